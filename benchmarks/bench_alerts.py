@@ -0,0 +1,127 @@
+"""Count SNS publishes for a flapping fleet with and without coalescing.
+
+Replays a day of per-minute inference invocations in which a handful of
+assets keep crossing the threshold, comparing one publish per anomalous
+asset and invocation with the AlertAggregator digest. A last run has the
+first publish fail, as a throttled SNS call would, and checks that the
+retried invocation still alerts every anomalous asset. Another alerts a
+new asset every minute and checks that only the alert times within the
+cooldown are kept. The script exits with status 1 if either check fails.
+
+Usage: python benchmarks/bench_alerts.py [--assets N] [--flapping N]
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(__file__), "..", "functions", "source", "InferenceFunction"
+    ),
+)
+
+from alert_digest import AlertAggregator  # noqa: E402
+from fakes import FakeSNS, ManualClock  # noqa: E402
+
+THRESHOLD = 1.7
+
+
+def invocations(num_assets, flapping, minutes, rows, seed=0):
+    """Yield ``{asset: scores}`` per simulated minute."""
+    rng = random.Random(seed)
+    for _ in range(minutes):
+        batch = {}
+        for a in range(num_assets):
+            high = a < flapping and rng.random() < 0.5
+            batch["asset-{:05d}".format(a)] = [
+                rng.uniform(1.6, 2.5) if high else rng.uniform(0.8, 1.3)
+                for _ in range(rows)
+            ]
+        yield batch
+
+
+def legacy(sns, batches):
+    for batch in batches:
+        for asset, scores in batch.items():
+            if any(score >= THRESHOLD for score in scores):
+                sns.publish(TopicArn="topic", Message=asset, Subject="alert")
+
+
+def coalesced(sns, batches, clock, cooldown, window):
+    aggregator = AlertAggregator(
+        sns, "topic", cooldown=cooldown, window=window, clock=clock
+    )
+    for batch in batches:
+        for asset, scores in batch.items():
+            aggregator.add(asset, scores, THRESHOLD)
+        aggregator.flush()
+        clock.advance(60)
+    aggregator.flush(force=True)
+
+
+def failed_publish_retried(cooldown):
+    """Return the assets a retry alerts after the first publish failed."""
+    sns = FakeSNS(failures=1)
+    aggregator = AlertAggregator(sns, "topic", cooldown=cooldown, clock=ManualClock())
+    aggregator.add("asset-00000", [2.0, 1.0], THRESHOLD)
+    aggregator.add("asset-00001", [1.9], THRESHOLD)
+    try:
+        aggregator.flush()
+    except Exception:
+        pass
+    aggregator.flush()
+    return [
+        asset
+        for asset in ("asset-00000", "asset-00001")
+        if any(asset in message["Message"] for message in sns.messages)
+    ]
+
+
+def alert_times_kept(cooldown, minutes):
+    """Return how many alert times are kept after alerting a new asset every
+    minute for ``minutes``."""
+    clock = ManualClock()
+    aggregator = AlertAggregator(FakeSNS(), "topic", cooldown=cooldown, clock=clock)
+    for minute in range(minutes):
+        aggregator.add("asset-{:05d}".format(minute), [2.0], THRESHOLD)
+        aggregator.flush()
+        clock.advance(60)
+    return len(aggregator.last_alerted)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--assets", type=int, default=200)
+    parser.add_argument("--flapping", type=int, default=10)
+    parser.add_argument("--minutes", type=int, default=1440)
+    parser.add_argument("--rows", type=int, default=5)
+    args = parser.parse_args()
+
+    def batches():
+        return invocations(args.assets, args.flapping, args.minutes, args.rows)
+
+    sns = FakeSNS()
+    legacy(sns, batches())
+    print("{:<34} {:>6} publishes".format("per asset and invocation", sns.calls))
+
+    for cooldown, window in ((0, 0), (3600, 0), (3600, 900)):
+        sns = FakeSNS()
+        coalesced(sns, batches(), ManualClock(), cooldown, window)
+        print(
+            "{:<34} {:>6} publishes".format(
+                "digest cooldown {}s window {}s".format(cooldown, window), sns.calls
+            )
+        )
+
+    alerted = failed_publish_retried(cooldown=3600)
+    print("{:<34} {:>6} of 2 assets".format("retry after failed publish", len(alerted)))
+    kept = alert_times_kept(cooldown=3600, minutes=args.minutes)
+    print("{:<34} {:>6} of {} assets".format("alert times kept", kept, args.minutes))
+    if len(alerted) != 2 or kept > 3600 // 60:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
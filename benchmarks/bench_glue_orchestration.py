@@ -0,0 +1,180 @@
+"""Simulate crawler/job runs against a fake Glue client.
+
+Drives GlueOrchestrator the way EventBridge would (daily start, state change
+events, 15 minute watchdog) over a simulated clock and reports the outcome
+of each scenario, the number of invocations and the time spent inside them,
+next to the idle time the old sleep-poll loop spent per run. A last scenario
+has the watchdog act on the state while a crawler event is being handled,
+which must start the job once. Every scenario checks its final status,
+attempts and number of crawls and jobs; the script exits with status 1
+when one does not match.
+
+Usage: python benchmarks/bench_glue_orchestration.py [--crawl-seconds N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(__file__), "..", "functions", "source", "StartGlueJobFunction"
+    ),
+)
+
+from fakes import FakeDynamoDB, FakeGlueClient, ManualClock  # noqa: E402
+from orchestrator import GlueOrchestrator, TableStateStore  # noqa: E402
+
+STEP = 60
+WATCHDOG_INTERVAL = 900
+POLL_TIMEOUT = 800
+
+
+def outcome(state, glue):
+    return {
+        "status": state["status"],
+        "attempts": state.get("attempts"),
+        "crawls": len(glue.crawls),
+        "jobs": len(glue.job_runs),
+    }
+
+
+def report(label, actual, expected, details=""):
+    """Print a scenario's outcome; return whether it is the expected one."""
+    mismatches = [
+        "{} {} != {}".format(name, actual[name], value)
+        for name, value in sorted(expected.items())
+        if actual[name] != value
+    ]
+    print(
+        "{:<16} {:<11} {:>2} attempts {:>3} crawls {:>3} jobs{} {}".format(
+            label,
+            actual["status"],
+            actual["attempts"],
+            actual["crawls"],
+            actual["jobs"],
+            details,
+            "UNEXPECTED " + ", ".join(mismatches) if mismatches else "ok",
+        )
+    )
+    return not mismatches
+
+
+def simulate(glue, clock, orchestrator, horizon):
+    invocations = 0
+    busy = 0.0
+
+    def invoke(action, *args):
+        nonlocal invocations, busy
+        invocations += 1
+        start = time.perf_counter()
+        state = action(*args)
+        busy += time.perf_counter() - start
+        return state
+
+    state = invoke(orchestrator.start_run)
+    for elapsed in range(STEP, horizon + STEP, STEP):
+        if state["status"] not in ("CRAWLING", "JOB_RUNNING"):
+            break
+        clock.advance(STEP)
+        for event in glue.events():
+            if event["detail-type"] == "Glue Crawler State Change":
+                state = invoke(orchestrator.on_crawler_event, event["detail"])
+            else:
+                state = invoke(orchestrator.on_job_event, event["detail"])
+        if elapsed % WATCHDOG_INTERVAL == 0:
+            state = invoke(orchestrator.check)
+    return state, invocations, busy
+
+
+class RacingStore(TableStateStore):
+    """Runs ``race`` once, right after the first ``load``."""
+
+    race = None
+
+    def load(self):
+        state = super().load()
+        race, self.race = self.race, None
+        if race is not None:
+            race()
+        return state
+
+
+def make_orchestrator(glue, dynamodb, clock, store_class=TableStateStore):
+    return GlueOrchestrator(
+        glue,
+        store_class(dynamodb, "state"),
+        "crawler",
+        "job",
+        crawl_timeout=1800,
+        job_timeout=7200,
+        max_attempts=3,
+        clock=clock,
+    )
+
+
+def run_race(crawl_seconds, expected):
+    clock = ManualClock()
+    glue = FakeGlueClient(clock, crawl_duration=crawl_seconds)
+    dynamodb = FakeDynamoDB({"state": ("name",)})
+    event_handler = make_orchestrator(glue, dynamodb, clock, RacingStore)
+    watchdog = make_orchestrator(glue, dynamodb, clock)
+    event_handler.start_run()
+    clock.advance(crawl_seconds)
+    (event,) = glue.events()
+    event_handler.store.race = watchdog.check
+    state = event_handler.on_crawler_event(event["detail"])
+    return report("watchdog race", outcome(state, glue), expected)
+
+
+def run(label, crawl_seconds, expected, **glue_options):
+    clock = ManualClock()
+    glue = FakeGlueClient(clock, crawl_duration=crawl_seconds, **glue_options)
+    dynamodb = FakeDynamoDB({"state": ("name",)})
+    orchestrator = make_orchestrator(glue, dynamodb, clock)
+    state, invocations, busy = simulate(glue, clock, orchestrator, 24 * 3600)
+    details = " {:>3} invocations {:>6.2f}ms busy (sleep-poll idle {}s)".format(
+        invocations, busy * 1000, min(crawl_seconds, POLL_TIMEOUT)
+    )
+    return report(label, outcome(state, glue), expected, details)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--crawl-seconds", type=int, default=420)
+    args = parser.parse_args()
+
+    succeeded = {"status": "SUCCEEDED", "attempts": 1, "crawls": 1, "jobs": 1}
+    results = [
+        run("happy path", args.crawl_seconds, succeeded),
+        run(
+            "crawl fails once",
+            args.crawl_seconds,
+            dict(succeeded, crawls=2),
+            failed_crawls=1,
+        ),
+        run(
+            "job fails once",
+            args.crawl_seconds,
+            dict(succeeded, attempts=2, jobs=2),
+            failed_jobs=1,
+        ),
+        run("missed event", args.crawl_seconds, succeeded, dropped_events={1}),
+        run(
+            "always failing",
+            args.crawl_seconds,
+            {"status": "FAILED", "attempts": 3, "crawls": 3, "jobs": 0},
+            failed_crawls=10,
+        ),
+        run_race(
+            args.crawl_seconds,
+            {"status": "JOB_RUNNING", "attempts": 1, "crawls": 1, "jobs": 1},
+        ),
+    ]
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
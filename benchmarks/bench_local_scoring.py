@@ -0,0 +1,84 @@
+"""Compare the in-process Random Cut Forest with the endpoint scoring path.
+
+The endpoint path runs against the local fake endpoint, so its numbers are
+only as realistic as --endpoint-latency. Requires NumPy.
+
+Usage: python benchmarks/bench_local_scoring.py [--assets N] [--rows N]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(__file__), "..", "functions", "source")
+sys.path.insert(0, os.path.join(ROOT, "InferenceFunction"))
+sys.path.insert(0, os.path.join(ROOT, "MLSharedLibraries", "python"))
+
+from fakes import FakeSageMakerRuntime  # noqa: E402
+from rcf_local import LocalRandomCutForest  # noqa: E402
+from scoring import LocalForestScorer, ScoringDispatcher  # noqa: E402
+
+NUM_OF_TREES = 50
+SAMPLES_PER_TREE = 5
+MEANS = [120.0, 1.0, 100.0, 90.0, 50.0]
+STDS = [2.0, 0.1, 5.0, 3.0, 5.0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--assets", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=60)
+    parser.add_argument("--endpoint-latency", type=float, default=0.03)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    training = rng.normal(MEANS, STDS, size=(50000, len(MEANS)))
+    start = time.perf_counter()
+    forest = LocalRandomCutForest.fit(
+        training, NUM_OF_TREES, SAMPLES_PER_TREE, seed=0
+    )
+    fit_s = time.perf_counter() - start
+    blob = forest.dumps()
+    start = time.perf_counter()
+    forest = LocalRandomCutForest.loads(blob)
+    load_s = time.perf_counter() - start
+    print(
+        "fit {:.3f}s, model {} bytes, load {:.4f}s".format(fit_s, len(blob), load_s)
+    )
+
+    feature_rows = {
+        "asset-{:05d}".format(a): rng.normal(MEANS, STDS, size=(args.rows, 5)).tolist()
+        for a in range(args.assets)
+    }
+    total_rows = args.assets * args.rows
+
+    scorers = [
+        ("local", LocalForestScorer(forest)),
+        (
+            "endpoint",
+            ScoringDispatcher(
+                FakeSageMakerRuntime(base_latency=args.endpoint_latency),
+                "fake",
+                payload_limit=64 * 1024,
+            ),
+        ),
+    ]
+    for label, scorer in scorers:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            scorer.score(feature_rows)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        print(
+            "{:<10} best {:>8.4f}s {:>12.0f} rows/s".format(
+                label, best, total_rows / best
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Verify a synthetic signed manifest per entry and with a shared verifier.
+
+Builds a signer certificate and a manifest of JWS-signed entries shaped like
+Microchip's, with a fraction of entries signed by the wrong key, then
+compares one ManifestItem per entry (the original per-entry setup) with
+verify_manifest.
+
+Requires cryptography and python-jose.
+
+Usage: python benchmarks/bench_manifest.py [--entries N]
+"""
+import argparse
+import base64
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(__file__), "..", "functions", "other", "UploadDeviceManifest"
+    ),
+)
+
+import jose.jws  # noqa: E402
+from cryptography import x509  # noqa: E402
+from cryptography.hazmat.backends import default_backend  # noqa: E402
+from cryptography.hazmat.primitives import hashes, serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import ec  # noqa: E402
+from cryptography.x509.oid import NameOID  # noqa: E402
+from jose.utils import base64url_encode  # noqa: E402
+from manifest import ManifestItem, verify_manifest  # noqa: E402
+
+
+def make_certificate(common_name, key, issuer_key=None):
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.datetime.utcnow()
+    return (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(
+            x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False
+        )
+        .sign(issuer_key or key, hashes.SHA256(), default_backend())
+    )
+
+
+def make_manifest(entries, bad_every=0):
+    signer_key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    signer_cert = make_certificate("manifest signer", signer_key)
+    wrong_key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    device_key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    device_der = make_certificate("device", device_key, signer_key).public_bytes(
+        serialization.Encoding.DER
+    )
+    headers = {
+        "kid": base64url_encode(
+            signer_cert.extensions.get_extension_for_class(
+                x509.SubjectKeyIdentifier
+            ).value.digest
+        ).decode("ascii"),
+        "x5t#S256": base64url_encode(
+            signer_cert.fingerprint(hashes.SHA256())
+        ).decode("ascii"),
+    }
+    pems = {}
+    for name, key in (("good", signer_key), ("bad", wrong_key)):
+        pems[name] = key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    manifest = []
+    for i in range(entries):
+        unique_id = "0123{:012x}".format(i)
+        payload = {
+            "uniqueId": unique_id,
+            "publicKeySet": {
+                "keys": [{"kty": "EC", "x5c": [base64.b64encode(device_der).decode()]}]
+            },
+        }
+        bad = bad_every and i % bad_every == 0
+        token = jose.jws.sign(
+            json.dumps(payload).encode("utf-8"),
+            pems["bad" if bad else "good"],
+            headers=headers,
+            algorithm="ES256",
+        )
+        protected, encoded_payload, signature = token.split(".")
+        manifest.append(
+            {
+                "header": {"uniqueId": unique_id},
+                "protected": protected,
+                "payload": encoded_payload,
+                "signature": signature,
+            }
+        )
+    return manifest, signer_cert
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--bad-every", type=int, default=1000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    manifest, signer_cert = make_manifest(args.entries, args.bad_every)
+    elapsed = time.perf_counter() - start
+    print("built {} entries in {:.1f}s".format(len(manifest), elapsed))
+    cert_pem = signer_cert.public_bytes(serialization.Encoding.PEM)
+
+    start = time.perf_counter()
+    verified = 0
+    for entry in manifest:
+        try:
+            ManifestItem(entry, signer_cert)
+            verified += 1
+        except Exception:
+            pass
+    elapsed = time.perf_counter() - start
+    print(
+        "{:<22} {:>8.2f}s {:>8.0f} entries/s {:>6} verified".format(
+            "per-entry setup", elapsed, len(manifest) / elapsed, verified
+        )
+    )
+
+    start = time.perf_counter()
+    results = verify_manifest(manifest, cert_pem)
+    elapsed = time.perf_counter() - start
+    errors = sum(1 for result in results if "error" in result)
+    print(
+        "{:<22} {:>8.2f}s {:>8.0f} entries/s {:>6} verified {} errors".format(
+            "verify_manifest",
+            elapsed,
+            len(manifest) / elapsed,
+            len(results) - errors,
+            errors,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
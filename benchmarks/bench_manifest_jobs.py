@@ -0,0 +1,152 @@
+"""Import a staged manifest as a job, interrupting and resuming it.
+
+Compares the peak Python memory of loading the whole manifest with
+``json.loads`` against streaming it through ``run_manifest_job``, whose
+worker is made to fail part-way through; the rerun resumes from the last
+checkpoint. A last run checks that a second worker invoked while the job
+is leased exits without provisioning anything, and the script exits with
+status 1 if it does not. S3, IoT and DynamoDB are in-memory stand-ins.
+
+Requires cryptography and python-jose.
+
+Usage: python benchmarks/bench_manifest_jobs.py [--entries N] [--batch-size N]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from bench_manifest import make_manifest
+from cryptography.hazmat.primitives import serialization
+from fakes import FakeDynamoDB, FakeS3
+
+FUNCTIONS = os.path.join(os.path.dirname(__file__), "..", "functions")
+sys.path.insert(0, os.path.join(FUNCTIONS, "other", "UploadDeviceManifest"))
+sys.path.insert(0, os.path.join(FUNCTIONS, "source", "SharedLibraries", "python"))
+
+from jobs import JobLease, LeaseLost, ManifestJobStore, run_manifest_job  # noqa: E402
+from provisioning import DEFAULT_RATE_LIMITS, BulkProvisioner  # noqa: E402
+
+
+class FailingS3(FakeS3):
+    """Fails the ``fail_at``-th ``put_object``, as a crashed worker would."""
+
+    def __init__(self, fail_at):
+        super().__init__()
+        self.fail_at = fail_at
+        self.puts = 0
+
+    def put_object(self, **kwargs):
+        self.puts += 1
+        if self.puts == self.fail_at:
+            raise RuntimeError("worker crashed")
+        return super().put_object(**kwargs)
+
+
+class CountingIoT:
+    """Accepts every IoT call and only counts things, so the fake's own
+    bookkeeping does not show up in the memory peaks."""
+
+    def __init__(self):
+        self.things = 0
+
+    def register_certificate_without_ca(self, certificatePem, status="INACTIVE"):
+        return {"certificateArn": "arn:cert", "certificateId": "0" * 64}
+
+    def create_thing(self, thingName):
+        self.things += 1
+        return {"thingName": thingName}
+
+    def __getattr__(self, api):
+        return lambda **kwargs: {}
+
+
+def peak(function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function()
+    finally:
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, time.perf_counter() - start, peak_bytes / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args()
+
+    entries, signer_cert = make_manifest(args.entries, bad_every=1000)
+    body = json.dumps(entries).encode("utf-8")
+    del entries
+    cert_pem = signer_cert.public_bytes(serialization.Encoding.PEM)
+    print("manifest: {} entries, {:.1f} MiB".format(args.entries, len(body) / 2 ** 20))
+
+    _, elapsed, mib = peak(lambda: len(json.loads(body)))
+    print("{:<12} {:>7.2f}s peak {:>7.1f} MiB".format("json.loads", elapsed, mib))
+
+    # Puts: queued status, manifest, running status, then one per batch.
+    batches = -(-args.entries // args.batch_size)
+    store = ManifestJobStore(FailingS3(fail_at=3 + batches // 2 + 1), "bucket")
+    job_id = store.create(body)["jobId"]
+    del body
+    iot = CountingIoT()
+    unlimited = {api: 1e6 for api in DEFAULT_RATE_LIMITS}
+    provisioner = BulkProvisioner(iot, "policy", rate_limits=unlimited)
+
+    def first_run():
+        try:
+            run_manifest_job(store, job_id, cert_pem, provisioner, args.batch_size)
+        except RuntimeError as error:
+            return error
+
+    error, elapsed, mib = peak(first_run)
+    job = store.load(job_id)
+    print(
+        "{:<12} {:>7.2f}s peak {:>7.1f} MiB  {} after {} entries".format(
+            "first run", elapsed, mib, error, job["entries"]
+        )
+    )
+    job, elapsed, mib = peak(
+        lambda: run_manifest_job(store, job_id, cert_pem, provisioner, args.batch_size)
+    )
+    print(
+        "{:<12} {:>7.2f}s peak {:>7.1f} MiB  {status}: {entries} entries, "
+        "{provisioned} provisioned, {rejected} rejected, {failed} failed".format(
+            "resumed", elapsed, mib, **job
+        )
+    )
+    print("things registered: {}".format(iot.things))
+
+    if not duplicate_worker_exits(cert_pem, unlimited):
+        sys.exit(1)
+
+
+def duplicate_worker_exits(cert_pem, rate_limits):
+    """Run a job whose lease another worker holds; it must not be touched."""
+    entries, _ = make_manifest(10)
+    store = ManifestJobStore(FakeS3(), "bucket")
+    job_id = store.create(json.dumps(entries).encode("utf-8"))["jobId"]
+    dynamodb = FakeDynamoDB({"leases": ("jobId",)})
+    JobLease(dynamodb, "leases", holder="first").claim(job_id)
+    iot = CountingIoT()
+    provisioner = BulkProvisioner(iot, "policy", rate_limits=rate_limits)
+    try:
+        run_manifest_job(
+            store, job_id, cert_pem, provisioner, lease=JobLease(dynamodb, "leases")
+        )
+        outcome = "ran"
+    except LeaseLost:
+        outcome = "exited"
+    untouched = outcome == "exited" and iot.things == 0
+    untouched = untouched and store.load(job_id)["status"] == "QUEUED"
+    print("duplicate worker: {}, {} things registered".format(outcome, iot.things))
+    return untouched
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""End-to-end benchmark of the pipeline on synthetic ConnectSense telemetry.
+
+--cords cords each report the five power features --rate times per second
+for --seconds seconds. The data runs through the Lambda handlers, which
+are imported with local fakes in place of their boto3 clients:
+
+  transform     Firehose transformation, one call per --buffer-seconds
+  inference     inference on each archive object the transform produced
+  alerts        ProcessAlerts batches of the watts readings the IoT rule
+                forwards (SQS batches of 100)
+  glue          scheduled crawl and ETL runs driven by their Glue events
+  provisioning  manifest import, if cryptography and python-jose are
+                installed (--manifest-devices 0 skips it)
+  training      training data sampling, if pyarrow is installed
+
+For every stage the suite reports throughput, p50/p99 call latency and
+the peak memory allocated during one call, followed by the time the
+handlers' own metrics attribute to each of their stages. Requires boto3
+and NumPy.
+--json writes the same numbers to a file for comparing runs.
+
+Usage: python benchmarks/bench_pipeline.py [--cords N] [--rate N] [--seconds N]
+"""
+import argparse
+import io
+import json
+import time
+
+import numpy as np
+
+from fakes import (
+    FakeDynamoDB,
+    FakeGlueClient,
+    FakeIoT,
+    FakeS3,
+    FakeSageMaker,
+    FakeSageMakerRuntime,
+    FakeSiteWise,
+    FakeSNS,
+    FakeSQS,
+    FakeSSM,
+)
+from harness import MetricsSink, format_table, load_function, run_stage
+from telemetry import (
+    ASSET_MODEL_ID,
+    PROPERTIES,
+    TelemetryGenerator,
+    archive_objects,
+    s3_event,
+    sqs_batches,
+)
+
+ARCHIVE_BUCKET = "archive-bucket"
+MODEL_BUCKET = "model-bucket"
+MODEL_PREFIX = "model"
+THRESHOLD_PARAM = "/connectsense/threshold"
+GLUE_STATE_TABLE = "glue-run-state"
+TOPIC_ARN = "arn:aws:sns:us-east-1:123456789012:alerts"
+
+
+def bench_transform(args, generator, s3):
+    sitewise = FakeSiteWise(*generator.sitewise_models())
+    module = load_function(
+        "TransformationHandler",
+        "transformation_lambda",
+        {"iotsitewise": sitewise},
+        {
+            "ASSET_MODEL_ID": ASSET_MODEL_ID,
+            "PARTITION_ARCHIVE": "true" if args.partitioned else "false",
+            "WIDE_ROWS": "true" if args.wide_rows else "false",
+        },
+    )
+    metrics = MetricsSink(module)
+    keys = []
+
+    def store(output):
+        name = "object-{:05d}".format(len(keys))
+        for key, body in archive_objects(output, name=name).items():
+            s3.put_object(Bucket=ARCHIVE_BUCKET, Key=key, Body=body)
+            keys.append(key)
+
+    invocations = (
+        (lambda event=event: module.handler(event, None), len(event["records"]))
+        for event in generator.firehose_events(args.seconds, args.buffer_seconds)
+    )
+    result = run_stage("transform", invocations, sink=store, trace_memory=args.memory)
+    result.stage_ms = metrics.stage_ms()
+    result.notes = "{} archive objects, {:.1f} MiB, {} SiteWise calls".format(
+        len(keys),
+        sum(len(s3.objects[(ARCHIVE_BUCKET, key)]) for key in keys) / 2 ** 20,
+        sitewise.calls,
+    )
+    return result, keys
+
+
+def train_local_model(generator, s3, shingle_size):
+    """Fit the local forest on a minute of telemetry, shingled like the
+    inference input, and return a threshold scoring 0.1% of it anomalous."""
+    from rcf_local import MODEL_FILE_NAME, LocalRandomCutForest
+
+    history = {}
+    rows = []
+    for asset_id, _, _, values in generator.readings(0, 60):
+        window = history.setdefault(asset_id, [])
+        window.append([values[p[0]] for p in PROPERTIES])
+        if len(window) == shingle_size:
+            rows.append([value for row in window for value in row])
+            window.pop(0)
+    rows = np.array(rows, dtype=float)
+    forest = LocalRandomCutForest.fit(rows, 50, 5, seed=0)
+    s3.put_object(
+        Bucket=MODEL_BUCKET,
+        Key="{}/{}".format(MODEL_PREFIX, MODEL_FILE_NAME),
+        Body=forest.dumps(),
+    )
+    return float(np.quantile(forest.score(rows), 0.999))
+
+
+def bench_inference(args, generator, s3, keys):
+    runtime = FakeSageMakerRuntime(base_latency=args.endpoint_latency)
+    sns = FakeSNS()
+    clients = {
+        "runtime.sagemaker": runtime,
+        "sagemaker": FakeSageMaker(),
+        "ssm": FakeSSM(),
+        "sns": sns,
+        "s3": s3,
+    }
+    module = load_function(
+        "InferenceFunction",
+        "inference_lambda",
+        clients,
+        {
+            "PARAM_NAME": THRESHOLD_PARAM,
+            "TOPIC_ARN": TOPIC_ARN,
+            "SCORING_ENGINE": args.engine,
+            "MODEL_BUCKET": MODEL_BUCKET,
+            "MODEL_OUTPUT_PREFIX": MODEL_PREFIX,
+            "SHINGLE_SIZE": str(args.shingle_size),
+        },
+    )
+    metrics = MetricsSink(module)
+    threshold = 1.95
+    if args.engine == "local":
+        threshold = train_local_model(generator, s3, args.shingle_size)
+    clients["ssm"].parameters[THRESHOLD_PARAM] = str(threshold)
+
+    def invocation(key):
+        body = s3.objects[(ARCHIVE_BUCKET, key)]
+        event = s3_event(ARCHIVE_BUCKET, [key])
+        return (lambda: module.handler(event, None)), body.count(b"\n")
+
+    result = run_stage(
+        "inference", (invocation(key) for key in keys), trace_memory=args.memory
+    )
+    result.stage_ms = metrics.stage_ms()
+    result.notes = "{} engine, {} endpoint calls, {} digests".format(
+        args.engine, runtime.calls, sns.calls
+    )
+    return result
+
+
+def bench_alerts(args, generator):
+    sns = FakeSNS()
+    sqs = FakeSQS()
+    module = load_function(
+        "ProcessAlerts",
+        "alerts",
+        {"sns": sns, "sqs": sqs},
+        {"TOPIC_ARN": TOPIC_ARN, "PUBLISH_RATE": "1000", "PUBLISH_BURST": "1000"},
+    )
+    metrics = MetricsSink(module)
+    invocations = (
+        (
+            lambda event=event: module.process_alert_batch(event, None),
+            len(event["Records"]),
+        )
+        for event in sqs_batches(generator.alert_readings(args.seconds))
+    )
+    result = run_stage("alerts", invocations, trace_memory=args.memory)
+    result.stage_ms = metrics.stage_ms()
+    result.notes = "{} digests, {} records deferred".format(
+        sns.calls, len(sqs.visibility)
+    )
+    return result
+
+
+def bench_glue(args, s3):
+    glue = FakeGlueClient(time.time, crawl_duration=0, job_duration=0)
+    dynamodb = FakeDynamoDB({GLUE_STATE_TABLE: ("name",)})
+    module = load_function(
+        "StartGlueJobFunction",
+        "glue_trigger_lambda",
+        {"dynamodb": dynamodb, "glue": glue, "s3": s3},
+        {
+            "JOB_NAME": glue.job_name,
+            "CRAWLER_NAME": glue.crawler_name,
+            "ARCHIVE_BUCKET": ARCHIVE_BUCKET,
+            "DATABASE_NAME": "connectsense",
+            "TABLE_NAME": "archive",
+            "STATE_TABLE_NAME": GLUE_STATE_TABLE,
+        },
+    )
+    metrics = MetricsSink(module)
+
+    def one_run():
+        state = module.handler({"detail-type": "Scheduled Event"}, None)
+        for _ in range(2):
+            for event in glue.events():
+                state = module.handler(event, None)
+        return state
+
+    result = run_stage(
+        "glue", ((one_run, 1) for _ in range(args.glue_runs)), trace_memory=args.memory
+    )
+    result.stage_ms = metrics.stage_ms()
+    result.notes = "{} Glue calls, {} DynamoDB calls".format(
+        glue.calls, dynamodb.calls
+    )
+    return result
+
+
+def bench_provisioning(args):
+    try:
+        from bench_manifest import make_manifest
+        from cryptography.hazmat.primitives import serialization
+    except ImportError as error:
+        return None, str(error)
+
+    iot = FakeIoT(latency=args.iot_latency)
+    module = load_function(
+        "UploadDeviceManifest",
+        "api",
+        {"iot": iot, "s3": FakeS3(), "lambda": None, "dynamodb": FakeDynamoDB({})},
+        {"DEVICE_POLICY": "device-policy"},
+    )
+    manifest, signer_cert = make_manifest(args.manifest_devices)
+    cert_pem = signer_cert.public_bytes(serialization.Encoding.PEM)
+    metrics = MetricsSink(module)
+
+    def upload():
+        with module.metrics.invocation():
+            return module._invoke_import_manifest("device-policy", manifest, cert_pem)
+
+    result = run_stage(
+        "provisioning", [(upload, len(manifest))], trace_memory=args.memory
+    )
+    result.stage_ms = metrics.stage_ms()
+    result.notes = "{} IoT calls, {} throttled".format(
+        sum(iot.calls.values()), iot.throttled
+    )
+    return result, None
+
+
+def bench_training(args, generator, s3):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as error:
+        return None, str(error)
+
+    names = [p[1] for p in PROPERTIES]
+    columns = {name: [] for name in names}
+    for _, _, _, values in generator.readings(0, args.seconds):
+        for prop in PROPERTIES:
+            columns[prop[1]].append(float(values[prop[0]]))
+    buffer = io.BytesIO()
+    pq.write_table(pa.table(columns), buffer)
+    s3.put_object(
+        Bucket=ARCHIVE_BUCKET, Key="combined/part-0.parquet", Body=buffer.getvalue()
+    )
+    module = load_function("StartMLTrainingDeploymentFunction", "training_data", {})
+    seen = []
+    result = run_stage(
+        "training",
+        [
+            (
+                lambda: module.load_sample(
+                    s3, ARCHIVE_BUCKET, "combined/", names, 100000, seed=0
+                ),
+                len(columns["watts"]),
+            )
+        ],
+        sink=lambda sample: seen.append(sample[1]),
+        trace_memory=args.memory,
+    )
+    result.notes = "{} rows seen".format(seen[0])
+    return result, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cords", type=int, default=100)
+    parser.add_argument("--rate", type=int, default=1)
+    parser.add_argument("--seconds", type=int, default=120)
+    parser.add_argument("--buffer-seconds", type=int, default=10)
+    parser.add_argument("--anomaly-rate", type=float, default=0.001)
+    parser.add_argument("--partitioned", action="store_true")
+    parser.add_argument(
+        "--wide-rows", action="store_true", help="archive wide rows from the transform"
+    )
+    parser.add_argument("--engine", choices=("endpoint", "local"), default="endpoint")
+    parser.add_argument("--endpoint-latency", type=float, default=0.02)
+    parser.add_argument("--shingle-size", type=int, default=1)
+    parser.add_argument("--glue-runs", type=int, default=20)
+    parser.add_argument("--manifest-devices", type=int, default=50)
+    parser.add_argument("--iot-latency", type=float, default=0.01)
+    parser.add_argument(
+        "--no-memory",
+        dest="memory",
+        action="store_false",
+        help="do not trace memory; latencies are lower without tracing",
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    generator = TelemetryGenerator(args.cords, args.rate, args.anomaly_rate)
+    s3 = FakeS3()
+    results = []
+    skipped = []
+
+    transform, keys = bench_transform(args, generator, s3)
+    results.append(transform)
+    results.append(bench_inference(args, generator, s3, keys))
+    results.append(bench_alerts(args, generator))
+    results.append(bench_glue(args, s3))
+    optional = [("training", lambda: bench_training(args, generator, s3))]
+    if args.manifest_devices:
+        optional.insert(0, ("provisioning", lambda: bench_provisioning(args)))
+    for name, bench in optional:
+        result, reason = bench()
+        if result is None:
+            skipped.append("{}: skipped, {}".format(name, reason))
+        else:
+            results.append(result)
+
+    print(
+        "{} cords x {} readings/s x {} s, memory {}".format(
+            args.cords,
+            args.rate,
+            args.seconds,
+            "traced" if args.memory else "not traced",
+        )
+    )
+    print(format_table(results))
+    for line in skipped:
+        print(line)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(
+                {
+                    "arguments": vars(args),
+                    "stages": [result.summary() for result in results],
+                },
+                output,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Compare the inference pivot stage with the original nested-scan loop.
+
+Usage: python benchmarks/bench_pivot.py [--readings N] [--fleet 10,50,200]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(__file__), "..", "functions", "source", "InferenceFunction"
+    ),
+)
+
+from pivot import FEATURES, pivot_readings  # noqa: E402
+
+
+def make_documents(num_assets, readings_per_asset, seed=0):
+    """Build archive documents shaped like the transformation handler output."""
+    rng = random.Random(seed)
+    documents = []
+    for a in range(num_assets):
+        asset_id = "asset-{:05d}".format(a)
+        for name in FEATURES:
+            values = [
+                {
+                    "timestamp": "20211001{:06d}".format(t),
+                    "quality": "GOOD",
+                    "value": rng.uniform(0, 240),
+                }
+                for t in range(readings_per_asset)
+            ]
+            documents.append({"name": name, "asset_id": asset_id, "values": values})
+    return documents
+
+
+def legacy_pivot(documents):
+    """The assets x timestamps x readings loop the handler used to run."""
+    lists = {name: [] for name in FEATURES}
+    timestamps = []
+    asset_ids = []
+    for data in documents:
+        property_name = data["name"]
+        asset_ids.append(data["asset_id"])
+        for v in data["values"]:
+            timestamps.append(v["timestamp"])
+            lists[property_name.lower()].append(
+                {
+                    property_name: v["value"],
+                    "timestamp": v["timestamp"],
+                    "asset_id": data["asset_id"],
+                }
+            )
+    timestamps = list(set(timestamps))
+    feature_rows = {}
+    for asset in set(asset_ids):
+        final_list = []
+        for t in timestamps:
+            packet = {}
+            for name in FEATURES:
+                for v in lists[name]:
+                    if v["timestamp"] == t and v["asset_id"] == asset:
+                        packet[name] = v[name]
+                        break
+            if len(packet) == len(FEATURES):
+                final_list.append(packet)
+        feature_rows[asset] = final_list
+    return feature_rows
+
+
+def timed(fn, documents):
+    start = time.perf_counter()
+    fn(documents)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readings", type=int, default=10)
+    parser.add_argument("--fleet", default="10,25,50,100,200")
+    parser.add_argument(
+        "--legacy-limit",
+        type=int,
+        default=100,
+        help="skip the legacy loop above this many assets",
+    )
+    args = parser.parse_args()
+
+    print(
+        "{:>8} {:>10} {:>12} {:>12} {:>9}".format(
+            "assets", "readings", "legacy_s", "pivot_s", "speedup"
+        )
+    )
+    for num_assets in [int(n) for n in args.fleet.split(",")]:
+        documents = make_documents(num_assets, args.readings)
+        readings = num_assets * args.readings * len(FEATURES)
+        pivot_s = timed(pivot_readings, documents)
+        if num_assets <= args.legacy_limit:
+            legacy_s = timed(legacy_pivot, documents)
+            speedup = "{:.0f}x".format(legacy_s / pivot_s)
+            legacy = "{:.4f}".format(legacy_s)
+        else:
+            legacy, speedup = "-", "-"
+        print(
+            "{:>8} {:>10} {:>12} {:>12.4f} {:>9}".format(
+                num_assets, readings, legacy, pivot_s, speedup
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Provision devices against a fake IoT registry, serially and in bulk.
+
+The fake enforces per-API TPS quotas (scaled by --tps-scale so runs stay
+short) and adds a fixed latency per call. The serial run mirrors the
+original one-device-at-a-time loop; the bulk run uses BulkProvisioner.
+
+With a provisioning index, a first upload where some things cannot be
+created is retried, then the whole manifest is uploaded again: the retry
+only redoes the missing steps and the re-upload makes no IoT calls.
+
+Usage: python benchmarks/bench_provisioning.py [--devices N] [--workers N]
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(__file__), "..", "functions", "other", "UploadDeviceManifest"
+    ),
+)
+
+from fakes import FakeDynamoDB, FakeIoT  # noqa: E402
+from provisioning import (  # noqa: E402
+    DEFAULT_RATE_LIMITS,
+    BulkProvisioner,
+    ProvisioningIndex,
+)
+
+
+def fake_pem(number):
+    der = number.to_bytes(8, "big") * 32
+    return "-----BEGIN CERTIFICATE-----\n{}\n-----END CERTIFICATE-----\n".format(
+        base64.b64encode(der).decode("ascii")
+    )
+
+
+def serial(iot, devices):
+    for unique_id, pem in devices:
+        response = iot.register_certificate_without_ca(certificatePem=pem)
+        iot.attach_policy(policyName="policy", target=response["certificateArn"])
+        iot.update_certificate(
+            certificateId=response["certificateId"], newStatus="ACTIVE"
+        )
+        iot.create_thing(thingName="CS-CORD-DK-" + unique_id)
+        iot.attach_thing_principal(
+            thingName="CS-CORD-DK-" + unique_id, principal=response["certificateArn"]
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--tps-scale", type=float, default=4.0)
+    args = parser.parse_args()
+
+    quotas = {api: rate * args.tps_scale for api, rate in DEFAULT_RATE_LIMITS.items()}
+    devices = [("{:016x}".format(i), fake_pem(i)) for i in range(args.devices)]
+
+    def report(name, iot, elapsed, extra):
+        print(
+            "{:<10} {:>7.2f}s {:>5} things {:>5} calls {:>4} throttled  {}".format(
+                name,
+                elapsed,
+                len(iot.things),
+                sum(iot.calls.values()),
+                iot.throttled,
+                extra,
+            )
+        )
+
+    iot = FakeIoT(latency=args.latency, quotas=quotas)
+    start = time.perf_counter()
+    try:
+        serial(iot, devices)
+        outcome = "ok"
+    except Exception as error:
+        outcome = "aborted: {}".format(error)
+    report("serial", iot, time.perf_counter() - start, outcome)
+
+    def run(name, iot, index=None):
+        provisioner = BulkProvisioner(
+            iot, "policy", max_workers=args.workers, rate_limits=quotas, index=index
+        )
+        before = sum(iot.calls.values())
+        iot.throttled = 0
+        start = time.perf_counter()
+        reports = provisioner.provision(devices)
+        elapsed = time.perf_counter() - start
+        failed = sum(1 for r in reports if r["status"] != "provisioned")
+        skipped = sum(1 for r in reports if r.get("skipped"))
+        iot.calls = {"total": sum(iot.calls.values()) - before}
+        report(name, iot, elapsed, "{} failed {} skipped".format(failed, skipped))
+
+    run("bulk", FakeIoT(latency=args.latency, quotas=quotas))
+
+    index = ProvisioningIndex(
+        FakeDynamoDB({"index": ("uniqueId", "fingerprint")}), "index"
+    )
+    broken = ["CS-CORD-DK-" + unique_id for unique_id, _ in devices[::10]]
+    iot = FakeIoT(latency=args.latency, quotas=quotas, fail_things=broken)
+    run("indexed", iot, index)
+    iot.fail_things = set()
+    run("retry", iot, index)
+    run("re-upload", iot, index)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Measure endpoint scoring throughput against a local fake endpoint.
+
+Compares one sequential whole-CSV call per asset with the bounded-pool
+ScoringDispatcher.
+
+Usage: python benchmarks/bench_scoring.py [--assets N] [--rows N] [--workers N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(__file__), "..", "functions", "source", "InferenceFunction"
+    ),
+)
+
+from fakes import FakeSageMakerRuntime  # noqa: E402
+from scoring import ScoringDispatcher  # noqa: E402
+
+
+def make_feature_rows(num_assets, rows_per_asset, seed=0):
+    rng = random.Random(seed)
+    return {
+        "asset-{:05d}".format(a): [
+            [round(rng.uniform(0, 240), 3) for _ in range(5)]
+            for _ in range(rows_per_asset)
+        ]
+        for a in range(num_assets)
+    }
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(label, dispatcher, endpoint, feature_rows):
+    total_rows = sum(len(rows) for rows in feature_rows.values())
+    start = time.perf_counter()
+    scores = dispatcher.score(feature_rows)
+    elapsed = time.perf_counter() - start
+    assert sum(len(s) for s in scores.values()) == total_rows
+    print(
+        "{:<12} {:>8.3f}s {:>10.0f} rows/s {:>6} calls {:>5} throttled "
+        "p50 {:>6.1f}ms p99 {:>6.1f}ms".format(
+            label,
+            elapsed,
+            total_rows / elapsed,
+            endpoint.calls,
+            endpoint.throttled,
+            percentile(endpoint.latencies, 50) * 1000,
+            percentile(endpoint.latencies, 99) * 1000,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--assets", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=60)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--payload-limit", type=int, default=64 * 1024)
+    parser.add_argument("--throttle-rate", type=float, default=0.02)
+    args = parser.parse_args()
+
+    feature_rows = make_feature_rows(args.assets, args.rows)
+
+    endpoint = FakeSageMakerRuntime(throttle_rate=args.throttle_rate)
+    sequential = ScoringDispatcher(
+        endpoint, "fake", payload_limit=2 ** 31, max_workers=1, backoff_base=0.01
+    )
+    run("sequential", sequential, endpoint, feature_rows)
+
+    endpoint = FakeSageMakerRuntime(throttle_rate=args.throttle_rate)
+    pooled = ScoringDispatcher(
+        endpoint,
+        "fake",
+        payload_limit=args.payload_limit,
+        max_workers=args.workers,
+        backoff_base=0.01,
+    )
+    run("dispatcher", pooled, endpoint, feature_rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Peak memory of the training function at its configured maximum sample.
+
+Fills the sampler with --sample-size shingled rows (--shingle-size rows of
+the five features each) and traces what combining and summarizing them
+allocates on top of the sample, the steps the handler runs before deciding
+whether to train. The sample plus that peak, plus --runtime-mib for the
+interpreter and its imports, must fit in the function's --memory-mib.
+--check exits with status 1 when it does not. Requires NumPy and pyarrow.
+
+Usage: python benchmarks/bench_training_memory.py [--shingle-size N] [--check]
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from harness import load_function
+
+FUNCTION = "StartMLTrainingDeploymentFunction"
+FEATURES = ("volts", "amps", "watts", "power_factor", "watt_hours")
+BATCH_ROWS = 65536
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sample-size", type=int, default=1000000)
+    parser.add_argument("--shingle-size", type=int, default=4)
+    parser.add_argument("--strata", type=int, default=1)
+    parser.add_argument("--memory-mib", type=int, default=512)
+    parser.add_argument("--runtime-mib", type=int, default=150)
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    training_data = load_function(FUNCTION, "training_data", {})
+    training_gate = load_function(FUNCTION, "training_gate", {})
+    width = len(FEATURES) * args.shingle_size
+    rng = np.random.default_rng(0)
+    sampler = training_data.StratifiedSample(
+        args.sample_size, width, list(range(args.strata)), rng
+    )
+    for stratum in range(args.strata):
+        for _ in range(0, args.sample_size // args.strata, BATCH_ROWS):
+            sampler.add(rng.random((BATCH_ROWS, width), dtype=np.float32), stratum)
+    samples = sampler.samples()
+    sample_bytes = sum(sample.nbytes for sample in samples.values())
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    combined = training_data.combine(samples, width)
+    training_gate.summarize(combined, FEATURES)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    total = sample_bytes / 2 ** 20 + peak / 2 ** 20 + args.runtime_mib
+    print(
+        "{} rows x {} columns in {} strata: sample {:.0f} MiB, combine and "
+        "summarize peak {:.0f} MiB in {:.2f} s, total with runtime {:.0f} of "
+        "{} MiB".format(
+            len(combined),
+            width,
+            args.strata,
+            sample_bytes / 2 ** 20,
+            peak / 2 ** 20,
+            elapsed,
+            total,
+            args.memory_mib,
+        )
+    )
+    if args.check and total > args.memory_mib:
+        print("OVER BUDGET")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
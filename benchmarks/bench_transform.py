@@ -0,0 +1,157 @@
+"""Micro-benchmark of the Firehose transformation on synthetic SiteWise records.
+
+Compares transform_batch with the original per-record loop.
+
+Usage: python benchmarks/bench_transform.py [--assets N] [--values N]
+"""
+import argparse
+import base64
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(__file__), "..", "functions", "source", "TransformationHandler"
+    ),
+)
+
+from batch_transform import transform_batch  # noqa: E402
+from fakes import FakeSiteWise  # noqa: E402
+from property_index import PropertyIndex  # noqa: E402
+
+MODEL_ID = "power-cord-asset-model"
+PROPERTIES = [
+    ("prop-volts", "volts", "DOUBLE"),
+    ("prop-amps", "amps", "DOUBLE"),
+    ("prop-watts", "watts", "DOUBLE"),
+    ("prop-power-factor", "power_factor", "INTEGER"),
+    ("prop-watt-hours", "watt_hours", "DOUBLE"),
+]
+
+
+def make_event(num_assets, values_per_record, seed=0):
+    """One Firehose record per asset property notification."""
+    rng = random.Random(seed)
+    base = 1633046400
+    records = []
+    for a in range(num_assets):
+        for property_id, name, data_type in PROPERTIES:
+            value_key = data_type.lower() + "Value"
+            values = []
+            for i in range(values_per_record):
+                value = rng.uniform(-5, 240)
+                if data_type == "INTEGER":
+                    value = int(value)
+                values.append(
+                    {
+                        "timestamp": {"timeInSeconds": base + i, "offsetInNanos": 0},
+                        "quality": "GOOD",
+                        "value": {value_key: value},
+                    }
+                )
+            notification = {
+                "type": "PropertyValueUpdate",
+                "payload": {
+                    "assetId": "asset-{:05d}".format(a),
+                    "propertyId": property_id,
+                    "values": values,
+                },
+            }
+            records.append(
+                {
+                    "recordId": "{}-{}".format(a, property_id),
+                    "data": base64.b64encode(
+                        json.dumps(notification).encode("utf-8")
+                    ).decode("utf-8"),
+                }
+            )
+    return {"records": records}
+
+
+def legacy_transform(event, asset_model_properties):
+    """The per-record loop the handler used to run."""
+    output = []
+    for record in event["records"]:
+        record_data = json.loads(base64.b64decode(record["data"]))
+        payload = record_data["payload"]
+        property_id = payload["propertyId"]
+        for prop in asset_model_properties:
+            if prop["id"] == property_id:
+                property_name = prop["name"]
+                property_type = prop["dataType"]
+                break
+        output_record_data = {
+            "name": property_name,
+            "property_id": property_id,
+            "property_type": property_type,
+            "asset_id": payload["assetId"],
+            "values": [],
+        }
+        for value in payload["values"]:
+            value_key = "{}Value".format(property_type.lower())
+            output_record_data["values"].append(
+                {
+                    "timestamp": datetime.datetime.fromtimestamp(
+                        value["timestamp"]["timeInSeconds"]
+                    ).strftime("%Y%m%d%H%M%S"),
+                    "quality": value["quality"],
+                    "value": value["value"][value_key],
+                }
+            )
+        for accrued_value in output_record_data["values"]:
+            if float(accrued_value["value"]) < 0:
+                output_record_data["values"].remove(accrued_value)
+        output.append(
+            {
+                "recordId": record["recordId"],
+                "result": "Ok",
+                "data": base64.b64encode(
+                    json.dumps(output_record_data).encode("utf-8")
+                ).decode("utf-8"),
+            }
+        )
+    return {"records": output}
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--assets", type=int, default=200)
+    parser.add_argument("--values", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    event = make_event(args.assets, args.values)
+    sitewise = FakeSiteWise(
+        {MODEL_ID: PROPERTIES},
+        {"asset-{:05d}".format(a): MODEL_ID for a in range(args.assets)},
+    )
+    index = PropertyIndex(sitewise, ttl=300)
+    index.load_model(MODEL_ID)
+    model_properties = sitewise.describe_asset_model(MODEL_ID)["assetModelProperties"]
+
+    records = len(event["records"])
+    legacy_s = best_of(args.repeat, lambda: legacy_transform(event, model_properties))
+    batch_s = best_of(args.repeat, lambda: transform_batch(event["records"], index))
+    _, stats = transform_batch(event["records"], index)
+    print("records {}, values {}".format(records, records * args.values))
+    print("legacy   {:.4f}s {:>10.0f} records/s".format(legacy_s, records / legacy_s))
+    print("batch    {:.4f}s {:>10.0f} records/s".format(batch_s, records / batch_s))
+    print("stats    {}".format(json.dumps(stats)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Count rows scored when readings are split across archive objects.
+
+Firehose flushes by size and time, so one row's five readings can land in
+two objects. Compares pivoting each object on its own with stitching rows
+through the WindowStore.
+
+Usage: python benchmarks/bench_windows.py [--objects N] [--shingle N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(__file__), "..", "functions", "source", "InferenceFunction"
+    ),
+)
+
+from bench_pivot import make_documents  # noqa: E402
+from pivot import index_readings, pivot_readings  # noqa: E402
+from window_store import WindowStore  # noqa: E402
+
+
+def split_objects(documents, num_objects, seed=0):
+    """Scatter every reading into one of ``num_objects`` consecutive objects,
+    keeping readings roughly in arrival (timestamp) order."""
+    rng = random.Random(seed)
+    readings = [
+        (value["timestamp"], document["name"], document["asset_id"], value)
+        for document in documents
+        for value in document["values"]
+    ]
+    readings.sort(key=lambda reading: reading[0])
+    per_object = len(readings) / num_objects
+    objects = [[] for _ in range(num_objects)]
+    for position, (_, name, asset_id, value) in enumerate(readings):
+        jitter = rng.uniform(-0.5, 0.5) * per_object * 0.1
+        index = min(num_objects - 1, max(0, int((position + jitter) / per_object)))
+        objects[index].append({"name": name, "asset_id": asset_id, "values": [value]})
+    return objects
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--assets", type=int, default=50)
+    parser.add_argument("--readings", type=int, default=200)
+    parser.add_argument("--objects", type=int, default=40)
+    parser.add_argument("--shingle", type=int, default=4)
+    args = parser.parse_args()
+
+    documents = make_documents(args.assets, args.readings)
+    objects = split_objects(documents, args.objects)
+    total = args.assets * args.readings
+
+    start = time.perf_counter()
+    per_object = sum(
+        len(rows) for o in objects for rows in pivot_readings(o).values()
+    )
+    elapsed = time.perf_counter() - start
+    print(
+        "{:<14} {:>7} of {} rows scored {:>8.1f}ms".format(
+            "per object", per_object, total, elapsed * 1000
+        )
+    )
+
+    for shingle_size in (1, args.shingle):
+        store = WindowStore(shingle_size)
+        start = time.perf_counter()
+        stitched = sum(
+            len(rows)
+            for o in objects
+            for rows in store.add(index_readings(o)).values()
+        )
+        elapsed = time.perf_counter() - start
+        print(
+            "{:<14} {:>7} of {} rows scored {:>8.1f}ms ({} still partial)".format(
+                "window x{}".format(shingle_size),
+                stitched,
+                total,
+                elapsed * 1000,
+                len(store.partial),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,666 @@
+"""Local stand-ins for the AWS clients used by the Lambda functions."""
+import base64
+import datetime
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+
+class FakeClientError(Exception):
+    """Mimics ``botocore.exceptions.ClientError`` closely enough for retries."""
+
+    def __init__(self, code, message=""):
+        super().__init__("{}: {}".format(code, message))
+        self.response = {"Error": {"Code": code, "Message": message}}
+
+
+class FakePaginator:
+    """Serves ``paginate(**kwargs)`` as a single page from ``method``."""
+
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, **kwargs):
+        yield self.method(**kwargs)
+
+
+class FakeSageMakerRuntime:
+    """In-process ``invoke_endpoint`` with simulated latency and throttling.
+
+    Latency is ``base_latency`` plus ``per_kb_latency`` for every KB of the
+    payload. At most ``capacity`` requests are served at once; further
+    concurrent requests, and a ``throttle_rate`` fraction of all requests,
+    fail with ``ThrottlingException``.
+    """
+
+    def __init__(
+        self,
+        base_latency=0.02,
+        per_kb_latency=0.0002,
+        capacity=16,
+        throttle_rate=0.0,
+        max_payload_bytes=6 * 1024 * 1024,
+        seed=0,
+    ):
+        self.base_latency = base_latency
+        self.per_kb_latency = per_kb_latency
+        self.capacity = capacity
+        self.throttle_rate = throttle_rate
+        self.max_payload_bytes = max_payload_bytes
+        self.calls = 0
+        self.throttled = 0
+        self.latencies = []
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def invoke_endpoint(self, EndpointName, Body, ContentType):
+        payload = Body.encode("utf-8") if isinstance(Body, str) else Body
+        if len(payload) > self.max_payload_bytes:
+            raise FakeClientError("ValidationError", "Request body too large")
+        with self._lock:
+            self.calls += 1
+            throttle = (
+                self._in_flight >= self.capacity
+                or self._rng.random() < self.throttle_rate
+            )
+            if throttle:
+                self.throttled += 1
+            else:
+                self._in_flight += 1
+        if throttle:
+            raise FakeClientError("ThrottlingException", "Rate exceeded")
+
+        start = time.perf_counter()
+        try:
+            time.sleep(self.base_latency + self.per_kb_latency * len(payload) / 1024)
+            scores = [{"score": self.score_row(line)} for line in payload.splitlines()]
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self.latencies.append(time.perf_counter() - start)
+        body = json.dumps({"scores": scores}).encode("utf-8")
+        return {"Body": io.BytesIO(body), "ContentType": "application/json"}
+
+    @staticmethod
+    def score_row(line):
+        # Deterministic pseudo-score so runs are comparable.
+        return (hash(line) % 1000) / 500.0
+
+
+class FakeSageMaker:
+    """The ``list_endpoints`` paginator over a fixed list of endpoint names,
+    newest first."""
+
+    def __init__(self, endpoints=("randomcutforest-2021-10-01-00-00-00-000",)):
+        self.endpoints = list(endpoints)
+        self.calls = 0
+
+    def list_endpoints(self, NameContains="", **kwargs):
+        self.calls += 1
+        return {
+            "Endpoints": [
+                {"EndpointName": name}
+                for name in self.endpoints
+                if NameContains in name
+            ]
+        }
+
+    def get_paginator(self, operation):
+        return FakePaginator(getattr(self, operation))
+
+
+class FakeSiteWise:
+    """``describe_asset_model``/``describe_asset`` over in-memory models.
+
+    ``models`` maps asset model ids to lists of ``(property_id, name,
+    dataType)``; ``assets`` maps asset ids to their asset model id.
+    """
+
+    def __init__(self, models, assets):
+        self.models = models
+        self.assets = assets
+        self.calls = 0
+
+    def describe_asset_model(self, assetModelId):
+        self.calls += 1
+        if assetModelId not in self.models:
+            raise FakeClientError("ResourceNotFoundException", assetModelId)
+        return {
+            "assetModelId": assetModelId,
+            "assetModelProperties": [
+                {"id": property_id, "name": name, "dataType": data_type}
+                for property_id, name, data_type in self.models[assetModelId]
+            ],
+        }
+
+    def describe_asset(self, assetId):
+        self.calls += 1
+        if assetId not in self.assets:
+            raise FakeClientError("ResourceNotFoundException", assetId)
+        return {"assetId": assetId, "assetModelId": self.assets[assetId]}
+
+
+class ManualClock:
+    """A clock that only moves when ``advance`` is called."""
+
+    def __init__(self, now=1600000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class FakeSSM:
+    """``get_parameter``/``put_parameter`` over an in-memory dict."""
+
+    def __init__(self, parameters=None):
+        self.parameters = dict(parameters or {})
+        self.calls = 0
+
+    def get_parameter(self, Name, WithDecryption=False):
+        self.calls += 1
+        if Name not in self.parameters:
+            raise FakeClientError("ParameterNotFound", Name)
+        return {"Parameter": {"Name": Name, "Value": self.parameters[Name]}}
+
+    def put_parameter(self, Name, Value, Type="String", Overwrite=False):
+        self.calls += 1
+        if Name in self.parameters and not Overwrite:
+            raise FakeClientError("ParameterAlreadyExists", Name)
+        self.parameters[Name] = Value
+        return {"Version": 1}
+
+
+class NoSuchKey(FakeClientError):
+    def __init__(self, key):
+        super().__init__("NoSuchKey", key)
+
+
+class FakeS3:
+    """S3 object calls over an in-memory dict of bytes.
+
+    ``get_object`` honours ``Range="bytes=<start>-"`` and returns a stream;
+    ``list_objects_v2`` supports ``Prefix``, ``Delimiter``, ``StartAfter`` and
+    ``MaxKeys`` and returns everything as one page.
+    """
+
+    exceptions = SimpleNamespace(NoSuchKey=NoSuchKey)
+
+    def __init__(self):
+        self.objects = {}
+        self.calls = 0
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        return "https://{Bucket}.s3.amazonaws.com/{Key}?X-Amz-Expires={}".format(
+            ExpiresIn, **Params
+        )
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.calls += 1
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        elif not isinstance(Body, bytes):
+            Body = Body.read()
+        self.objects[(Bucket, Key)] = Body
+        return {}
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.calls += 1
+        if (Bucket, Key) not in self.objects:
+            raise NoSuchKey(Key)
+        data = self.objects[(Bucket, Key)]
+        start = 0
+        if Range:
+            start = int(Range[len("bytes=") :].split("-")[0])
+            if start >= len(data):
+                raise FakeClientError("InvalidRange", Range)
+        # BytesIO shares the object's buffer instead of copying it.
+        body = io.BytesIO(data)
+        body.seek(start)
+        return {"Body": body, "ContentLength": len(data) - start}
+
+    def download_fileobj(self, Bucket, Key, Fileobj):
+        Fileobj.write(self.get_object(Bucket=Bucket, Key=Key)["Body"].read())
+
+    def head_object(self, Bucket, Key):
+        self.calls += 1
+        if (Bucket, Key) not in self.objects:
+            raise FakeClientError("404", Key)
+        data = self.objects[(Bucket, Key)]
+        return {
+            "ETag": '"{}"'.format(hashlib.md5(data).hexdigest()),
+            "ContentLength": len(data),
+        }
+
+    def list_objects_v2(
+        self, Bucket, Prefix="", Delimiter=None, StartAfter=None, MaxKeys=None
+    ):
+        self.calls += 1
+        contents = []
+        prefixes = set()
+        for bucket, key in sorted(self.objects):
+            if bucket != Bucket or not key.startswith(Prefix):
+                continue
+            if StartAfter and key <= StartAfter:
+                continue
+            if Delimiter and Delimiter in key[len(Prefix) :]:
+                rest = key[len(Prefix) :]
+                prefixes.add(Prefix + rest[: rest.index(Delimiter) + 1])
+                continue
+            data = self.objects[(bucket, key)]
+            contents.append(
+                {
+                    "Key": key,
+                    "Size": len(data),
+                    "ETag": '"{}"'.format(hashlib.md5(data).hexdigest()),
+                }
+            )
+        return {
+            "Contents": contents[:MaxKeys],
+            "CommonPrefixes": [{"Prefix": prefix} for prefix in sorted(prefixes)],
+        }
+
+    def get_paginator(self, operation):
+        return FakePaginator(getattr(self, operation))
+
+
+class EntityNotFoundException(FakeClientError):
+    def __init__(self, name):
+        super().__init__("EntityNotFoundException", name)
+
+
+class FakeGlueClient:
+    """A crawler and a job whose runs advance with ``clock``.
+
+    Crawls take ``crawl_duration`` seconds and job runs ``job_duration``. The
+    first ``failed_crawls`` crawls and ``failed_jobs`` job runs fail. Once a
+    run finishes, ``events`` returns the matching EventBridge state change
+    event exactly once, unless the run is listed in ``dropped_events`` (by
+    crawl number or job run id) to simulate a missed delivery.
+    ``partitions`` holds the catalog partitions ``get_partitions`` returns,
+    ``partition_keys`` the table's partition columns and ``columns`` its
+    other columns.
+    """
+
+    def __init__(
+        self,
+        clock,
+        crawler_name="crawler",
+        job_name="job",
+        crawl_duration=300,
+        job_duration=600,
+        failed_crawls=0,
+        failed_jobs=0,
+        dropped_events=(),
+    ):
+        self.clock = clock
+        self.crawler_name = crawler_name
+        self.job_name = job_name
+        self.crawl_duration = crawl_duration
+        self.job_duration = job_duration
+        self.failed_crawls = failed_crawls
+        self.failed_jobs = failed_jobs
+        self.dropped_events = set(dropped_events)
+        self.calls = 0
+        self.crawls = []
+        self.job_runs = {}
+        self.partitions = []
+        self.partition_keys = ("asset", "dt", "hour")
+        self.columns = ("name", "property_id", "property_type", "asset_id", "values")
+        self._pending = []
+
+    def _crawl_status(self, crawl):
+        if self.clock() < crawl["start"] + self.crawl_duration:
+            return None
+        return "FAILED" if crawl["number"] <= self.failed_crawls else "SUCCEEDED"
+
+    def _job_status(self, run):
+        if run["stopped"]:
+            return "STOPPED"
+        if self.clock() < run["start"] + self.job_duration:
+            return "RUNNING"
+        return "FAILED" if run["number"] <= self.failed_jobs else "SUCCEEDED"
+
+    exceptions = SimpleNamespace(EntityNotFoundException=EntityNotFoundException)
+
+    def get_table(self, DatabaseName, Name):
+        self.calls += 1
+        keys = [{"Name": key, "Type": "string"} for key in self.partition_keys]
+        columns = [{"Name": column, "Type": "string"} for column in self.columns]
+        return {
+            "Table": {
+                "Name": Name,
+                "PartitionKeys": keys,
+                "StorageDescriptor": {"Columns": columns},
+            }
+        }
+
+    def get_partitions(self, DatabaseName, TableName, Expression=None):
+        self.calls += 1
+        return {"Partitions": [{"Values": list(v)} for v in self.partitions]}
+
+    def get_paginator(self, operation):
+        return FakePaginator(getattr(self, operation))
+
+    def start_crawler(self, Name):
+        self.calls += 1
+        if self.crawls and self._crawl_status(self.crawls[-1]) is None:
+            raise FakeClientError("CrawlerRunningException", Name)
+        crawl = {"number": len(self.crawls) + 1, "start": self.clock()}
+        self.crawls.append(crawl)
+        self._pending.append(("crawl", crawl))
+        return {}
+
+    def get_crawler(self, Name):
+        self.calls += 1
+        crawler = {"Name": Name, "State": "READY"}
+        finished = [c for c in self.crawls if self._crawl_status(c) is not None]
+        if self.crawls and self._crawl_status(self.crawls[-1]) is None:
+            crawler["State"] = "RUNNING"
+        if finished:
+            last = finished[-1]
+            crawler["LastCrawl"] = {
+                "Status": self._crawl_status(last),
+                "StartTime": datetime.datetime.fromtimestamp(
+                    last["start"], datetime.timezone.utc
+                ),
+            }
+        return {"Crawler": crawler}
+
+    def start_job_run(self, JobName):
+        self.calls += 1
+        if any(self._job_status(run) == "RUNNING" for run in self.job_runs.values()):
+            raise FakeClientError("ConcurrentRunsExceededException", JobName)
+        run_id = "jr_{:04d}".format(len(self.job_runs) + 1)
+        self.job_runs[run_id] = {
+            "number": len(self.job_runs) + 1,
+            "start": self.clock(),
+            "stopped": False,
+        }
+        self._pending.append(("job", run_id))
+        return {"JobRunId": run_id}
+
+    def get_job_run(self, JobName, RunId):
+        self.calls += 1
+        run = self.job_runs[RunId]
+        return {"JobRun": {"Id": RunId, "JobRunState": self._job_status(run)}}
+
+    def get_job_runs(self, JobName, MaxResults=100):
+        self.calls += 1
+        runs = [
+            {"Id": run_id, "JobRunState": self._job_status(run)}
+            for run_id, run in reversed(list(self.job_runs.items()))
+        ]
+        return {"JobRuns": runs[:MaxResults]}
+
+    def batch_stop_job_run(self, JobName, JobRunIds):
+        self.calls += 1
+        for run_id in JobRunIds:
+            self.job_runs[run_id]["stopped"] = True
+        return {"SuccessfulSubmissions": [{"JobRunId": r} for r in JobRunIds]}
+
+    def events(self):
+        """Return the state change events for runs finished by now."""
+        ready = []
+        pending = []
+        for kind, item in self._pending:
+            if kind == "crawl":
+                status = self._crawl_status(item)
+                if status is None:
+                    pending.append((kind, item))
+                elif item["number"] not in self.dropped_events:
+                    ready.append(
+                        {
+                            "source": "aws.glue",
+                            "detail-type": "Glue Crawler State Change",
+                            "detail": {
+                                "crawlerName": self.crawler_name,
+                                "state": status.capitalize(),
+                            },
+                        }
+                    )
+            else:
+                status = self._job_status(self.job_runs[item])
+                if status == "RUNNING":
+                    pending.append((kind, item))
+                elif item not in self.dropped_events:
+                    ready.append(
+                        {
+                            "source": "aws.glue",
+                            "detail-type": "Glue Job State Change",
+                            "detail": {
+                                "jobName": self.job_name,
+                                "jobRunId": item,
+                                "state": status,
+                            },
+                        }
+                    )
+        self._pending = pending
+        return ready
+
+
+class FakeSNS:
+    """``publish`` that records messages instead of sending them.
+
+    The first ``failures`` calls fail with ``Throttling``.
+    """
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.messages = []
+        self.calls = 0
+
+    def publish(self, TopicArn, Message, Subject=None, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise FakeClientError("Throttling", "Rate exceeded")
+        self.messages.append(
+            {"TopicArn": TopicArn, "Subject": Subject, "Message": Message}
+        )
+        return {"MessageId": "msg-{:06d}".format(len(self.messages))}
+
+
+class FakeSQS:
+    """``change_message_visibility_batch`` that records the new timeouts."""
+
+    def __init__(self):
+        self.visibility = {}
+        self.calls = 0
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        self.calls += 1
+        if len(Entries) > 10:
+            raise FakeClientError("TooManyEntriesInBatchRequest", QueueUrl)
+        for entry in Entries:
+            self.visibility[entry["ReceiptHandle"]] = entry["VisibilityTimeout"]
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+
+class FakeIoT:
+    """AWS IoT registry calls with latency and per-API TPS quotas.
+
+    Calls beyond an API's quota within a one second window fail with
+    ``ThrottlingException``. ``fail_things`` lists thing names whose
+    ``create_thing`` fails permanently.
+    """
+
+    def __init__(self, latency=0.01, quotas=None, fail_things=()):
+        self.latency = latency
+        self.quotas = quotas or {}
+        self.fail_things = set(fail_things)
+        self.calls = {}
+        self.throttled = 0
+        self.certificates = {}
+        self.things = {}
+        self.policies = {}
+        self.principals = {}
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def _call(self, api):
+        now = time.monotonic()
+        with self._lock:
+            self.calls[api] = self.calls.get(api, 0) + 1
+            quota = self.quotas.get(api)
+            if quota is not None:
+                window = [t for t in self._windows.get(api, []) if now - t < 1.0]
+                if len(window) >= quota:
+                    self.throttled += 1
+                    self._windows[api] = window
+                    raise FakeClientError("ThrottlingException", api)
+                window.append(now)
+                self._windows[api] = window
+        time.sleep(self.latency)
+
+    def register_certificate_without_ca(self, certificatePem, status="INACTIVE"):
+        self._call("register_certificate_without_ca")
+        # Like IoT, the id is the SHA-256 of the first certificate's DER.
+        body = certificatePem.split("-----BEGIN CERTIFICATE-----")[1]
+        der = base64.b64decode(body.split("-----END CERTIFICATE-----")[0])
+        certificate_id = hashlib.sha256(der).hexdigest()
+        arn = "arn:aws:iot:us-east-1:123456789012:cert/" + certificate_id
+        with self._lock:
+            if certificate_id in self.certificates:
+                raise FakeClientError("ResourceAlreadyExistsException", arn)
+            self.certificates[certificate_id] = {"arn": arn, "status": status}
+        return {"certificateArn": arn, "certificateId": certificate_id}
+
+    def describe_certificate(self, certificateId):
+        self._call("describe_certificate")
+        with self._lock:
+            if certificateId not in self.certificates:
+                raise FakeClientError("ResourceNotFoundException", certificateId)
+            certificate = self.certificates[certificateId]
+        return {
+            "certificateDescription": {
+                "certificateArn": certificate["arn"],
+                "certificateId": certificateId,
+                "status": certificate["status"],
+            }
+        }
+
+    def attach_policy(self, policyName, target):
+        self._call("attach_policy")
+        with self._lock:
+            self.policies.setdefault(target, set()).add(policyName)
+        return {}
+
+    def update_certificate(self, certificateId, newStatus):
+        self._call("update_certificate")
+        with self._lock:
+            self.certificates[certificateId]["status"] = newStatus
+        return {}
+
+    def create_thing(self, thingName):
+        self._call("create_thing")
+        if thingName in self.fail_things:
+            raise FakeClientError("InvalidRequestException", thingName)
+        with self._lock:
+            arn = "arn:aws:iot:us-east-1:123456789012:thing/" + thingName
+            self.things.setdefault(thingName, arn)
+        return {"thingName": thingName, "thingArn": arn}
+
+    def attach_thing_principal(self, thingName, principal):
+        self._call("attach_thing_principal")
+        with self._lock:
+            self.principals.setdefault(thingName, set()).add(principal)
+        return {}
+
+
+class FakeDynamoDB:
+    """``get_item``, ``put_item`` and ``batch_get_item`` over in-memory tables.
+
+    ``key_names`` maps each table to its key attribute names. ``put_item``
+    understands ``attribute_not_exists(...)``, ``<attribute> = :value`` and
+    numeric ``<attribute> < :value`` conditions, joined by ``OR``. With
+    ``unprocessed_every`` set, every n-th key of a batch is returned as
+    unprocessed once, as DynamoDB does under load.
+    """
+
+    def __init__(self, key_names, unprocessed_every=0):
+        self.key_names = key_names
+        self.unprocessed_every = unprocessed_every
+        self.tables = {table: {} for table in key_names}
+        self.calls = 0
+        self._deferred = set()
+        self._lock = threading.Lock()
+
+    def _key(self, table, item):
+        return tuple(json.dumps(item[name]) for name in self.key_names[table])
+
+    def get_item(self, TableName, Key, ConsistentRead=False):
+        with self._lock:
+            self.calls += 1
+            item = self.tables[TableName].get(self._key(TableName, Key))
+        return {} if item is None else {"Item": dict(item)}
+
+    def _check(self, current, condition, values):
+        for part in condition.split(" OR "):
+            part = part.strip()
+            if part.startswith("attribute_not_exists("):
+                if current is None:
+                    return True
+                continue
+            if current is None:
+                continue
+            if "<" in part:
+                attribute, placeholder = [side.strip() for side in part.split("<")]
+                if float(current[attribute]["N"]) < float(values[placeholder]["N"]):
+                    return True
+                continue
+            attribute, placeholder = [side.strip() for side in part.split("=")]
+            if current.get(attribute) == values[placeholder]:
+                return True
+        return False
+
+    def put_item(
+        self,
+        TableName,
+        Item,
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+    ):
+        key = self._key(TableName, Item)
+        with self._lock:
+            self.calls += 1
+            current = self.tables[TableName].get(key)
+            if ConditionExpression and not self._check(
+                current, ConditionExpression, ExpressionAttributeValues or {}
+            ):
+                raise FakeClientError("ConditionalCheckFailedException", TableName)
+            self.tables[TableName][key] = dict(Item)
+        return {}
+
+    def batch_get_item(self, RequestItems):
+        responses = {}
+        unprocessed = {}
+        with self._lock:
+            self.calls += 1
+            for table, request in RequestItems.items():
+                if len(request["Keys"]) > 100:
+                    raise FakeClientError("ValidationException", "too many keys")
+                for position, key in enumerate(request["Keys"]):
+                    key = self._key(table, key)
+                    if (
+                        self.unprocessed_every
+                        and position % self.unprocessed_every == 0
+                        and key not in self._deferred
+                    ):
+                        self._deferred.add(key)
+                        unprocessed.setdefault(table, {"Keys": []})["Keys"].append(
+                            request["Keys"][position]
+                        )
+                        continue
+                    item = self.tables[table].get(key)
+                    if item is not None:
+                        responses.setdefault(table, []).append(dict(item))
+        return {"Responses": responses, "UnprocessedKeys": unprocessed}
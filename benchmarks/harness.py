@@ -0,0 +1,204 @@
+"""Load Lambda handlers against local fakes and time their invocations.
+
+``load_function`` imports a handler module and points its clients at the
+fakes given for each service: ``boto3.client`` returns the fakes while the
+module is imported, and each ``LazyClient`` the function's modules hold
+creates its client from them. Every call imports the function afresh,
+with its own copy of the layer modules, the way a cold container would.
+boto3 itself must be installed; it is not called.
+"""
+import importlib
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+from unittest import mock
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions")
+LAYERS = (
+    os.path.join(ROOT, "source", "SharedLibraries", "python"),
+    os.path.join(ROOT, "source", "MLSharedLibraries", "python"),
+)
+
+
+def function_dir(name):
+    """Return the code directory of the function ``name``."""
+    for parent in ("source", "other"):
+        path = os.path.join(ROOT, parent, name)
+        if os.path.isdir(path):
+            return path
+    raise ValueError("no function named {}".format(name))
+
+
+def _owned_modules(paths):
+    names = []
+    for name, module in sys.modules.items():
+        module_file = getattr(module, "__file__", None) or ""
+        if any(module_file.startswith(path + os.sep) for path in paths):
+            names.append(name)
+    return names
+
+
+def load_function(name, module, clients, environ=None):
+    """Import ``module`` of function ``name`` with fake AWS clients.
+
+    ``clients`` maps boto3 service names to fakes; creating a client for any
+    other service fails, so a handler cannot reach AWS by accident.
+    ``environ`` is added to ``os.environ`` and left there, since handlers
+    may also read it when invoked.
+    """
+    import boto3
+
+    paths = [os.path.abspath(function_dir(name))]
+    paths += [os.path.abspath(layer) for layer in LAYERS]
+    for owned in _owned_modules(paths):
+        del sys.modules[owned]
+    os.environ.update(environ or {})
+
+    def client(service_name, *args, **kwargs):
+        try:
+            return clients[service_name]
+        except KeyError:
+            raise KeyError("no fake for the {} client".format(service_name))
+
+    saved_path = list(sys.path)
+    sys.path[:0] = paths
+    try:
+        with mock.patch.object(boto3, "client", client):
+            loaded = importlib.import_module(module)
+    finally:
+        # Keep the function's modules importable for lazy imports.
+        sys.path[:] = paths + [p for p in saved_path if p not in paths]
+    lazy_client = sys.modules.get("lazy_client")
+    if lazy_client is not None:
+        for owned in _owned_modules(paths):
+            for value in vars(sys.modules[owned]).values():
+                if isinstance(value, lazy_client.LazyClient):
+                    value.factory = client
+    return loaded
+
+
+class MetricsSink:
+    """Collects the EMF documents printed by a loaded function's ``metrics``.
+
+    Anything else the metrics print, such as profiles, is passed through.
+    """
+
+    def __init__(self, module):
+        self.documents = []
+        module.metrics.emit = self.emit
+
+    def emit(self, line):
+        if line.startswith("{"):
+            self.documents.append(json.loads(line))
+        else:
+            print(line)
+
+    def stage_ms(self):
+        """Milliseconds spent in each timed stage over all documents."""
+        totals = {}
+        for document in self.documents:
+            for directive in document["_aws"]["CloudWatchMetrics"]:
+                for metric in directive["Metrics"]:
+                    if metric["Unit"] == "Milliseconds":
+                        name = metric["Name"][: -len("_ms")]
+                        totals[name] = totals.get(name, 0.0) + document[metric["Name"]]
+        return totals
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of ``values``."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
+
+
+class StageResult:
+    """Latencies of one stage's invocations and the items they handled."""
+
+    def __init__(self, name, latencies, items, peak_bytes=None, notes=""):
+        self.name = name
+        self.latencies = latencies
+        self.items = items
+        self.peak_bytes = peak_bytes
+        self.notes = notes
+        self.stage_ms = {}
+
+    def summary(self):
+        total = sum(self.latencies)
+        return {
+            "stage": self.name,
+            "invocations": len(self.latencies),
+            "items": self.items,
+            "items_per_second": self.items / total if total else 0.0,
+            "p50_ms": percentile(self.latencies, 0.5) * 1000,
+            "p99_ms": percentile(self.latencies, 0.99) * 1000,
+            "peak_mib": (
+                None if self.peak_bytes is None else self.peak_bytes / 2 ** 20
+            ),
+            "notes": self.notes,
+            "stage_ms": self.stage_ms,
+        }
+
+
+def run_stage(name, invocations, sink=None, trace_memory=True):
+    """Call each ``(function, items)`` of ``invocations`` in turn.
+
+    ``sink`` receives each call's return value, outside the timed section.
+    With ``trace_memory``, the most memory Python allocated during any one
+    call is recorded too, i.e. what a warm container needs on top of what it
+    already holds. Tracing slows calls down, so latencies are then only
+    comparable with other traced runs.
+    """
+    latencies = []
+    items = 0
+    peak = 0 if trace_memory else None
+    for function, count in invocations:
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            start = time.perf_counter()
+            result = function()
+            latencies.append(time.perf_counter() - start)
+            if trace_memory:
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+        items += count
+        if sink is not None:
+            sink(result)
+    return StageResult(name, latencies, items, peak)
+
+
+def format_table(results):
+    lines = [
+        "{:<14} {:>6} {:>9} {:>12} {:>9} {:>9} {:>9}  {}".format(
+            "stage", "calls", "items", "items/s", "p50 ms", "p99 ms", "peak MiB", ""
+        )
+    ]
+    for result in results:
+        row = result.summary()
+        peak = "-" if row["peak_mib"] is None else "{:.1f}".format(row["peak_mib"])
+        lines.append(
+            "{stage:<14} {invocations:>6} {items:>9} {items_per_second:>12.0f} "
+            "{p50_ms:>9.2f} {p99_ms:>9.2f} {peak:>9}  {notes}".format(
+                peak=peak, **row
+            )
+        )
+    for result in results:
+        if result.stage_ms:
+            lines.append(
+                "{:<14} ".format(result.name + ":")
+                + ", ".join(
+                    "{} {:.0f} ms".format(stage, ms)
+                    for stage, ms in sorted(
+                        result.stage_ms.items(), key=lambda item: -item[1]
+                    )
+                )
+            )
+    return "\n".join(lines)
@@ -0,0 +1,160 @@
+"""Cold import time of every Lambda handler, checked against a budget.
+
+Each handler module is imported in a fresh interpreter with ``-X importtime``
+and its layers on the path, the way a new Lambda container loads it. That
+covers everything the module does at import, including creating clients.
+Bytecode is cached in a temporary directory and a warm-up import runs
+first, so the numbers are for packages shipped with precompiled bytecode.
+The best of --repeat runs is reported.
+
+With --check the script exits with status 1 when a handler fails to import
+or takes longer than its budget in IMPORT_BUDGETS_MS, so the build can run
+it before packaging. Budgets are for the build machine; --scale adjusts
+them for slower ones. Requires the functions' dependencies to be
+installed, except those the handlers import lazily.
+
+Usage: python benchmarks/import_times.py [--check] [--repeat N] [--json FILE]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from harness import LAYERS, function_dir
+
+SHARED_LAYER = LAYERS[:1]
+ALERTS_TOPIC = "arn:aws:sns:us-east-1:123456789012:alerts"
+# (function, handler module, layers, environment the module reads at import)
+FUNCTIONS = (
+    (
+        "TransformationHandler",
+        "transformation_lambda",
+        SHARED_LAYER,
+        {"ASSET_MODEL_ID": "model"},
+    ),
+    (
+        "InferenceFunction",
+        "inference_lambda",
+        LAYERS,
+        {"PARAM_NAME": "/threshold", "TOPIC_ARN": ALERTS_TOPIC},
+    ),
+    ("StartGlueJobFunction", "glue_trigger_lambda", SHARED_LAYER, {}),
+    ("StartMLTrainingDeploymentFunction", "training_and_deployment_lambda", LAYERS, {}),
+    ("ProcessAlerts", "alerts", SHARED_LAYER, {"TOPIC_ARN": ALERTS_TOPIC}),
+    ("UploadDeviceManifest", "api", SHARED_LAYER, {"DEVICE_POLICY": "policy"}),
+)
+IMPORT_BUDGETS_MS = {
+    "TransformationHandler": 120,
+    "InferenceFunction": 120,
+    "StartGlueJobFunction": 120,
+    "StartMLTrainingDeploymentFunction": 500,
+    "ProcessAlerts": 120,
+    "UploadDeviceManifest": 120,
+}
+
+
+def parse_importtime(stderr, module):
+    """Return ``(total_us, [(child, cumulative_us)])`` for ``module``.
+
+    The children are the modules ``module`` imported directly, heaviest
+    first.
+    """
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        if depth == 0:
+            if name == module:
+                children.sort(key=lambda child: -child[1])
+                return int(cumulative), children
+            children = []
+        elif depth == 1:
+            children.append((name, int(cumulative)))
+    raise ValueError("{} was not imported".format(module))
+
+
+def measure(name, module, layers, environ, cache_dir):
+    """Import ``module`` of function ``name`` once in a new interpreter."""
+    paths = [function_dir(name)] + [os.path.abspath(layer) for layer in layers]
+    env = dict(os.environ, **environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        paths + [p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p]
+    )
+    env["PYTHONPYCACHEPREFIX"] = cache_dir
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if process.returncode:
+        raise ImportError(process.stderr.strip().splitlines()[-1])
+    return parse_importtime(process.stderr, module)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    print(
+        "{:<34} {:>9} {:>9}  {}".format(
+            "function", "import ms", "budget", "heaviest imports"
+        )
+    )
+    results = []
+    over = False
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for name, module, layers, environ in FUNCTIONS:
+            budget = IMPORT_BUDGETS_MS[name] * args.scale
+            try:
+                runs = [
+                    measure(name, module, layers, environ, cache_dir)
+                    for _ in range(args.repeat + 1)
+                ][1:]
+            except ImportError as error:
+                over = True
+                print("{:<34} {:>9} {:>9.0f}  {}".format(name, "-", budget, error))
+                results.append({"function": name, "error": str(error)})
+                continue
+            total, children = min(runs)
+            heaviest = ", ".join(
+                "{} {:.0f}".format(child, us / 1000) for child, us in children[:3]
+            )
+            flag = ""
+            if total / 1000 > budget:
+                over = True
+                flag = "  OVER BUDGET"
+            print(
+                "{:<34} {:>9.1f} {:>9.0f}  {}{}".format(
+                    name, total / 1000, budget, heaviest, flag
+                )
+            )
+            results.append(
+                {
+                    "function": name,
+                    "import_ms": total / 1000,
+                    "budget_ms": budget,
+                    "imports_ms": {child: us / 1000 for child, us in children},
+                }
+            )
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=2)
+    if args.check and over:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Synthetic ConnectSense telemetry for the benchmarks.
+
+A fleet of ``cords`` power cords reports the five power features ``rate``
+times per second. The generator produces the same data in the shapes the
+pipeline sees it: SiteWise property notifications delivered to the
+Firehose transformation, archive objects written by Firehose, the S3
+events that trigger inference, and the watts readings the IoT rule routes
+to ProcessAlerts.
+
+A fraction ``anomaly_rate`` of readings draw their watts from a surge
+distribution, so thresholds and alerts have something to find.
+"""
+import base64
+import json
+import random
+
+ASSET_MODEL_ID = "connectsense-cord-model"
+ALERTS_QUEUE_ARN = "arn:aws:sqs:us-east-1:123456789012:alerts"
+# (property id, name, data type, mean, standard deviation)
+PROPERTIES = (
+    ("prop-volts", "volts", "DOUBLE", 120.0, 2.0),
+    ("prop-amps", "amps", "DOUBLE", 1.0, 0.1),
+    ("prop-watts", "watts", "DOUBLE", 100.0, 5.0),
+    ("prop-power-factor", "power_factor", "INTEGER", 90.0, 3.0),
+    ("prop-watt-hours", "watt_hours", "DOUBLE", 50.0, 5.0),
+)
+SURGE_WATTS = (1500.0, 200.0)
+START = 1633046400
+
+
+class TelemetryGenerator:
+    """Deterministic readings for ``cords`` cords at ``rate`` per second."""
+
+    def __init__(self, cords, rate=1, anomaly_rate=0.001, start=START, seed=0):
+        self.cords = cords
+        self.rate = rate
+        self.anomaly_rate = anomaly_rate
+        self.start = start
+        self.seed = seed
+        self.asset_ids = ["cord-{:06d}".format(c) for c in range(cords)]
+
+    def sitewise_models(self):
+        """Arguments for ``FakeSiteWise``: the asset model and its assets."""
+        models = {ASSET_MODEL_ID: [p[:3] for p in PROPERTIES]}
+        return models, {asset_id: ASSET_MODEL_ID for asset_id in self.asset_ids}
+
+    def readings(self, first_second, seconds):
+        """Yield ``(asset_id, time_in_seconds, offset_in_nanos, values)``.
+
+        ``values`` maps each property id to its reading. Readings depend
+        only on the seed and the tick, so windows can be generated in any
+        order.
+        """
+        step = 10 ** 9 // self.rate
+        for second in range(first_second, first_second + seconds):
+            rng = random.Random(self.seed * 1000003 + second)
+            for tick in range(self.rate):
+                for asset_id in self.asset_ids:
+                    values = {}
+                    for property_id, name, data_type, mean, std in PROPERTIES:
+                        if name == "watts" and rng.random() < self.anomaly_rate:
+                            mean, std = SURGE_WATTS
+                        value = rng.gauss(mean, std)
+                        if data_type == "INTEGER":
+                            value = int(value)
+                        values[property_id] = value
+                    yield asset_id, self.start + second, tick * step, values
+
+    def firehose_events(self, seconds, buffer_seconds):
+        """Yield one Firehose transformation event per ``buffer_seconds``.
+
+        Every property value update is its own notification, as SiteWise
+        publishes them.
+        """
+        for first in range(0, seconds, buffer_seconds):
+            records = []
+            window = min(buffer_seconds, seconds - first)
+            for asset_id, second, nanos, values in self.readings(first, window):
+                for property_id, _, data_type, _, _ in PROPERTIES:
+                    notification = {
+                        "type": "PropertyValueUpdate",
+                        "payload": {
+                            "assetId": asset_id,
+                            "propertyId": property_id,
+                            "values": [
+                                {
+                                    "timestamp": {
+                                        "timeInSeconds": second,
+                                        "offsetInNanos": nanos,
+                                    },
+                                    "quality": "GOOD",
+                                    "value": {
+                                        data_type.lower() + "Value": values[property_id]
+                                    },
+                                }
+                            ],
+                        },
+                    }
+                    records.append(
+                        {
+                            "recordId": str(len(records)),
+                            "data": base64.b64encode(
+                                json.dumps(notification).encode("utf-8")
+                            ).decode("ascii"),
+                        }
+                    )
+            yield {"records": records}
+
+    def alert_readings(self, seconds, threshold=5.0):
+        """Yield the ``{serial, watts}`` readings the IoT rule forwards."""
+        for asset_id, second, _, values in self.readings(0, seconds):
+            watts = values["prop-watts"]
+            if watts > threshold:
+                yield {"serial": asset_id, "watts": watts, "timestamp": second}
+
+
+def archive_objects(transformed, prefix="archive/", name="object"):
+    """Group transformation output into archive objects as Firehose would.
+
+    Returns ``{key: body}``. Records with partition keys go to their
+    ``asset=/dt=/hour=`` partition; the rest to one object under ``prefix``.
+    """
+    objects = {}
+    for record in transformed["records"]:
+        if record["result"] != "Ok":
+            continue
+        keys = record.get("metadata", {}).get("partitionKeys")
+        if keys:
+            key = "asset={asset_id}/dt={date}/hour={hour}/".format(**keys) + name
+        else:
+            key = prefix + name
+        objects.setdefault(key, []).append(base64.b64decode(record["data"]))
+    return {key: b"".join(parts) for key, parts in objects.items()}
+
+
+def s3_event(bucket, keys):
+    """An S3 ObjectCreated notification for ``keys``."""
+    return {
+        "Records": [
+            {"s3": {"bucket": {"name": bucket}, "object": {"key": key}}}
+            for key in keys
+        ]
+    }
+
+
+def sqs_batches(readings, batch_size=100, queue_arn=ALERTS_QUEUE_ARN):
+    """Group readings into SQS events of ``batch_size`` messages."""
+    records = []
+    for reading in readings:
+        message_id = "m-{}".format(len(records))
+        records.append(
+            {
+                "messageId": message_id,
+                "receiptHandle": "rh-" + message_id,
+                "eventSourceARN": queue_arn,
+                "body": json.dumps(reading),
+            }
+        )
+        if len(records) == batch_size:
+            yield {"Records": records}
+            records = []
+    if records:
+        yield {"Records": records}
@@ -2,19 +2,38 @@
 import os
 import json
 import logging
-import boto3
-from cryptography import x509
-from cryptography.hazmat.backends import default_backend
-from manifest import ManifestItem
-from manifest import ManifestIterator
-
-iot = boto3.client("iot")
+import time
+from base64 import b64decode
+from urllib.parse import unquote_plus
+from jobs import RUNNING, JobLease, LeaseLost, ManifestJobStore, run_manifest_job
+from lazy_client import LazyClient
+from metrics import Metrics
+from provisioning import MAX_WORKERS, BulkProvisioner, ProvisioningIndex
+
+# Each handler uses only some of the clients.
+iot = LazyClient("iot")
+s3 = LazyClient("s3")
+lambda_client = LazyClient("lambda")
+dynamodb = LazyClient("dynamodb")
+metrics = Metrics("UploadDeviceManifest")
 
 POLICY_NAME = os.environ["DEVICE_POLICY"]
-
-
-class ManifestImportException(Exception):
-    """Manifest Named Exception."""
+PROVISIONING_WORKERS = int(os.environ.get("PROVISIONING_WORKERS", MAX_WORKERS))
+# DynamoDB table recording each device's provisioning progress; without it
+# every upload provisions all of its devices again.
+PROVISIONING_TABLE = os.environ.get("PROVISIONING_TABLE")
+# API Gateway gives up after 29 s; devices not started, or still retrying, by
+# then are reported as pending so the caller can upload them again.
+API_TIME_BUDGET = float(os.environ.get("API_TIME_BUDGET_SECONDS", "25"))
+MANIFEST_JOB_BUCKET = os.environ.get("MANIFEST_JOB_BUCKET")
+# DynamoDB table of job leases, so duplicate or overlapping worker
+# invocations do not run the same job at once.
+JOB_LEASE_TABLE = os.environ.get("JOB_LEASE_TABLE")
+# How long the presigned manifest upload URL of a new job stays valid.
+UPLOAD_URL_EXPIRES = int(os.environ.get("UPLOAD_URL_EXPIRES_SECONDS", "900"))
+# A worker stops taking new batches this long before its timeout and hands
+# the job over to a fresh invocation.
+WORKER_RESERVE_MS = int(os.environ.get("WORKER_RESERVE_SECONDS", "60")) * 1000
 
 
 def load_verify_cert_by_file(filename):
@@ -25,82 +44,175 @@ def load_verify_cert_by_file(filename):
     return verification_cert
 
 
-def _make_thing(device_id, certificate_arn):
-    """Creates an AWS-IOT "thing" and attaches the certificate."""
-    try:
-        response = iot.create_thing(thingName=device_id)
-        thing_arn = response["thingArn"]
-    except:
-        raise ManifestImportException("Unable to create thing")
-
-    try:
-        response = iot.attach_thing_principal(
-            thingName=device_id, principal=certificate_arn
-        )
-    except:
-        raise ManifestImportException("Unable to attach certificate to thing")
-
-    return thing_arn
-
-
-def _import_certificate(certificate_x509_pem, policy_name):
-    """Attach policy to imported certificate."""
-    response = iot.register_certificate_without_ca(certificatePem=certificate_x509_pem)
-
-    iot.attach_policy(policyName=policy_name, target=response["certificateArn"])
-
-    iot.update_certificate(certificateId=response["certificateId"], newStatus="ACTIVE")
-
-    return response["certificateArn"]
-
-
-def _invoke_import_manifest(policy_name, manifest, cert_pem):
-    """Processes a manifest and loads entries into AWS-IOT."""
-
-    verification_cert = x509.load_pem_x509_certificate(
-        data=cert_pem, backend=default_backend()
+def _make_provisioner(policy_name):
+    index = None
+    if PROVISIONING_TABLE:
+        index = ProvisioningIndex(dynamodb, PROVISIONING_TABLE)
+    return BulkProvisioner(
+        iot,
+        policy_name,
+        max_workers=PROVISIONING_WORKERS,
+        index=index,
+        on_retry=lambda: metrics.count("iot_retries"),
     )
 
-    iterator = ManifestIterator(manifest)
-
-    # this should only contain one manifest item
-    things = []
-    while iterator.index != 0:
-        manifest_item = ManifestItem(next(iterator), verification_cert)
 
-        certificate_arn = _import_certificate(
-            manifest_item.get_certificate_chain(), policy_name
-        )
+def _invoke_import_manifest(policy_name, manifest, cert_pem, deadline=None):
+    """Processes a manifest and loads entries into AWS-IOT.
+
+    Returns one provisioning report per verified entry and the entries that
+    failed verification.
+    """
+    # Loads jose and cryptography, which only the import handlers need.
+    from manifest import verify_manifest
+
+    with metrics.timer("jws_verify"):
+        results = verify_manifest(manifest, cert_pem)
+
+    devices = []
+    errors = []
+    for result in results:
+        if "error" in result:
+            metrics.debug("manifest item # {index} rejected: {error}", **result)
+            errors.append(result)
+            continue
+        devices.append((result["uniqueId"], result["certificateChain"]))
+    metrics.count("entries", len(results))
+    metrics.count("rejected", len(errors))
+
+    with metrics.timer("iot_calls"):
+        reports = _make_provisioner(policy_name).provision(devices, deadline=deadline)
+    for report in reports:
+        if report.get("skipped"):
+            metrics.count("skipped")
+        else:
+            metrics.count(report["status"])
+    return reports, errors
+
+
+@metrics.instrument
+def upload_manifest(event, context):
+    """Create the DevKit Thing, Policy, and Certificates."""
+    cert = load_verify_cert_by_file("./MCHP_manifest_signer.crt")
+    with metrics.timer("parse"):
+        manifest = json.loads(event["body"])
+    metrics.debug("manifest of {} entries", len(manifest))
 
-        thing_name = "CS-CORD-DK-" + manifest_item.identifier
-        thing_arn = _make_thing(thing_name, certificate_arn)
+    reports, errors = _invoke_import_manifest(
+        POLICY_NAME, manifest, cert, deadline=time.monotonic() + API_TIME_BUDGET
+    )
+    things = [r["thingName"] for r in reports if r["status"] == "provisioned"]
+    unfinished = [r for r in reports if r["status"] != "provisioned"]
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps(
+            {
+                "success": not errors and not unfinished,
+                "things": things,
+                "devices": unfinished,
+                "errors": errors,
+            }
+        ),
+    }
+
+
+def _json_response(status_code, body):
+    return {"statusCode": status_code, "body": json.dumps(body)}
+
+
+def _start_worker(function_name, job_id):
+    lambda_client.invoke(
+        FunctionName=function_name,
+        InvocationType="Event",
+        Payload=json.dumps({"jobId": job_id}).encode("utf-8"),
+    )
 
-        if thing_arn:
-            things.append(thing_name)
 
-    return things
+def create_manifest_job(event, context):
+    """Create a manifest import job.
+
+    Without a request body the response holds a presigned ``uploadUrl`` the
+    client PUTs the manifest to, which is how manifests too large for a
+    request body are submitted. A manifest sent as the body is staged
+    directly. Either way the worker starts once the manifest is in S3.
+    """
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        body = b64decode(body)
+    elif isinstance(body, str):
+        body = body.encode("utf-8")
+    store = ManifestJobStore(s3, MANIFEST_JOB_BUCKET)
+    if body.strip():
+        job = store.create(body)
+        return _json_response(202, {"jobId": job["jobId"], "status": job["status"]})
+    job = store.create()
+    return _json_response(
+        201,
+        {
+            "jobId": job["jobId"],
+            "status": job["status"],
+            "uploadUrl": store.upload_url(job["jobId"], UPLOAD_URL_EXPIRES),
+            "expiresIn": UPLOAD_URL_EXPIRES,
+        },
+    )
 
 
-def upload_manifest(event, context):
-    print(event)
-    """Create the DevKit Thing, Policy, and Certificates."""
+def manifest_job_status(event, context):
+    """Report the progress of a manifest import job."""
+    job_id = (event.get("pathParameters") or {}).get("jobId", "")
+    job = None
+    if job_id.isalnum():
+        job = ManifestJobStore(s3, MANIFEST_JOB_BUCKET).load(job_id)
+    if job is None:
+        return _json_response(404, {"error": "Unknown job {}".format(job_id)})
+    return _json_response(200, job)
+
+
+def _event_job_id(store, event):
+    """Job id of a worker event: an S3 ``Object Created`` event from
+    EventBridge for an uploaded manifest, or a continuation's ``jobId``."""
+    if "jobId" in event:
+        return event["jobId"]
+    detail = event.get("detail") or {}
+    key = unquote_plus((detail.get("object") or {}).get("key", ""))
+    return store.job_id_of(key)
+
+
+@metrics.instrument
+def process_manifest_job(event, context):
+    """Import a staged manifest, continuing in a new invocation when this
+    one runs short of time."""
+    store = ManifestJobStore(s3, MANIFEST_JOB_BUCKET)
+    job_id = _event_job_id(store, event)
+    if job_id is None:
+        print("not a manifest upload: {}".format(json.dumps(event.get("detail"))))
+        return
+    cert = load_verify_cert_by_file("./MCHP_manifest_signer.crt")
+    lease = None
+    if JOB_LEASE_TABLE:
+        lease = JobLease(dynamodb, JOB_LEASE_TABLE, holder=context.aws_request_id)
     try:
-        cert = load_verify_cert_by_file("./MCHP_manifest_signer.crt")
-        manifest = json.loads(event["body"])
-        print(manifest)
-
-        _invoke_import_manifest(POLICY_NAME, manifest, cert)
-
-        return {"statusCode": 200, "body": json.dumps({"success": True})}
-
-    except ManifestImportException as error:
-        print(error)
-        return {
-            "statusCode": 500,
-            "body": json.dumps(
-                {
-                    "type": type(error).__name__,
-                    "error": error,
-                }
-            ),
-        }
+        job = run_manifest_job(
+            store,
+            job_id,
+            cert,
+            _make_provisioner(POLICY_NAME),
+            should_stop=lambda: context.get_remaining_time_in_millis()
+            < WORKER_RESERVE_MS,
+            metrics=metrics,
+            lease=lease,
+        )
+    except LeaseLost:
+        print("manifest job {} is held by another worker".format(job_id))
+        metrics.count("lease_lost")
+        return
+    if job is None:
+        print("manifest job {} not found".format(job_id))
+        return
+    print(
+        "manifest job {jobId}: {status}, {entries} entries, "
+        "{provisioned} provisioned".format(**job)
+    )
+    if job["status"] == RUNNING:
+        _start_worker(context.invoked_function_arn, job_id)
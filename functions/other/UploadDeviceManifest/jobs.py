@@ -0,0 +1,316 @@
+"""Manifest import jobs staged in S3.
+
+A job stores the uploaded manifest and a status document next to it.
+Manifests are usually uploaded by the client straight to S3 with a
+presigned URL, since API Gateway limits request bodies to 10 MB and Lambda
+to 6 MB; the upload's ObjectCreated event starts the worker. The worker
+streams the manifest, verifies and provisions its entries in
+batches and, after every batch, checkpoints the byte offset reached and
+the running totals in the status document. A run that stops, whether it
+ran out of time or failed, resumes from the last checkpoint. Entries of
+the batch in progress when it failed are handed to the provisioner again,
+which skips or resumes them when it keeps a provisioning index. With a
+``JobLease`` only one worker runs a job at a time, however often it is
+invoked for it.
+"""
+import json
+import time
+import uuid
+
+from metrics import Metrics
+
+AWAITING_UPLOAD = "AWAITING_UPLOAD"
+QUEUED = "QUEUED"
+RUNNING = "RUNNING"
+SUCCEEDED = "SUCCEEDED"
+FAILED = "FAILED"
+
+MANIFEST_NAME = "manifest.json"
+BATCH_SIZE = 200
+# Failed entries listed in the status document; the totals count them all.
+MAX_REPORTED_FAILURES = 1000
+# How long a claim on a job lasts; it is renewed before every batch, so a
+# batch must be verified, provisioned and checkpointed within it.
+LEASE_SECONDS = 300
+
+
+class LeaseLost(Exception):
+    """Another worker holds the job's lease."""
+
+
+def _error_code(error):
+    return getattr(error, "response", {}).get("Error", {}).get("Code")
+
+
+class JobLease:
+    """Claims on manifest jobs kept in a DynamoDB table keyed by ``jobId``.
+
+    A claim is a conditional ``put_item`` that succeeds when the job is
+    unclaimed, its lease has expired or ``holder`` already holds it, so it
+    also renews the lease. Give each invocation its own ``holder``; Lambda
+    reuses the request id for the retries of an event, which lets a retry
+    take over the lease of the run it replaces.
+    """
+
+    def __init__(
+        self,
+        dynamodb_client,
+        table_name,
+        holder=None,
+        seconds=LEASE_SECONDS,
+        clock=time.time,
+    ):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+        self.holder = holder or uuid.uuid4().hex
+        self.seconds = seconds
+        self.clock = clock
+
+    def _put(self, job_id, expires_at):
+        try:
+            self.dynamodb_client.put_item(
+                TableName=self.table_name,
+                Item={
+                    "jobId": {"S": job_id},
+                    "leaseHolder": {"S": self.holder},
+                    "expiresAt": {"N": str(expires_at)},
+                },
+                ConditionExpression="attribute_not_exists(jobId)"
+                " OR expiresAt < :now OR leaseHolder = :holder",
+                ExpressionAttributeValues={
+                    ":now": {"N": str(int(self.clock()))},
+                    ":holder": {"S": self.holder},
+                },
+            )
+        except Exception as error:
+            if _error_code(error) == "ConditionalCheckFailedException":
+                raise LeaseLost(job_id)
+            raise
+
+    def claim(self, job_id):
+        """Claim or renew the lease on ``job_id``; raises ``LeaseLost``."""
+        self._put(job_id, int(self.clock()) + self.seconds)
+
+    def release(self, job_id):
+        """Let another worker claim ``job_id`` right away."""
+        try:
+            self._put(job_id, 0)
+        except LeaseLost:
+            pass
+
+
+class ManifestJobStore:
+    """Keeps job manifests and status documents under an S3 prefix."""
+
+    def __init__(self, s3_client, bucket, prefix="manifest-jobs", clock=time.time):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.clock = clock
+
+    def _key(self, job_id, name):
+        return "{}/{}/{}".format(self.prefix, job_id, name)
+
+    def create(self, manifest_body=None):
+        """Create a job and return it.
+
+        ``manifest_body`` (bytes) is staged right away; without it the job
+        awaits an upload to ``upload_url``.
+        """
+        job_id = uuid.uuid4().hex
+        now = self.clock()
+        job = {
+            "jobId": job_id,
+            "status": AWAITING_UPLOAD if manifest_body is None else QUEUED,
+            "offset": 0,
+            "entries": 0,
+            "provisioned": 0,
+            "skipped": 0,
+            "failed": 0,
+            "rejected": 0,
+            "failures": [],
+            "createdAt": now,
+        }
+        # Saved first, so the job exists when the manifest's upload event
+        # arrives.
+        self.save(job)
+        if manifest_body is not None:
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=self._key(job_id, MANIFEST_NAME),
+                Body=manifest_body,
+            )
+        return job
+
+    def upload_url(self, job_id, expires_in):
+        """Presigned URL the client PUTs the job's manifest to."""
+        return self.s3_client.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": self.bucket, "Key": self._key(job_id, MANIFEST_NAME)},
+            ExpiresIn=expires_in,
+        )
+
+    def job_id_of(self, key):
+        """Return the job a manifest ``key`` belongs to, or None."""
+        parts = key.split("/")
+        if (
+            len(parts) != 3
+            or parts[0] != self.prefix
+            or parts[2] != MANIFEST_NAME
+            or not parts[1].isalnum()
+        ):
+            return None
+        return parts[1]
+
+    def load(self, job_id):
+        """Return the status document of ``job_id``, or None."""
+        try:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket, Key=self._key(job_id, "status.json")
+            )
+        except Exception as error:
+            if getattr(error, "response", {}).get("Error", {}).get("Code") in (
+                "NoSuchKey",
+                "404",
+            ):
+                return None
+            raise
+        return json.loads(response["Body"].read())
+
+    def save(self, job):
+        job["updatedAt"] = self.clock()
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(job["jobId"], "status.json"),
+            Body=json.dumps(job).encode("utf-8"),
+            ContentType="application/json",
+        )
+
+    def open_manifest(self, job_id, offset=0):
+        """Return a stream of the job's manifest from byte ``offset``."""
+        response = self.s3_client.get_object(
+            Bucket=self.bucket,
+            Key=self._key(job_id, MANIFEST_NAME),
+            Range="bytes={}-".format(offset),
+        )
+        return response["Body"]
+
+
+def _record_batch(job, results, provisioner, metrics):
+    devices = []
+    for result in results:
+        if "error" in result:
+            _count(job, metrics, "rejected")
+            _add_failure(job, result)
+            continue
+        devices.append((result["uniqueId"], result["certificateChain"]))
+    with metrics.timer("iot_calls"):
+        reports = provisioner.provision(devices)
+    for report in reports:
+        if report.get("skipped"):
+            _count(job, metrics, "skipped")
+        elif report["status"] == "provisioned":
+            _count(job, metrics, "provisioned")
+        else:
+            _count(job, metrics, "failed")
+            _add_failure(job, report)
+    job["entries"] += len(results)
+
+
+def _count(job, metrics, name):
+    job[name] += 1
+    metrics.count(name)
+
+
+def _add_failure(job, failure):
+    if len(job["failures"]) < MAX_REPORTED_FAILURES:
+        job["failures"].append(failure)
+
+
+def run_manifest_job(
+    store,
+    job_id,
+    cert_pem,
+    provisioner,
+    batch_size=BATCH_SIZE,
+    should_stop=None,
+    metrics=None,
+    lease=None,
+):
+    """Work on ``job_id`` until it is done or ``should_stop()`` is true.
+
+    ``should_stop`` is checked after each checkpoint. Stage times and entry
+    counts go to ``metrics``. With a ``JobLease``, the job is claimed before
+    it is touched and the claim renewed before every batch; ``LeaseLost``
+    is raised, with nothing more written, when another worker holds it. The
+    lease is released on the way out. Returns the job's status document; a
+    job still ``RUNNING`` has entries left to process.
+    """
+    if metrics is None:
+        # Never started, so it records nothing.
+        metrics = Metrics("ManifestJob")
+    if lease is not None:
+        lease.claim(job_id)
+    try:
+        return _work(
+            store,
+            job_id,
+            cert_pem,
+            provisioner,
+            batch_size,
+            should_stop,
+            metrics,
+            lease,
+        )
+    finally:
+        if lease is not None:
+            lease.release(job_id)
+
+
+def _work(
+    store, job_id, cert_pem, provisioner, batch_size, should_stop, metrics, lease
+):
+    from manifest import iter_manifest_entries, verify_manifest
+
+    # Loaded after the claim, so it holds the totals of the last worker.
+    job = store.load(job_id)
+    if job is None or job["status"] in (SUCCEEDED, FAILED):
+        return job
+    job["status"] = RUNNING
+    store.save(job)
+
+    def checkpoint(batch, offset):
+        if lease is not None:
+            lease.claim(job_id)
+        with metrics.timer("jws_verify"):
+            results = verify_manifest(batch, cert_pem, start=job["entries"])
+        _record_batch(job, results, provisioner, metrics)
+        job["offset"] = offset
+        with metrics.timer("checkpoint"):
+            store.save(job)
+        metrics.count("entries", len(batch))
+
+    batch = []
+    offset = job["offset"]
+    try:
+        stream = store.open_manifest(job_id, offset)
+        entries = iter_manifest_entries(stream, offset)
+        for offset, entry in metrics.timed_iter("parse", entries):
+            batch.append(entry)
+            if len(batch) < batch_size:
+                continue
+            checkpoint(batch, offset)
+            batch = []
+            if should_stop is not None and should_stop():
+                return job
+        if batch:
+            checkpoint(batch, offset)
+    except ValueError as error:
+        # The manifest itself is malformed; running again would not help.
+        job["status"] = FAILED
+        job["error"] = str(error)
+        store.save(job)
+        return job
+    job["status"] = SUCCEEDED
+    store.save(job)
+    return job
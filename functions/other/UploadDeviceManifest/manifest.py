@@ -1,7 +1,10 @@
 """Microchip Manifest Upload."""
 
+import codecs
+import functools
 import json
 from base64 import b64decode
+import jose.exceptions
 import jose.jws
 from jose.utils import base64url_decode, base64url_encode
 from cryptography import x509
@@ -9,41 +12,22 @@ from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes, serialization
 
 verification_algorithms = ["RS256", "RS384", "RS512", "ES256", "ES384", "ES512"]
+JSON_WHITESPACE = " \t\n\r"
 
 
-class ManifestIterator:
-    """Iterator helper."""
+class ManifestVerifier:
+    """Verifies manifest entries against one signer certificate.
 
-    def __init__(self, manifest):
-        self.manifest = manifest
-        self.index = len(manifest)
-        print("length of manifest: {}".format(self.index))
+    The certificate's key id, PEM public key and SHA-256 fingerprint are
+    computed once instead of for every entry.
+    """
 
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        if self.index == 0:
-            raise StopIteration
-        self.index = self.index - 1
-        print("reading manifest item # {}".format(self.index))
-        return self.manifest[self.index]
-
-
-class ManifestItem:
-    """ManifestItems are a secure element's public keys."""
-
-    def __init__(self, signed_se, verification_cert):
-        self.signed_se = signed_se
-        self.ski_ext = verification_cert.extensions.get_extension_for_class(
+    def __init__(self, verification_cert):
+        ski_ext = verification_cert.extensions.get_extension_for_class(
             extclass=x509.SubjectKeyIdentifier
         )
-
-        self.verification_cert_kid_b64 = base64url_encode(
-            self.ski_ext.value.digest
-        ).decode("ascii")
-
-        self.verification_public_key_pem = (
+        self.kid_b64 = base64url_encode(ski_ext.value.digest).decode("ascii")
+        self.public_key_pem = (
             verification_cert.public_key()
             .public_bytes(
                 encoding=serialization.Encoding.PEM,
@@ -51,61 +35,173 @@ class ManifestItem:
             )
             .decode("ascii")
         )
-
-        self.verification_cert_x5t_s256_b64 = base64url_encode(
+        self.x5t_s256_b64 = base64url_encode(
             verification_cert.fingerprint(hashes.SHA256())
         ).decode("ascii")
-        self.certificate_chain = ""
-        self.run()
 
-    def get_identifier(self):
-        """Secure element's unique id."""
-        return self.identifier
+    @classmethod
+    def from_pem(cls, cert_pem):
+        return cls(
+            x509.load_pem_x509_certificate(data=cert_pem, backend=default_backend())
+        )
 
-    def get_certificate_chain(self):
-        """Secure element public keys."""
-        return self.certificate_chain
+    def verify(self, signed_se):
+        """Return ``(unique_id, certificate_chain)`` of a signed entry.
 
-    def run(self):
-        """Manifest item public key validator."""
-        print("uniqueId: {}".format(self.signed_se["header"]["uniqueId"]))
-        self.identifier = self.signed_se["header"]["uniqueId"]
+        Raises ValueError when the entry was not signed by this certificate.
+        """
+        identifier = signed_se["header"]["uniqueId"]
 
         # Decode the protected header
-        protected = json.loads(
-            base64url_decode(self.signed_se["protected"].encode("ascii"))
-        )
-        if protected["kid"] != self.verification_cert_kid_b64:
+        protected = json.loads(base64url_decode(signed_se["protected"].encode("ascii")))
+        if protected["kid"] != self.kid_b64:
             raise ValueError("kid does not match certificate value")
-        if protected["x5t#S256"] != self.verification_cert_x5t_s256_b64:
+        if protected["x5t#S256"] != self.x5t_s256_b64:
             raise ValueError("x5t#S256 does not match certificate value")
         # Convert JWS to compact form as required by python-jose
         jws_compact = ".".join(
-            [
-                self.signed_se["protected"],
-                self.signed_se["payload"],
-                self.signed_se["signature"],
-            ]
+            [signed_se["protected"], signed_se["payload"], signed_se["signature"]]
         )
         # Verify and decode the payload. If verification fails an exception will
         # be raised.
-        secure_element = json.loads(
-            jose.jws.verify(
-                token=jws_compact,
-                key=self.verification_public_key_pem,
-                algorithms=verification_algorithms,
+        try:
+            secure_element = json.loads(
+                jose.jws.verify(
+                    token=jws_compact,
+                    key=self.public_key_pem,
+                    algorithms=verification_algorithms,
+                )
             )
-        )
+        except jose.exceptions.JWSError as error:
+            raise ValueError(str(error))
         try:
             public_keys = secure_element["publicKeySet"]["keys"]
         except KeyError:
             public_keys = []
+        certificate_chain = ""
         for jwk in public_keys:
-            cert = ""
             for cert_b64 in jwk.get("x5c", []):
                 cert = x509.load_der_x509_certificate(
                     data=b64decode(cert_b64), backend=default_backend()
                 )
-                self.certificate_chain = self.certificate_chain + cert.public_bytes(
+                certificate_chain = certificate_chain + cert.public_bytes(
                     encoding=serialization.Encoding.PEM
                 ).decode("ascii")
+        return identifier, certificate_chain
+
+    def verify_result(self, index, signed_se):
+        """Verify one entry, reporting failures instead of raising."""
+        result = {"index": index}
+        try:
+            result["uniqueId"] = signed_se["header"]["uniqueId"]
+            result["uniqueId"], result["certificateChain"] = self.verify(signed_se)
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            # Malformed entries, e.g. a null "protected", fail on their own.
+            result["error"] = "{}: {}".format(type(error).__name__, error)
+        return result
+
+
+@functools.lru_cache(maxsize=4)
+def _verifier(cert_pem):
+    return ManifestVerifier.from_pem(cert_pem)
+
+
+def verify_manifest(manifest, cert_pem, start=0):
+    """Verify every entry of ``manifest`` with one verifier per certificate.
+
+    Returns one result dict per entry, in manifest order, with either
+    ``uniqueId`` and ``certificateChain`` or ``error``; indexes are counted
+    from ``start``. Verification is CPU bound, so entries are verified in
+    turn; threads would only contend for the GIL.
+    """
+    verifier = _verifier(cert_pem)
+    return [
+        verifier.verify_result(index, signed_se)
+        for index, signed_se in enumerate(manifest, start)
+    ]
+
+
+def iter_manifest_entries(stream, offset=0, chunk_size=64 * 1024):
+    """Yield ``(end_offset, entry)`` for each entry of a manifest.
+
+    ``stream`` is a binary file-like object holding the manifest's JSON
+    array from byte ``offset`` on. ``offset`` is either 0 or an
+    ``end_offset`` yielded earlier, so a run can resume right after the
+    last entry it handled. Only the entry being decoded is kept in memory.
+
+    Raises ValueError if the manifest is not a JSON array.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    # Byte offset in the manifest of buffer[0].
+    position = offset
+    state = "start" if offset == 0 else "after_entry"
+    eof = False
+    while True:
+        stripped = buffer.lstrip(JSON_WHITESPACE)
+        position += len(buffer) - len(stripped)
+        buffer = stripped
+        if state == "entry":
+            try:
+                entry, end = decoder.raw_decode(buffer)
+            except ValueError:
+                if eof:
+                    raise
+                end = None
+            # A value running to the end of the buffer may continue in the
+            # next chunk.
+            if end is not None and (end < len(buffer) or eof):
+                position += len(buffer[:end].encode("utf-8"))
+                buffer = buffer[end:]
+                state = "after_entry"
+                yield position, entry
+                continue
+        elif buffer:
+            char = buffer[0]
+            if state == "start":
+                if char != "[":
+                    raise ValueError("manifest is not a JSON array")
+                state = "first_entry"
+            elif state == "first_entry" and char != "]":
+                state = "entry"
+                continue
+            elif char == "]":
+                return
+            elif char == "," and state == "after_entry":
+                state = "entry"
+            else:
+                raise ValueError("unexpected {!r} at byte {}".format(char, position))
+            position += 1
+            buffer = buffer[1:]
+            continue
+        if eof:
+            raise ValueError("manifest ends unexpectedly")
+        data = stream.read(chunk_size)
+        eof = not data
+        buffer += text_decoder.decode(data, final=eof)
+
+
+class ManifestItem:
+    """ManifestItems are a secure element's public keys."""
+
+    def __init__(self, signed_se, verification_cert):
+        self.signed_se = signed_se
+        if isinstance(verification_cert, ManifestVerifier):
+            self.verifier = verification_cert
+        else:
+            self.verifier = ManifestVerifier(verification_cert)
+        self.certificate_chain = ""
+        self.run()
+
+    def get_identifier(self):
+        """Secure element's unique id."""
+        return self.identifier
+
+    def get_certificate_chain(self):
+        """Secure element public keys."""
+        return self.certificate_chain
+
+    def run(self):
+        """Manifest item public key validator."""
+        self.identifier, self.certificate_chain = self.verifier.verify(self.signed_se)
@@ -0,0 +1,331 @@
+"""Bulk registration of verified manifest entries in AWS IoT."""
+import base64
+import hashlib
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+THING_PREFIX = "CS-CORD-DK-"
+
+# Requests per second allowed for each IoT API, matching the default AWS IoT
+# Core quotas. Raise them if the account's quotas were increased.
+DEFAULT_RATE_LIMITS = {
+    "register_certificate_without_ca": 10,
+    "attach_policy": 15,
+    "update_certificate": 10,
+    "create_thing": 15,
+    "attach_thing_principal": 15,
+    "describe_certificate": 10,
+}
+# Provisioning steps of a device, in order. The index records how many of
+# them a device has completed.
+STEPS = (
+    "register_certificate_without_ca",
+    "attach_policy",
+    "update_certificate",
+    "create_thing",
+    "attach_thing_principal",
+)
+MAX_WORKERS = 16
+MAX_RETRIES = 6
+BACKOFF_BASE = 0.2
+BACKOFF_CAP = 5.0
+RETRYABLE_ERRORS = (
+    "ThrottlingException",
+    "LimitExceededException",
+    "ServiceUnavailableException",
+    "InternalFailureException",
+)
+
+
+class RateLimiter:
+    """Token bucket shared by threads; ``acquire`` waits for a token."""
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.burst
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = self.clock()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class ProvisioningError(Exception):
+    """A provisioning step failed after its retries."""
+
+    def __init__(self, step, error):
+        super().__init__("{} failed: {}".format(step, error))
+        self.step = step
+        self.code = _error_code(error)
+
+
+class DeadlinePassed(ProvisioningError):
+    """A step was still being retried when the deadline passed."""
+
+
+def _error_code(error):
+    return getattr(error, "response", {}).get("Error", {}).get("Code")
+
+
+def certificate_fingerprint(certificate_chain):
+    """Return the SHA-256 hex digest of the first certificate of a PEM chain.
+
+    This is also the id AWS IoT gives the certificate once registered.
+    """
+    lines = certificate_chain.strip().splitlines()
+    try:
+        begin = lines.index("-----BEGIN CERTIFICATE-----")
+        end = lines.index("-----END CERTIFICATE-----", begin)
+    except ValueError:
+        raise ValueError("no PEM certificate in chain")
+    der = base64.b64decode("".join(lines[begin + 1 : end]))
+    return hashlib.sha256(der).hexdigest()
+
+
+def _item_key(unique_id, fingerprint):
+    return {"uniqueId": {"S": unique_id}, "fingerprint": {"S": fingerprint}}
+
+
+class ProvisioningIndex:
+    """Provisioning progress of each device in a DynamoDB table.
+
+    Items are keyed by ``uniqueId`` and certificate ``fingerprint`` and hold
+    the number of STEPS completed and the certificate ARN, so a device seen
+    again with the same certificate is skipped or resumed, while one with a
+    new certificate is provisioned afresh. Only ``batch_get_item`` and
+    ``put_item`` are used.
+    """
+
+    BATCH_SIZE = 100
+
+    def __init__(self, dynamodb_client, table_name):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+
+    def get_many(self, keys):
+        """Return ``{(unique_id, fingerprint): progress}`` for known keys."""
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        for start in range(0, len(keys), self.BATCH_SIZE):
+            chunk = keys[start : start + self.BATCH_SIZE]
+            request = {self.table_name: {"Keys": [_item_key(*key) for key in chunk]}}
+            while request:
+                response = self.dynamodb_client.batch_get_item(RequestItems=request)
+                for item in response["Responses"].get(self.table_name, []):
+                    key = (item["uniqueId"]["S"], item["fingerprint"]["S"])
+                    found[key] = {
+                        "step": int(item["step"]["N"]),
+                        "certificateArn": item.get("certificateArn", {}).get("S"),
+                    }
+                request = response.get("UnprocessedKeys")
+        return found
+
+    def put(self, unique_id, fingerprint, progress):
+        item = _item_key(unique_id, fingerprint)
+        item["step"] = {"N": str(progress["step"])}
+        if progress.get("certificateArn"):
+            item["certificateArn"] = {"S": progress["certificateArn"]}
+        self.dynamodb_client.put_item(TableName=self.table_name, Item=item)
+
+
+class BulkProvisioner:
+    """Registers certificates and things for many devices concurrently.
+
+    Every IoT call goes through the rate limiter of its API, and throttled
+    or transiently failing calls are retried with jittered exponential
+    backoff. Devices are independent: one failing does not stop the rest.
+    ``on_retry``, if given, is called from the worker thread before each
+    retry.
+    """
+
+    def __init__(
+        self,
+        iot_client,
+        policy_name,
+        max_workers=MAX_WORKERS,
+        rate_limits=None,
+        max_retries=MAX_RETRIES,
+        backoff_base=BACKOFF_BASE,
+        index=None,
+        on_retry=None,
+        sleep=time.sleep,
+        clock=time.monotonic,
+    ):
+        self.iot_client = iot_client
+        self.policy_name = policy_name
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.index = index
+        self.on_retry = on_retry
+        self.sleep = sleep
+        self.clock = clock
+        limits = dict(DEFAULT_RATE_LIMITS, **(rate_limits or {}))
+        self.limiters = {
+            api: RateLimiter(rate, clock=clock, sleep=sleep)
+            for api, rate in limits.items()
+        }
+        self._rng = random.Random()
+
+    def call(self, api, deadline=None, **kwargs):
+        """Call ``iot_client.<api>`` within its rate limit, retrying
+        throttling and transient errors.
+
+        Raises ``DeadlinePassed`` instead of retrying when the backoff would
+        end after ``deadline`` (a ``clock`` value).
+        """
+        for attempt in range(self.max_retries + 1):
+            self.limiters[api].acquire()
+            try:
+                return getattr(self.iot_client, api)(**kwargs)
+            except Exception as error:
+                if (
+                    _error_code(error) not in RETRYABLE_ERRORS
+                    or attempt == self.max_retries
+                ):
+                    raise ProvisioningError(api, error)
+                # Full jitter keeps retrying workers from moving in lockstep.
+                backoff = min(BACKOFF_CAP, self.backoff_base * 2 ** attempt)
+                delay = self._rng.uniform(0, backoff)
+                if deadline is not None and self.clock() + delay >= deadline:
+                    raise DeadlinePassed(api, error)
+            if self.on_retry is not None:
+                self.on_retry()
+            self.sleep(delay)
+
+    def provision_device(
+        self, unique_id, certificate_chain, progress=None, deadline=None
+    ):
+        """Register one device, starting after the steps in ``progress``,
+        and return its report. A device whose step was still being retried
+        at ``deadline`` is reported as ``pending``."""
+        report = {"uniqueId": unique_id, "thingName": THING_PREFIX + unique_id}
+        progress = dict(progress or {"step": 0})
+        try:
+            fingerprint = certificate_fingerprint(certificate_chain)
+        except ValueError as error:
+            report.update(status="failed", step=STEPS[0], error=str(error))
+            return report
+        try:
+            for step in range(progress["step"], len(STEPS)):
+                self._run_step(
+                    STEPS[step],
+                    report,
+                    progress,
+                    certificate_chain,
+                    fingerprint,
+                    deadline,
+                )
+                progress["step"] = step + 1
+                self._record(unique_id, fingerprint, progress)
+        except DeadlinePassed as error:
+            report.update(status="pending", step=error.step)
+            return report
+        except ProvisioningError as error:
+            report.update(status="failed", step=error.step, error=str(error))
+            return report
+        report["certificateArn"] = progress["certificateArn"]
+        report["status"] = "provisioned"
+        return report
+
+    def _run_step(
+        self, step, report, progress, certificate_chain, certificate_id, deadline
+    ):
+        if step == "register_certificate_without_ca":
+            try:
+                response = self.call(step, deadline, certificatePem=certificate_chain)
+            except ProvisioningError as error:
+                if error.code != "ResourceAlreadyExistsException":
+                    raise
+                # Registered by a run that stopped before recording it.
+                response = self.call(
+                    "describe_certificate", deadline, certificateId=certificate_id
+                )["certificateDescription"]
+            progress["certificateArn"] = response["certificateArn"]
+        elif step == "attach_policy":
+            self.call(
+                step,
+                deadline,
+                policyName=self.policy_name,
+                target=progress["certificateArn"],
+            )
+        elif step == "update_certificate":
+            self.call(step, deadline, certificateId=certificate_id, newStatus="ACTIVE")
+        elif step == "create_thing":
+            self.call(step, deadline, thingName=report["thingName"])
+        elif step == "attach_thing_principal":
+            self.call(
+                step,
+                deadline,
+                thingName=report["thingName"],
+                principal=progress["certificateArn"],
+            )
+
+    def _record(self, unique_id, fingerprint, progress):
+        if self.index is None:
+            return
+        try:
+            self.index.put(unique_id, fingerprint, progress)
+        except Exception as error:
+            raise ProvisioningError("record_progress", error)
+
+    def lookup(self, devices):
+        """Return the indexed progress of each device, or None, in order."""
+        if self.index is None:
+            return [None] * len(devices)
+        keys = []
+        for unique_id, certificate_chain in devices:
+            try:
+                keys.append((unique_id, certificate_fingerprint(certificate_chain)))
+            except ValueError:
+                keys.append(None)
+        found = self.index.get_many(key for key in keys if key is not None)
+        return [found.get(key) for key in keys]
+
+    def provision(self, devices, deadline=None):
+        """Provision ``(unique_id, certificate_chain)`` pairs.
+
+        Devices the index shows as provisioned are reported as such, with
+        ``skipped`` set, without any IoT call. Devices not started before
+        ``deadline`` (a ``clock`` value), or still retrying a step when it
+        passes, are reported as ``pending``.
+        Returns one report per device, in order.
+        """
+        devices = list(devices)
+
+        def run(device, progress):
+            unique_id = device[0]
+            if progress is not None and progress["step"] == len(STEPS):
+                return {
+                    "uniqueId": unique_id,
+                    "thingName": THING_PREFIX + unique_id,
+                    "certificateArn": progress["certificateArn"],
+                    "status": "provisioned",
+                    "skipped": True,
+                }
+            if deadline is not None and self.clock() >= deadline:
+                return {
+                    "uniqueId": unique_id,
+                    "thingName": THING_PREFIX + unique_id,
+                    "status": "pending",
+                }
+            return self.provision_device(*device, progress=progress, deadline=deadline)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(run, devices, self.lookup(devices)))
@@ -1,62 +1,113 @@
 import sys
-from awsglue.dynamicframe import DynamicFrame
+from functools import reduce
 from awsglue.utils import getResolvedOptions
 from pyspark.context import SparkContext
+from pyspark.sql import functions as F
 from awsglue.context import GlueContext
 from awsglue.job import Job
-from awsglue.dynamicframe import DynamicFrame
 data_sheets = ['volts', 'amps', 'watts', 'power_factor', 'watt_hours']
 args = getResolvedOptions(sys.argv, ['JOB_NAME',
                                      'database',
                                      'ingest_table',
                                      'target_bucket',
                                      'TempDir'])
+# With --incremental true the job relies on its bookmark (transformation_ctx)
+# to read only archive files added since the previous run and appends the
+# result to the combined dataset instead of rewriting it.
+incremental = False
+if '--incremental' in sys.argv:
+    incremental = getResolvedOptions(sys.argv, ['incremental'])['incremental'].lower() == 'true'
 sc = SparkContext()
 glueContext = GlueContext(sc)
 spark = glueContext.spark_session
 job = Job(glueContext)
 job.init(args['JOB_NAME'], args)
+
+
+def pivot_readings(root_df, root_vals_df):
+    joined_data = root_df.join(root_vals_df, (root_df.values == root_vals_df.id),
+                               how="left_outer")
+
+    # One row per reading, then a single pivot on (asset_id, timestamp)
+    # instead of one filtered table and one join per feature.
+    readings = joined_data.where(F.col('name').isin(data_sheets)).select(
+        F.col('asset_id'),
+        F.col('name'),
+        F.col('`values.val.timestamp`').alias('timestamp'),
+        F.when(F.col('property_type') == 'INTEGER', F.col('`values.val.value.int`'))
+         .otherwise(F.col('`values.val.value.double`')).alias('value'))
+
+    return readings.groupBy('asset_id', 'timestamp') \
+        .pivot('name', data_sheets) \
+        .agg(F.first('value')) \
+        .dropna(subset=data_sheets)
+
+
+def feature_column(df, feature):
+    # Relationalize splits a column holding both ints and doubles in two.
+    names = [name for name in (feature, feature + '.int', feature + '.double')
+             if name in df.columns]
+    if not names:
+        return F.lit(None).cast('double').alias(feature)
+    return F.coalesce(*[F.col('`{}`'.format(name)).cast('double') for name in names]) \
+        .alias(feature)
+
+
+def wide_readings(root_df):
+    # Rows the transformation stage already pivoted. Rows it wrote before all
+    # their features arrived are merged with the rest of their timestamp.
+    rows = root_df
+    if 'name' in root_df.columns:
+        rows = rows.where(F.col('name').isNull())
+    rows = rows.select(F.col('asset_id'), F.col('timestamp'),
+                       *[feature_column(root_df, feature) for feature in data_sheets])
+    return rows.groupBy('asset_id', 'timestamp') \
+        .agg(*[F.first(feature, ignorenulls=True).alias(feature)
+               for feature in data_sheets]) \
+        .dropna(subset=data_sheets)
+
+
+def combined_readings(source):
+    relationalize_json = source.relationalize(root_table_name="root",
+                                              staging_path=args['TempDir'])
+    root_df = relationalize_json.select('root').toDF()
+
+    # The archive holds one document per property notification, wide rows
+    # written by the transformation stage with WIDE_ROWS set, or both.
+    tables = []
+    if 'root_values' in relationalize_json.keys():
+        tables.append(pivot_readings(root_df,
+                                     relationalize_json.select('root_values').toDF()))
+    if any(column.split('.')[0] in data_sheets for column in root_df.columns):
+        tables.append(wide_readings(root_df))
+    if not tables:
+        print('No property notifications or wide rows found in {} columns {}; '
+              'nothing to write'.format(args['ingest_table'], root_df.columns))
+        return None
+    return reduce(lambda left, right: left.unionByName(right), tables) \
+        .withColumn('date', F.date_format(F.to_timestamp('timestamp', 'yyyyMMddHHmmss'),
+                                          'yyyy-MM-dd'))
+
+
 DataSource0 = glueContext.create_dynamic_frame.from_catalog(database=args['database'],
                                                             table_name=args['ingest_table'],
                                                             transformation_ctx="DataSource0")
-relationalize_json = DataSource0.relationalize(root_table_name="root",
-                                               staging_path=args['TempDir'])
-
-root_df = relationalize_json.select('root')
-root_vals_df = relationalize_json.select('root_values')
-root_df = root_df.toDF()
-root_vals_df = root_vals_df.toDF()
-joined_data = root_df.join(root_vals_df, (root_df.values == root_vals_df.id),
-                           how="left_outer")
-joined_data.createOrReplaceTempView("join_table")
-columns = []
-for i, d in enumerate(data_sheets):
-    sql = """SELECT `values.val.timestamp` as timestamp_{},
-    case when `property_type` = 'INTEGER' then `values.val.value.int` else `values.val.value.double` end as {}
-    FROM join_table
-    where `name` = '{}'""".format(i, d, d)
-    current_table = spark.sql(sql)
-    columns.append(current_table)
-
-
-final_table = columns[0].join(columns[1], (columns[0].timestamp_0 == columns[1].timestamp_1), how="left_outer")
-final_table = final_table.join(columns[2], (final_table.timestamp_0 == columns[2].timestamp_2), how="left_outer")
-final_table = final_table.join(columns[3], (final_table.timestamp_0 == columns[3].timestamp_3), how="left_outer")
-final_table = final_table.join(columns[4], (final_table.timestamp_0 == columns[4].timestamp_4), how="left_outer")
-final_table.createOrReplaceTempView("final_table")
-sql = """select `timestamp_0` as timestamp, `volts`, `amps`, `watts`, `power_factor`, `watt_hours` 
-from final_table 
-order by `timestamp_0` desc"""
-
-final_table = spark.sql(sql)
-final_frame = DynamicFrame.fromDF(final_table, glueContext, "final_table")
-final_frame_repartitioned = final_frame.repartition(1)
-DatasinkFinal = glueContext.write_dynamic_frame.from_options(frame=final_frame_repartitioned,
-                                                             format_options={'withHeader': True,
-                                                                             'writeHeader': True},
-                                                             connection_type="s3",
-                                                             format="csv",
-                                                             connection_options={'path': args['target_bucket'],
-                                                                                 'partitionKeys': []},
-                                                             transformation_ctx="DataSinkFinal")
-job.commit()
\ No newline at end of file
+
+# When the bookmark finds nothing new, or the new documents hold no readings,
+# skip the write so no _SUCCESS marker (and no retraining) is produced.
+final_table = None
+if not DataSource0.toDF().rdd.isEmpty():
+    final_table = combined_readings(DataSource0)
+if final_table is not None:
+    # Parquet partitioned by asset and day, sorted only inside each
+    # partition. The sort leads with the partition columns so the writer,
+    # which needs rows grouped by them, keeps the timestamp order in every
+    # file. Spark writes a _SUCCESS marker once every partition is
+    # committed, which triggers model training.
+    final_table.repartition('asset_id', 'date') \
+        .sortWithinPartitions('asset_id', 'date', 'timestamp') \
+        .write \
+        .mode('append' if incremental else 'overwrite') \
+        .partitionBy('asset_id', 'date') \
+        .parquet(args['target_bucket'])
+job.commit()
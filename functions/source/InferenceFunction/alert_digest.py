@@ -0,0 +1,135 @@
+"""Coalesce anomaly alerts into one SNS digest per window.
+
+Threshold crossings are collected per asset with their score statistics.
+``flush`` publishes a single digest covering every asset that crossed since
+the last digest, skipping assets already alerted within ``cooldown``
+seconds, so the number of publish calls no longer follows the number of
+archive objects or of anomalous rows. An asset only counts as alerted once
+a message naming it has been published; if publishing fails it stays
+pending, so a retry reports it. Alert times are only kept for the
+cooldown, so they do not accumulate one per asset ever alerted.
+"""
+import logging
+import time
+
+logger = logging.Logger(__name__)
+
+SUBJECT = "Future Failure Possible - Action Required"
+# SNS messages are limited to 256 KB; larger digests are split.
+MAX_MESSAGE_BYTES = 200 * 1024
+
+
+class AlertAggregator:
+    """Collects crossings and publishes them as digests.
+
+    With ``window`` 0 every ``flush`` publishes; otherwise crossings are held
+    in the container until ``window`` seconds after the first of them, or
+    until a ``flush(force=True)``. Held crossings are lost if the container
+    is never invoked again, so callers force a flush while they still can.
+    """
+
+    def __init__(self, sns_client, topic_arn, cooldown=0, window=0, clock=time.time):
+        self.sns_client = sns_client
+        self.topic_arn = topic_arn
+        self.cooldown = cooldown
+        self.window = window
+        self.clock = clock
+        self.pending = {}
+        self.window_start = None
+        self.last_alerted = {}
+        self.suppressed = 0
+
+    def add(self, asset_id, scores, threshold):
+        """Record the rows of ``asset_id`` scoring at or above ``threshold``."""
+        crossing = [score for score in scores if score >= threshold]
+        if not crossing:
+            return
+        stats = self.pending.get(asset_id)
+        if stats is None:
+            stats = self.pending[asset_id] = {
+                "count": 0,
+                "rows": 0,
+                "sum": 0.0,
+                "max": float("-inf"),
+                "threshold": threshold,
+            }
+            if self.window_start is None:
+                self.window_start = self.clock()
+        stats["count"] += len(crossing)
+        stats["rows"] += len(scores)
+        stats["sum"] += sum(crossing)
+        stats["max"] = max(stats["max"], max(crossing))
+
+    def flush(self, force=False):
+        """Publish the pending digest if its window has passed.
+
+        Returns the number of messages published. When a publish call
+        raises, the assets of the messages not yet published stay pending.
+        """
+        if not self.pending:
+            return 0
+        now = self.clock()
+        if not force and now - self.window_start < self.window:
+            return 0
+        self.last_alerted = {
+            asset_id: alerted
+            for asset_id, alerted in self.last_alerted.items()
+            if now - alerted < self.cooldown
+        }
+        lines = []
+        suppressed = []
+        for asset_id, stats in sorted(dict(self.pending).items()):
+            if now - self.last_alerted.get(asset_id, float("-inf")) < self.cooldown:
+                suppressed.append(asset_id)
+                continue
+            lines.append(
+                (
+                    asset_id,
+                    "Asset {}: {} of {} readings at or above {} "
+                    "(max score {:.3f}, mean {:.3f})".format(
+                        asset_id,
+                        stats["count"],
+                        stats["rows"],
+                        stats["threshold"],
+                        stats["max"],
+                        stats["sum"] / stats["count"],
+                    ),
+                )
+            )
+        published = 0
+        for asset_ids, message in self._messages(lines):
+            logger.debug(message)
+            self.sns_client.publish(
+                TopicArn=self.topic_arn, Message=message, Subject=SUBJECT
+            )
+            published += 1
+            for asset_id in asset_ids:
+                self.last_alerted[asset_id] = now
+                del self.pending[asset_id]
+        for asset_id in suppressed:
+            del self.pending[asset_id]
+        self.suppressed += len(suppressed)
+        self.window_start = None
+        return published
+
+    def _messages(self, lines):
+        """Yield ``(asset_ids, message)`` for ``(asset_id, line)`` pairs."""
+        if not lines:
+            return
+        header = "Failure predicted on {} asset(s). Please perform maintenance.".format(
+            len(lines)
+        )
+        asset_ids = []
+        body = []
+        size = len(header)
+        for asset_id, line in lines:
+            line_size = len(line.encode("utf-8")) + 1
+            if body and size + line_size > MAX_MESSAGE_BYTES:
+                yield asset_ids, "\n".join([header] + body)
+                asset_ids = []
+                body = []
+                size = len(header)
+            asset_ids.append(asset_id)
+            body.append(line)
+            size += line_size
+        yield asset_ids, "\n".join([header] + body)
@@ -1,131 +1,189 @@
 import os
-import boto3
-import json
-import io
-import csv
-import logging
+from alert_digest import AlertAggregator
+from archive_reader import event_object_key, is_archive_key, iter_documents
+from lazy_client import LazyClient
+from metrics import Metrics
+from pivot import index_readings
+from ttl_cache import (
+    DEFAULT_TTL,
+    cached,
+    endpoint_key,
+    find_endpoint,
+    invalidate,
+)
+from scoring import (
+    MAX_PAYLOAD_BYTES,
+    MAX_WORKERS,
+    LocalForestScorer,
+    ScoringDispatcher,
+    SegmentRouter,
+)
+from window_store import WindowStore
 
-logger = logging.Logger(__name__)
+metrics = Metrics("InferenceFunction")
 
 PARAM_NAME = os.environ["PARAM_NAME"]
 TOPIC_ARN = os.environ["TOPIC_ARN"]
+PAYLOAD_LIMIT_BYTES = int(os.getenv("PAYLOAD_LIMIT_BYTES", MAX_PAYLOAD_BYTES))
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", MAX_WORKERS))
+# "endpoint" scores on the SageMaker endpoint, "local" scores in-process with
+# the forest the training function stores under MODEL_OUTPUT_PREFIX.
+SCORING_ENGINE = os.getenv("SCORING_ENGINE", "endpoint")
+MODEL_BUCKET = os.getenv("MODEL_BUCKET")
+MODEL_OUTPUT_PREFIX = os.getenv("MODEL_OUTPUT_PREFIX")
+THRESHOLD_TTL = int(os.getenv("THRESHOLD_TTL_SECONDS", DEFAULT_TTL))
+ENDPOINT_TTL = int(os.getenv("ENDPOINT_TTL_SECONDS", DEFAULT_TTL))
+MODEL_TTL = int(os.getenv("MODEL_TTL_SECONDS", DEFAULT_TTL))
+# Rows per shingle; must match the SHINGLE_SIZE the model was trained with.
+SHINGLE_SIZE = int(os.getenv("SHINGLE_SIZE", "1"))
+PARTIAL_ROW_TTL = int(os.getenv("PARTIAL_ROW_TTL_SECONDS", "900"))
+# An asset alerted within the cooldown is left out of later digests; with a
+# window, crossings from several warm invocations share one digest.
+ALERT_COOLDOWN = int(os.getenv("ALERT_COOLDOWN_SECONDS", "3600"))
+ALERT_WINDOW = int(os.getenv("ALERT_WINDOW_SECONDS", "0"))
+# Held crossings are published by an invocation with less time left than
+# this, since a timeout recycles the container and loses them.
+ALERT_FLUSH_MARGIN = int(os.getenv("ALERT_FLUSH_MARGIN_SECONDS", "15"))
 
-sagemaker_runtime_client = boto3.client("runtime.sagemaker")
-sagemaker_client = boto3.client("sagemaker")
-ssm_client = boto3.client("ssm")
-sns_client = boto3.client("sns")
-s3_client = boto3.client("s3")
+# Local scoring never calls SageMaker, and a batch without crossings never
+# publishes; clients are only created when first used.
+sagemaker_runtime_client = LazyClient("runtime.sagemaker")
+sagemaker_client = LazyClient("sagemaker")
+ssm_client = LazyClient("ssm")
+sns_client = LazyClient("sns")
+s3_client = LazyClient("s3")
 
-threshold = float(ssm_client.get_parameter(Name=PARAM_NAME)["Parameter"]["Value"])
-endpoint_name = None
-existing_endpoints = sagemaker_client.list_endpoints()["Endpoints"]
-for e in existing_endpoints:
-    if e["EndpointName"].startswith("randomcutforest"):
-        endpoint_name = e["EndpointName"]
-        break
+local_model = {"etag": None, "scorer": None}
+window_store = WindowStore(SHINGLE_SIZE, partial_ttl=PARTIAL_ROW_TTL)
+alerts = AlertAggregator(
+    sns_client, TOPIC_ARN, cooldown=ALERT_COOLDOWN, window=ALERT_WINDOW
+)
 
 
-def handler(event, context):
-    volts = []
-    amps = []
-    watts = []
-    power_factor = []
-    watt_hours = []
-    timestamps = []
-    asset_ids = []
+def get_threshold():
+    return cached(
+        "threshold:{}".format(PARAM_NAME),
+        lambda: float(
+            ssm_client.get_parameter(Name=PARAM_NAME)["Parameter"]["Value"]
+        ),
+        THRESHOLD_TTL,
+    )
+
+
+def get_registry():
+    """Return the segment model registry, or an empty one if none is stored."""
+    from model_registry import REGISTRY_FILE_NAME, ModelRegistry
+
+    key = "{}/{}".format(MODEL_OUTPUT_PREFIX, REGISTRY_FILE_NAME)
+
+    def load():
+        try:
+            data = s3_client.get_object(Bucket=MODEL_BUCKET, Key=key)["Body"].read()
+        except s3_client.exceptions.NoSuchKey:
+            return ModelRegistry()
+        return ModelRegistry.loads(data)
+
+    return cached("registry:{}".format(key), load, MODEL_TTL)
+
+
+def get_segment_scorer(key):
+    """Return the scorer for a segment forest; segment keys are versioned, so
+    a cached forest is never stale."""
+    from rcf_local import LocalRandomCutForest
+
+    def load():
+        data = s3_client.get_object(Bucket=MODEL_BUCKET, Key=key)["Body"].read()
+        return LocalForestScorer(LocalRandomCutForest.loads(data))
+
+    return cached("segment_model:{}".format(key), load, MODEL_TTL)
+
+
+def get_router():
+    """Route assets with a segment model to it and the rest to get_scorer."""
+    registry = get_registry()
+    if not registry.models:
+        return get_scorer()
+    return SegmentRouter(registry, get_segment_scorer, get_scorer)
+
+
+def get_scorer():
+    """Return the scorer for the configured engine.
+
+    The local forest is kept across warm invocations; once per MODEL_TTL its
+    ETag is checked and it is only downloaded again when it changed.
+    """
+    if SCORING_ENGINE != "local":
+        return ScoringDispatcher(
+            sagemaker_runtime_client,
+            find_endpoint(sagemaker_client, ttl=ENDPOINT_TTL),
+            payload_limit=PAYLOAD_LIMIT_BYTES,
+            max_workers=SCORING_WORKERS,
+            on_retry=lambda: metrics.count("endpoint_retries"),
+        )
+
+    # Imported lazily so endpoint mode does not pay for loading NumPy.
+    from rcf_local import MODEL_FILE_NAME, LocalRandomCutForest
+
+    key = "{}/{}".format(MODEL_OUTPUT_PREFIX, MODEL_FILE_NAME)
+
+    def load():
+        etag = s3_client.head_object(Bucket=MODEL_BUCKET, Key=key)["ETag"]
+        if etag != local_model["etag"]:
+            data = s3_client.get_object(Bucket=MODEL_BUCKET, Key=key)["Body"].read()
+            local_model["scorer"] = LocalForestScorer(LocalRandomCutForest.loads(data))
+            local_model["etag"] = etag
+        return local_model["scorer"]
+
+    return cached("local_model:{}".format(key), load, MODEL_TTL)
+
+
+def iter_event_documents(event):
     for record in event["Records"]:
         file_bucket = record["s3"]["bucket"]["name"]
-        file_key = record["s3"]["object"]["key"]
-        data_list = (
-            s3_client.get_object(Bucket=file_bucket, Key=file_key)["Body"]
-            .read()
-            .decode("utf-8")
-        )
-        data_list = data_list.replace("}{", "},{")
-        data_list = data_list.rstrip(",")
-        data_list = "[" + data_list
-        data_list = data_list + "]"
-        data_list = json.loads(data_list)
-        for data in data_list:
-            logger.debug(data)
-            property_name = data["name"]
-            asset_id = data["asset_id"]
-            asset_ids.append(asset_id)
-            values = data["values"]
-            for v in values:
-                packet = {
-                    property_name: v["value"],
-                    "timestamp": v["timestamp"],
-                    "asset_id": asset_id,
-                }
-                timestamps.append(v["timestamp"])
-                if property_name.lower() == "volts":
-                    volts.append(packet)
-                elif property_name.lower() == "watts":
-                    watts.append(packet)
-                elif property_name.lower() == "amps":
-                    amps.append(packet)
-                elif property_name.lower() == "watt_hours":
-                    watt_hours.append(packet)
-                elif property_name.lower() == "power_factor":
-                    power_factor.append(packet)
-
-        timestamps = list(set(timestamps))
-        asset_ids = list(set(asset_ids))
-        for asset in asset_ids:
-            final_list = []
-            for t in timestamps:
-                packet = {"timestamp": t}
-                for v in volts:
-                    if v["timestamp"] == t and v["asset_id"] == asset:
-                        packet.update({"volts": v["volts"]})
-                        break
-                for v in amps:
-                    if v["timestamp"] == t and v["asset_id"] == asset:
-                        packet.update({"amps": v["amps"]})
-                        break
-                for v in watts:
-                    if v["timestamp"] == t and v["asset_id"] == asset:
-                        packet.update({"watts": v["watts"]})
-                        break
-                for v in power_factor:
-                    if v["timestamp"] == t and v["asset_id"] == asset:
-                        packet.update({"power_factor": v["power_factor"]})
-                        break
-                for v in watt_hours:
-                    if v["timestamp"] == t and v["asset_id"] == asset:
-                        packet.update({"watt_hours": v["watt_hours"]})
-                        break
-                try:
-                    packet.pop("timestamp")
-                    assert len(packet.keys()) == 5
-                    final_list.append(packet)
-                except AssertionError:
-                    logger.debug("Packet missing data: {}".format(packet))
-                    pass
-
-            keys = final_list[0].keys()
-            csv_file = io.StringIO()
-            dict_writer = csv.DictWriter(csv_file, keys)
-            dict_writer.writerows(final_list)
-            csv_payload = csv_file.getvalue()
-
-            response = sagemaker_runtime_client.invoke_endpoint(
-                EndpointName=endpoint_name, Body=csv_payload, ContentType="text/csv"
-            )
-            body = json.loads(response["Body"].read().decode("utf-8"))
-            scores = body["scores"]
-            for score in scores:
-                prediction = score["score"]
-                if float(prediction) >= threshold:
-                    message = "Failure predicted on asset {}. Please perform maintenance".format(
-                        asset
-                    )
-                    subject = "Future Failure Possible - Action Required"
-                    logger.debug(message)
-                    sns_client.publish(
-                        TopicArn=TOPIC_ARN, Message=message, Subject=subject
-                    )
-                    break
-                else:
-                    pass
+        file_key = event_object_key(record)
+        if not is_archive_key(file_key):
+            continue
+        with metrics.timer("s3_fetch"):
+            body = s3_client.get_object(Bucket=file_bucket, Key=file_key)["Body"]
+        metrics.count("objects")
+        for document in iter_documents(body):
+            yield document
+
+
+def _flush_alerts(context):
+    force = (
+        context is not None
+        and context.get_remaining_time_in_millis() < ALERT_FLUSH_MARGIN * 1000
+    )
+    with metrics.timer("publish"):
+        metrics.count("digests", alerts.flush(force=force))
+
+
+@metrics.instrument
+def handler(event, context):
+    # Documents are decoded as the pivot consumes them; each stage's time
+    # excludes the stages nested in it.
+    documents = metrics.timed_iter("decode", iter_event_documents(event))
+    with metrics.timer("pivot"):
+        readings = index_readings(documents)
+    expired = window_store.expired
+    # Rows split across archive objects are completed by later invocations.
+    with metrics.timer("window"):
+        feature_rows = window_store.add(readings)
+    metrics.count("dropped_packets", window_store.expired - expired)
+    if not feature_rows:
+        _flush_alerts(context)
+        return
+
+    metrics.count("rows", sum(len(rows) for rows in feature_rows.values()))
+    threshold = get_threshold()
+    try:
+        with metrics.timer("score"):
+            asset_scores = get_router().score(feature_rows)
+    except Exception:
+        # The endpoint may have been replaced; look it up again next time.
+        invalidate(endpoint_key())
+        raise
+    for asset, scores in asset_scores.items():
+        alerts.add(asset, scores, threshold)
+    _flush_alerts(context)
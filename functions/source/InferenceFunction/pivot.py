@@ -0,0 +1,63 @@
+"""Pivot archived SiteWise property documents into per-asset feature rows."""
+import logging
+
+logger = logging.Logger(__name__)
+
+# Column order of the CSV payload sent to the model; matches the combined
+# training dataset written by the Glue job.
+FEATURES = ("volts", "amps", "watts", "power_factor", "watt_hours")
+
+
+def index_readings(documents):
+    """Index readings as ``(asset_id, timestamp) -> {feature: value}``.
+
+    Every reading is placed into the index in a single pass, so the cost is
+    linear in the number of readings regardless of how many assets or
+    timestamps a file holds. Documents without ``values`` are wide rows
+    written by the transformation stage, which may lack some features.
+    """
+    index = {}
+    for data in documents:
+        if "values" not in data:
+            key = (data["asset_id"], data["timestamp"])
+            row = index.get(key)
+            if row is None:
+                row = index[key] = {}
+            for feature in FEATURES:
+                if feature in data:
+                    row.setdefault(feature, data[feature])
+            continue
+        property_name = data["name"].lower()
+        if property_name not in FEATURES:
+            continue
+        asset_id = data["asset_id"]
+        for v in data["values"]:
+            key = (asset_id, v["timestamp"])
+            row = index.get(key)
+            if row is None:
+                row = index[key] = {}
+            # First reading wins when a property repeats for a timestamp.
+            row.setdefault(property_name, v["value"])
+    return index
+
+
+def pivot_readings(documents):
+    """Group readings into complete feature rows keyed by asset.
+
+    Returns a dict mapping each asset id to its rows (lists of values in
+    ``FEATURES`` order), sorted by timestamp. Rows missing any of the five
+    features are dropped.
+    """
+    index = index_readings(documents)
+    feature_rows = {}
+    dropped = 0
+    for (asset_id, timestamp) in sorted(index):
+        row = index[(asset_id, timestamp)]
+        if len(row) != len(FEATURES):
+            dropped += 1
+            continue
+        feature_rows.setdefault(asset_id, []).append([row[f] for f in FEATURES])
+
+    if dropped:
+        logger.debug("Dropped {} incomplete packets".format(dropped))
+    return feature_rows
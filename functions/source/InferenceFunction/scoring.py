@@ -0,0 +1,171 @@
+"""Concurrent, size-aware dispatch of rows to the anomaly detection endpoint."""
+import csv
+import io
+import json
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.Logger(__name__)
+
+# SageMaker real-time endpoints reject request bodies above 6 MB.
+MAX_PAYLOAD_BYTES = 5 * 1024 * 1024
+MAX_WORKERS = 8
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.1
+BACKOFF_CAP = 5.0
+RETRYABLE_ERRORS = (
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailable",
+    "InternalFailure",
+)
+
+
+def split_payload(rows, limit_bytes=MAX_PAYLOAD_BYTES):
+    """Yield ``(row_count, csv_payload)`` chunks no larger than ``limit_bytes``.
+
+    Rows are never split; a single row larger than the limit is sent alone.
+    """
+    row_buffer = io.StringIO()
+    csv_writer = csv.writer(row_buffer)
+    lines = []
+    size = 0
+    for row in rows:
+        row_buffer.seek(0)
+        row_buffer.truncate()
+        csv_writer.writerow(row)
+        line = row_buffer.getvalue()
+        line_size = len(line.encode("utf-8"))
+        if lines and size + line_size > limit_bytes:
+            yield len(lines), "".join(lines)
+            lines = []
+            size = 0
+        lines.append(line)
+        size += line_size
+    if lines:
+        yield len(lines), "".join(lines)
+
+
+class ScoringDispatcher:
+    """Score per-asset feature rows against a SageMaker endpoint.
+
+    Payloads for every asset are split at ``payload_limit`` bytes and sent
+    through a bounded thread pool. Throttled calls are retried with jittered
+    exponential backoff, and scores are merged back per asset in row order.
+    ``on_retry``, if given, is called from the worker thread before each
+    retry.
+    """
+
+    def __init__(
+        self,
+        runtime_client,
+        endpoint_name,
+        payload_limit=MAX_PAYLOAD_BYTES,
+        max_workers=MAX_WORKERS,
+        max_retries=MAX_RETRIES,
+        backoff_base=BACKOFF_BASE,
+        on_retry=None,
+    ):
+        self.runtime_client = runtime_client
+        self.endpoint_name = endpoint_name
+        self.payload_limit = payload_limit
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.on_retry = on_retry
+
+    def score(self, feature_rows):
+        """Return a dict mapping each asset id to the scores of its rows."""
+        requests = []
+        for asset, rows in feature_rows.items():
+            for count, payload in split_payload(rows, self.payload_limit):
+                requests.append((asset, count, payload))
+
+        if not requests:
+            return {}
+        workers = min(self.max_workers, len(requests))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(lambda r: self._invoke(r[2]), requests)
+            scores = {}
+            for (asset, count, _), chunk_scores in zip(requests, results):
+                if len(chunk_scores) != count:
+                    logger.debug(
+                        "Expected {} scores for {}, got {}".format(
+                            count, asset, len(chunk_scores)
+                        )
+                    )
+                scores.setdefault(asset, []).extend(chunk_scores)
+        return scores
+
+    def _invoke(self, payload):
+        attempt = 0
+        while True:
+            try:
+                response = self.runtime_client.invoke_endpoint(
+                    EndpointName=self.endpoint_name,
+                    Body=payload,
+                    ContentType="text/csv",
+                )
+                break
+            except Exception as error:
+                code = getattr(error, "response", {}).get("Error", {}).get("Code")
+                if code not in RETRYABLE_ERRORS or attempt >= self.max_retries:
+                    raise
+                if self.on_retry is not None:
+                    self.on_retry()
+                delay = min(BACKOFF_CAP, self.backoff_base * 2 ** attempt)
+                time.sleep(random.uniform(0, delay))
+                attempt += 1
+        body = json.loads(response["Body"].read().decode("utf-8"))
+        return [float(s["score"]) for s in body["scores"]]
+
+
+class LocalForestScorer:
+    """Score per-asset feature rows with an in-process Random Cut Forest.
+
+    Exposes the same ``score`` interface as ``ScoringDispatcher``; all rows of
+    an invocation are scored in one vectorized call.
+    """
+
+    def __init__(self, forest):
+        self.forest = forest
+
+    def score(self, feature_rows):
+        """Return a dict mapping each asset id to the scores of its rows."""
+        rows = [row for asset_rows in feature_rows.values() for row in asset_rows]
+        if not rows:
+            return {}
+        all_scores = self.forest.score(rows).tolist()
+        scores = {}
+        start = 0
+        for asset, asset_rows in feature_rows.items():
+            scores[asset] = all_scores[start : start + len(asset_rows)]
+            start += len(asset_rows)
+        return scores
+
+
+class SegmentRouter:
+    """Route each asset's rows to the forest of its segment.
+
+    ``registry`` maps asset ids to model keys, ``segment_scorer(key)`` returns
+    the scorer for a key and ``fallback()`` the scorer for assets without a
+    segment model. Each scorer is called once with all of its assets.
+    """
+
+    def __init__(self, registry, segment_scorer, fallback):
+        self.registry = registry
+        self.segment_scorer = segment_scorer
+        self.fallback = fallback
+
+    def score(self, feature_rows):
+        """Return a dict mapping each asset id to the scores of its rows."""
+        routed = {}
+        for asset, rows in feature_rows.items():
+            routed.setdefault(self.registry.model_key(asset), {})[asset] = rows
+        scores = {}
+        for key, rows in routed.items():
+            scorer = self.fallback() if key is None else self.segment_scorer(key)
+            scores.update(scorer.score(rows))
+        return scores
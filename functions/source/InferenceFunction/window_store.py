@@ -0,0 +1,108 @@
+"""Per-asset feature windows kept across inference invocations.
+
+Firehose may split the five readings of one ``(asset_id, timestamp)`` across
+two archive objects. Incomplete rows are held here until the missing
+readings arrive (or they expire), and the last complete rows of every asset
+are kept so each row can be scored as a shingle: the row concatenated with
+the ``shingle_size - 1`` rows before it.
+
+State lives in the Lambda container, so it carries over between warm
+invocations only; both partial rows and asset histories are evicted
+oldest-first when they exceed their limits.
+"""
+import collections
+import logging
+import time
+
+from pivot import FEATURES
+
+logger = logging.Logger(__name__)
+
+PARTIAL_TTL = 900
+MAX_PARTIAL_ROWS = 100000
+MAX_ASSETS = 10000
+
+
+class WindowStore:
+    """Stitches partial rows and builds per-asset shingles."""
+
+    def __init__(
+        self,
+        shingle_size=1,
+        partial_ttl=PARTIAL_TTL,
+        max_partial_rows=MAX_PARTIAL_ROWS,
+        max_assets=MAX_ASSETS,
+        clock=time.monotonic,
+    ):
+        self.shingle_size = shingle_size
+        self.partial_ttl = partial_ttl
+        self.max_partial_rows = max_partial_rows
+        self.max_assets = max_assets
+        self.clock = clock
+        # (asset_id, timestamp) -> (first seen, {feature: value}), oldest first.
+        self.partial = collections.OrderedDict()
+        # asset_id -> deque of the last shingle_size - 1 complete rows.
+        self.history = collections.OrderedDict()
+        self.expired = 0
+
+    def add(self, index):
+        """Merge an ``index_readings`` result and return the rows completed
+        by it as ``{asset_id: [shingle, ...]}``, in timestamp order.
+
+        Rows that are still incomplete are kept for later invocations.
+        """
+        now = self.clock()
+        completed = []
+        for key, readings in index.items():
+            pending = self.partial.get(key)
+            if pending is None:
+                row = readings
+            else:
+                row = pending[1]
+                for name, value in readings.items():
+                    # First reading wins when a property repeats.
+                    row.setdefault(name, value)
+            if len(row) == len(FEATURES):
+                if pending is not None:
+                    del self.partial[key]
+                completed.append((key, row))
+            elif pending is None:
+                self.partial[key] = (now, row)
+        self._evict_partial(now)
+
+        shingles = {}
+        for (asset_id, _), row in sorted(completed, key=lambda item: item[0]):
+            shingle = self._shingle(asset_id, [row[name] for name in FEATURES])
+            if shingle is not None:
+                shingles.setdefault(asset_id, []).append(shingle)
+        return shingles
+
+    def _shingle(self, asset_id, row):
+        if self.shingle_size <= 1:
+            return row
+        window = self.history.pop(asset_id, None)
+        if window is None:
+            window = collections.deque(maxlen=self.shingle_size - 1)
+        self.history[asset_id] = window
+        while len(self.history) > self.max_assets:
+            self.history.popitem(last=False)
+        shingle = None
+        if len(window) == self.shingle_size - 1:
+            shingle = [value for previous in window for value in previous] + row
+        window.append(row)
+        return shingle
+
+    def _evict_partial(self, now):
+        dropped = 0
+        while self.partial:
+            key, (first_seen, _) = next(iter(self.partial.items()))
+            if (
+                now - first_seen < self.partial_ttl
+                and len(self.partial) <= self.max_partial_rows
+            ):
+                break
+            del self.partial[key]
+            dropped += 1
+        if dropped:
+            self.expired += dropped
+            logger.debug("Dropped {} incomplete packets".format(dropped))
@@ -0,0 +1,70 @@
+"""Registry of per-segment forests shared by training and inference.
+
+Training can split the fleet into segments, either one per asset or a fixed
+number of asset groups, and grow a local forest for each. The registry
+records how assets map to segments and where each segment's forest is
+stored; assets without a segment model are scored by the global model.
+"""
+import json
+import zlib
+
+REGISTRY_FILE_NAME = "model-registry.json"
+SEGMENT_PREFIX = "segments"
+
+GLOBAL = "global"
+ASSET = "asset"
+GROUP = "group"
+
+
+def segment_of(asset_id, segmentation, segment_count=1):
+    """Return the segment of ``asset_id``, or None for a global model.
+
+    Groups are assigned by a stable hash so an asset keeps its group across
+    training runs and containers.
+    """
+    if asset_id is None:
+        return None
+    if segmentation == ASSET:
+        return asset_id
+    if segmentation == GROUP:
+        return "group-{}".format(zlib.crc32(asset_id.encode("utf-8")) % segment_count)
+    return None
+
+
+def segment_model_key(prefix, version, segment):
+    # Keys are versioned so a cached forest never goes stale in place.
+    return "{}/{}/{}/{}.npz".format(prefix, SEGMENT_PREFIX, version, segment)
+
+
+class ModelRegistry:
+    """Maps segments to the S3 keys of their forests."""
+
+    def __init__(
+        self, segmentation=GLOBAL, segment_count=1, version=None, models=None
+    ):
+        self.segmentation = segmentation
+        self.segment_count = segment_count
+        self.version = version
+        self.models = models or {}
+
+    def segment(self, asset_id):
+        return segment_of(asset_id, self.segmentation, self.segment_count)
+
+    def model_key(self, asset_id):
+        """Return the key of the forest for ``asset_id``, or None."""
+        return self.models.get(self.segment(asset_id))
+
+    def dumps(self):
+        return json.dumps(
+            {
+                "segmentation": self.segmentation,
+                "segment_count": self.segment_count,
+                "version": self.version,
+                "models": self.models,
+            },
+            separators=(",", ":"),
+        ).encode("utf-8")
+
+    @classmethod
+    def loads(cls, data):
+        return cls(**json.loads(data))
@@ -0,0 +1,178 @@
+"""Array-backed Random Cut Forest for in-process anomaly scoring.
+
+Trees are stored as flat NumPy arrays (one row per tree, one column per node)
+so a whole batch of points can be routed and scored with vectorized
+operations. Scores follow the Random Cut Forest anomaly score used by the
+SageMaker algorithm: on the order of 1 for typical points and growing toward
+``log2(samples_per_tree + 1)`` for points isolated at the root, so the same
+``threshold`` parameter applies to both engines.
+"""
+import io
+
+import numpy as np
+
+# Stored under MODEL_OUTPUT_PREFIX next to the SageMaker training output.
+MODEL_FILE_NAME = "rcf-local.npz"
+SCORE_BATCH_SIZE = 4096
+
+
+class LocalRandomCutForest:
+    """Random Cut Forest whose trees live in compact arrays."""
+
+    def __init__(
+        self, left, right, cut_dim, cut_value, bbox_min, bbox_max, mass, depth
+    ):
+        self.left = left
+        self.right = right
+        self.cut_dim = cut_dim
+        self.cut_value = cut_value
+        self.bbox_min = bbox_min
+        self.bbox_max = bbox_max
+        self.mass = mass
+        self.depth = depth
+
+    @property
+    def num_trees(self):
+        return self.left.shape[0]
+
+    @classmethod
+    def fit(cls, data, num_trees, samples_per_tree, seed=None):
+        """Build a forest from ``data`` (rows x features).
+
+        Each tree is grown from an independent uniform sample of
+        ``samples_per_tree`` rows, matching the SageMaker hyperparameters.
+        """
+        rng = np.random.default_rng(seed)
+        data = np.asarray(data, dtype=np.float64)
+        num_rows, num_features = data.shape
+        sample_size = min(samples_per_tree, num_rows)
+        max_nodes = max(1, 2 * sample_size - 1)
+
+        left = np.full((num_trees, max_nodes), -1, dtype=np.int32)
+        right = np.full((num_trees, max_nodes), -1, dtype=np.int32)
+        cut_dim = np.zeros((num_trees, max_nodes), dtype=np.int32)
+        cut_value = np.zeros((num_trees, max_nodes), dtype=np.float64)
+        bbox_min = np.zeros((num_trees, max_nodes, num_features), dtype=np.float64)
+        bbox_max = np.zeros((num_trees, max_nodes, num_features), dtype=np.float64)
+        mass = np.zeros((num_trees, max_nodes), dtype=np.int32)
+        depth = np.zeros((num_trees, max_nodes), dtype=np.int32)
+
+        for t in range(num_trees):
+            sample = data[rng.choice(num_rows, size=sample_size, replace=False)]
+            stack = [(sample, 0, 0)]
+            next_node = 1
+            while stack:
+                points, node, node_depth = stack.pop()
+                lo = points.min(axis=0)
+                hi = points.max(axis=0)
+                bbox_min[t, node] = lo
+                bbox_max[t, node] = hi
+                mass[t, node] = len(points)
+                depth[t, node] = node_depth
+                ranges = hi - lo
+                total = ranges.sum()
+                if total <= 0:
+                    continue
+                dim = rng.choice(num_features, p=ranges / total)
+                cut = rng.uniform(lo[dim], hi[dim])
+                go_left = points[:, dim] <= cut
+                cut_dim[t, node] = dim
+                cut_value[t, node] = cut
+                left[t, node] = next_node
+                right[t, node] = next_node + 1
+                stack.append((points[go_left], next_node, node_depth + 1))
+                stack.append((points[~go_left], next_node + 1, node_depth + 1))
+                next_node += 2
+
+        return cls(left, right, cut_dim, cut_value, bbox_min, bbox_max, mass, depth)
+
+    def score(self, points):
+        """Return the anomaly score of every row in ``points``."""
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        # Bound the (trees x points x features) temporaries.
+        return np.concatenate(
+            [
+                self._score_batch(points[start : start + SCORE_BATCH_SIZE])
+                for start in range(0, len(points), SCORE_BATCH_SIZE)
+            ]
+            or [np.zeros(0)]
+        )
+
+    def _score_batch(self, points):
+        count = points.shape[0]
+        # Route every point through every tree at once: index arrays are
+        # (trees x points), bounding boxes (trees x points x features).
+        trees = np.arange(self.num_trees)[:, None]
+        max_depth = int(self.depth.max())
+
+        node = np.zeros((self.num_trees, count), dtype=np.int32)
+        path = [node]
+        for _ in range(max_depth):
+            children = self.left[trees, node]
+            cut_points = points[np.arange(count), self.cut_dim[trees, node]]
+            go_left = cut_points <= self.cut_value[trees, node]
+            child = np.where(go_left, children, self.right[trees, node])
+            node = np.where(children < 0, node, child)
+            path.append(node)
+
+        leaf_depth = self.depth[trees, node]
+        leaf_mass = self.mass[trees, node]
+        tree_mass = self.mass[:, :1]
+        seen = np.all(points == self.bbox_min[trees, node], axis=2)
+        damp = 1.0 - leaf_mass / (2.0 * tree_mass)
+        score = np.where(
+            seen,
+            damp / (leaf_depth + np.log2(leaf_mass + 1.0)),
+            1.0 / (leaf_depth + 1.0),
+        )
+
+        # Walk back up the path, weighting each ancestor by the chance a
+        # random cut there would have isolated the point.
+        for step in range(max_depth - 1, -1, -1):
+            ancestor = path[step]
+            lo = self.bbox_min[trees, ancestor]
+            hi = self.bbox_max[trees, ancestor]
+            box_range = (hi - lo).sum(axis=2)
+            merged = np.maximum(hi, points) - np.minimum(lo, points)
+            merged_range = merged.sum(axis=2)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                prob_cut = np.where(
+                    merged_range > 0,
+                    (merged_range - box_range) / merged_range,
+                    0.0,
+                )
+            updated = prob_cut / (step + 1.0) + (1.0 - prob_cut) * score
+            score = np.where(step < leaf_depth, updated, score)
+
+        return (score * np.log2(tree_mass + 1.0)).mean(axis=0)
+
+    def dumps(self):
+        """Serialize the forest to ``.npz`` bytes."""
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            left=self.left,
+            right=self.right,
+            cut_dim=self.cut_dim,
+            cut_value=self.cut_value,
+            bbox_min=self.bbox_min,
+            bbox_max=self.bbox_max,
+            mass=self.mass,
+            depth=self.depth,
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def loads(cls, data):
+        """Load a forest serialized with :meth:`dumps`."""
+        arrays = np.load(io.BytesIO(data))
+        return cls(
+            arrays["left"],
+            arrays["right"],
+            arrays["cut_dim"],
+            arrays["cut_value"],
+            arrays["bbox_min"],
+            arrays["bbox_max"],
+            arrays["mass"],
+            arrays["depth"],
+        )
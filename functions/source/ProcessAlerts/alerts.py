@@ -1,23 +1,237 @@
 """Temperature threshold excess handler."""
+import json
 import os
 import logging
-import boto3
+import threading
+import time
+from lazy_client import LazyClient
+from metrics import Metrics
 
 logger = logging.getLogger("lambda_logger")
 logger.setLevel(logging.DEBUG)
-sns = boto3.client("sns")  # type: botostubs.SNS
+sns = LazyClient("sns")  # type: botostubs.SNS
+sqs = LazyClient("sqs")
+metrics = Metrics("ProcessAlerts")
 
+# Digest publishes per second and the burst allowed above that rate.
+PUBLISH_RATE = float(os.getenv("PUBLISH_RATE", "1"))
+PUBLISH_BURST = int(os.getenv("PUBLISH_BURST", "5"))
+DEVICES_PER_MESSAGE = int(os.getenv("DEVICES_PER_MESSAGE", "100"))
+# How long a batch may wait for publish tokens, and how soon the records of
+# devices it still could not publish are delivered again.
+PUBLISH_WAIT = float(os.getenv("PUBLISH_WAIT_SECONDS", "10"))
+RETRY_DELAY = int(os.getenv("RETRY_DELAY_SECONDS", "30"))
+# Time kept free at the end of an invocation for deferring records.
+DEFER_MARGIN = 5
 
+
+class TokenBucket:
+    """Allows ``rate`` operations per second with bursts of ``capacity``."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(capacity)
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """Take a token if one is available; never waits."""
+        with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def wait(self, timeout):
+        """Take a token, waiting up to ``timeout`` seconds for one."""
+        deadline = self.clock() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                if self.rate <= 0:
+                    return False
+                delay = (1 - self.tokens) / self.rate
+            if self.clock() + delay > deadline:
+                return False
+            self.sleep(delay)
+
+
+publish_bucket = TokenBucket(PUBLISH_RATE, PUBLISH_BURST)
+
+
+@metrics.instrument
 def process_alerts(event, context):
     """Surface and publish device telemetry."""
-    logger.debug(event)
-
-    sns.publish(
-        Subject="Watts threshold excess",
-        Message="The wattage recorded for device with serial {0} is {1}".format(
-            event["serial"], event["watts"]
-        ),
-        TopicArn=os.environ["TOPIC_ARN"],
-    )
+    metrics.debug("Watts alert for device {}", event.get("serial"))
+
+    with metrics.timer("publish"):
+        sns.publish(
+            Subject="Watts threshold excess",
+            Message="The wattage recorded for device with serial {0} is {1}".format(
+                event["serial"], event["watts"]
+            ),
+            TopicArn=os.environ["TOPIC_ARN"],
+        )
+    metrics.count("digests")
 
     return {"statusCode": 200}
+
+
+def iter_alert_records(event):
+    """Yield ``(item_id, reading)`` from an SQS batch or a list of readings."""
+    if isinstance(event, dict) and "Records" in event:
+        for record in event["Records"]:
+            yield record["messageId"], record["body"]
+        return
+    readings = event.get("events", []) if isinstance(event, dict) else event
+    for index, reading in enumerate(readings):
+        yield str(index), reading
+
+
+def group_by_device(event):
+    """Map each serial to its peak and latest watts, the number of readings
+    and the ids of the records they came from.
+
+    Malformed records are logged, counted and skipped: they can never be
+    parsed, so delivering them again would only hold up the queue.
+    """
+    devices = {}
+    for item_id, reading in iter_alert_records(event):
+        try:
+            if isinstance(reading, str):
+                reading = json.loads(reading)
+            serial = reading["serial"]
+            watts = float(reading["watts"])
+        except (KeyError, TypeError, ValueError):
+            logger.warning("Dropping malformed alert record {}".format(item_id))
+            metrics.count("malformed")
+            continue
+        device = devices.get(serial)
+        if device is None:
+            device = devices[serial] = {"peak": watts, "readings": 0, "items": []}
+        device["peak"] = max(device["peak"], watts)
+        device["latest"] = watts
+        device["readings"] += 1
+        device["items"].append(item_id)
+    return devices
+
+
+def queue_url(arn):
+    """Return the URL of the SQS queue ``arn``."""
+    _, partition, _, region, account, name = arn.split(":")
+    domain = "amazonaws.com.cn" if partition == "aws-cn" else "amazonaws.com"
+    return "https://sqs.{}.{}/{}/{}".format(region, domain, account, name)
+
+
+def defer_records(records, delay):
+    """Make SQS deliver ``records`` again in ``delay`` seconds instead of
+    after the queue's visibility timeout. Returns the number deferred."""
+    by_queue = {}
+    for record in records:
+        by_queue.setdefault(record["eventSourceARN"], []).append(record)
+    deferred = 0
+    for arn, queued in by_queue.items():
+        for start in range(0, len(queued), 10):
+            entries = [
+                {
+                    "Id": str(index),
+                    "ReceiptHandle": record["receiptHandle"],
+                    "VisibilityTimeout": delay,
+                }
+                for index, record in enumerate(queued[start : start + 10])
+            ]
+            try:
+                response = sqs.change_message_visibility_batch(
+                    QueueUrl=queue_url(arn), Entries=entries
+                )
+            except Exception as error:
+                # The records still come back after the visibility timeout.
+                logger.warning("Unable to defer alert records: {}".format(error))
+                continue
+            deferred += len(response.get("Successful", []))
+    return deferred
+
+
+def _remaining_seconds(context):
+    if context is None:
+        return float("inf")
+    return context.get_remaining_time_in_millis() / 1000 - DEFER_MARGIN
+
+
+def digest_message(devices, serials):
+    lines = [
+        "Device {}: latest {} W, peak {} W over {} readings".format(
+            serial,
+            devices[serial]["latest"],
+            devices[serial]["peak"],
+            devices[serial]["readings"],
+        )
+        for serial in serials
+    ]
+    header = "The wattage threshold was exceeded by {} device(s).".format(
+        len(serials)
+    )
+    return "\n".join([header] + lines)
+
+
+@metrics.instrument
+def process_alert_batch(event, context):
+    """Publish one digest per DEVICES_PER_MESSAGE devices in a batch.
+
+    Accepts an SQS event or a list of ``{serial, watts}`` readings. Digests
+    are limited by a token bucket, waited on for up to PUBLISH_WAIT seconds.
+    Records of devices that could not be published are returned as batch
+    item failures so SQS redelivers them, after RETRY_DELAY seconds rather
+    than a whole visibility timeout. Malformed records are acknowledged.
+    """
+    with metrics.timer("group"):
+        devices = group_by_device(event)
+    metrics.count("devices", len(devices))
+    retry = []
+    serials = sorted(devices)
+    wait = min(PUBLISH_WAIT, _remaining_seconds(context))
+    deadline = time.monotonic() + wait
+    for start in range(0, len(serials), DEVICES_PER_MESSAGE):
+        chunk = serials[start : start + DEVICES_PER_MESSAGE]
+        with metrics.timer("throttled"):
+            allowed = publish_bucket.wait(max(deadline - time.monotonic(), 0))
+        if not allowed:
+            deferred = len(serials) - start
+            logger.info("Publish rate exceeded, deferring {} devices".format(deferred))
+            metrics.count("deferred_devices", deferred)
+            for serial in serials[start:]:
+                retry.extend(devices[serial]["items"])
+            break
+        try:
+            with metrics.timer("publish"):
+                sns.publish(
+                    Subject="Watts threshold excess",
+                    Message=digest_message(devices, chunk),
+                    TopicArn=os.environ["TOPIC_ARN"],
+                )
+            metrics.count("digests")
+        except Exception as error:
+            logger.warning("Unable to publish digest: {}".format(error))
+            for serial in chunk:
+                retry.extend(devices[serial]["items"])
+    if retry and isinstance(event, dict) and "Records" in event:
+        retried = set(retry)
+        with metrics.timer("defer"):
+            defer_records(
+                [r for r in event["Records"] if r["messageId"] in retried],
+                RETRY_DELAY,
+            )
+    metrics.count("failed_items", len(retry))
+    return {"batchItemFailures": [{"itemIdentifier": item} for item in retry]}
@@ -0,0 +1,150 @@
+"""Read the SiteWise archive written by the Firehose delivery stream.
+
+Archive objects hold newline-delimited (or, for older objects, directly
+concatenated) JSON documents, optionally gzip compressed, under
+``asset=<asset_id>/dt=<YYYY-MM-DD>/hour=<HH>/`` partitions. Documents are
+streamed in chunks so memory stays bounded regardless of object size, and
+partitions are listed by prefix without listing the objects in them.
+"""
+import codecs
+import json
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
+
+CHUNK_SIZE = 64 * 1024
+# Prefixes Firehose writes failed records under; these are not archive data.
+ERROR_PREFIXES = ("errors/", "processing-failed/")
+GZIP_MAGIC = b"\x1f\x8b"
+
+_decoder = json.JSONDecoder()
+# Separators that may appear between documents.
+_SEPARATORS = " \t\r\n,"
+
+
+def _iter_chunks(body, chunk_size):
+    """Yield raw chunks of ``body``, transparently gunzipping it."""
+    chunk = body.read(max(chunk_size, len(GZIP_MAGIC)))
+    if not chunk.startswith(GZIP_MAGIC):
+        while chunk:
+            yield chunk
+            chunk = body.read(chunk_size)
+        return
+    # wbits=47 accepts gzip headers; a new decompressor is started for each
+    # concatenated gzip member.
+    decompressor = zlib.decompressobj(wbits=47)
+    while chunk:
+        data = b""
+        while chunk:
+            if decompressor.eof:
+                decompressor = zlib.decompressobj(wbits=47)
+            data += decompressor.decompress(chunk)
+            chunk = decompressor.unused_data
+        if data:
+            yield data
+        chunk = body.read(chunk_size)
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def iter_documents(body, chunk_size=CHUNK_SIZE):
+    """Yield the JSON documents of an archive object one at a time.
+
+    ``body`` is any binary file-like object, such as the ``Body`` returned by
+    ``s3.get_object``. Only the text of the document currently being decoded
+    is buffered.
+    """
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = _iter_chunks(body, chunk_size)
+    buffer = ""
+    eof = False
+    while True:
+        pos = _skip_separators(buffer, 0)
+        while pos < len(buffer):
+            try:
+                document, end = _decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The document continues in the next chunk.
+                if eof:
+                    raise
+                break
+            yield document
+            pos = _skip_separators(buffer, end)
+        buffer = buffer[pos:]
+        if eof:
+            return
+
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            buffer += text_decoder.decode(b"", final=True)
+            if not buffer:
+                return
+        else:
+            buffer += text_decoder.decode(chunk)
+
+
+def _skip_separators(buffer, pos):
+    length = len(buffer)
+    while pos < length and buffer[pos] in _SEPARATORS:
+        pos += 1
+    return pos
+
+
+def event_object_key(record):
+    """Return the object key of an S3 event record.
+
+    Keys in S3 event notifications are URL encoded, which matters for the
+    ``=`` in partition prefixes.
+    """
+    return unquote_plus(record["s3"]["object"]["key"])
+
+
+def is_archive_key(key):
+    return not key.startswith(ERROR_PREFIXES)
+
+
+def list_archive_partitions(
+    s3_client, bucket, since_date=None, deadline=None, workers=1
+):
+    """Return ``(asset_id, date, hour)`` for every archive partition.
+
+    With ``since_date`` (``YYYY-MM-DD``) only partitions on or after that day
+    are listed; earlier days are skipped server side with ``StartAfter``.
+    Assets are listed by up to ``workers`` threads. When ``deadline`` (a
+    ``time.monotonic`` value) passes before the listing is complete,
+    ``TimeoutError`` is raised.
+    """
+    paginator = s3_client.get_paginator("list_objects_v2")
+
+    def children(prefix, start_after=None):
+        kwargs = {"Bucket": bucket, "Prefix": prefix, "Delimiter": "/"}
+        if start_after:
+            kwargs["StartAfter"] = start_after
+        for page in paginator.paginate(**kwargs):
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError("listing {} timed out".format(prefix))
+            for common in page.get("CommonPrefixes", []):
+                child = common["Prefix"]
+                yield child, child[len(prefix) : -1]
+
+    def asset_partitions(asset):
+        asset_prefix, asset_id = asset
+        date_prefix = asset_prefix + "dt="
+        start_after = date_prefix + since_date if since_date else None
+        return [
+            (asset_id, date, hour)
+            for hour_parent, date in children(date_prefix, start_after)
+            for _, hour in children(hour_parent + "hour=")
+        ]
+
+    assets = list(children("asset="))
+    if workers <= 1 or len(assets) <= 1:
+        listings = map(asset_partitions, assets)
+        return [partition for listing in listings for partition in listing]
+    with ThreadPoolExecutor(max_workers=min(workers, len(assets))) as executor:
+        listings = executor.map(asset_partitions, assets)
+        return [partition for listing in listings for partition in listing]
+
@@ -0,0 +1,39 @@
+"""boto3 clients created on first use.
+
+Importing boto3 and building a client's service model take a large part
+of a cold start. A ``LazyClient`` defers both until a handler first calls
+the client, so a container only pays for the clients its invocations use.
+"""
+import threading
+
+
+class LazyClient:
+    """Stands in for ``boto3.client(service_name, **kwargs)``.
+
+    Attribute access, including ``exceptions``, goes to the real client,
+    which is created once and shared by all threads. ``factory`` replaces
+    ``boto3.client``, e.g. to hand out stubs.
+    """
+
+    def __init__(self, service_name, factory=None, **kwargs):
+        self.service_name = service_name
+        self.factory = factory
+        self.kwargs = kwargs
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    factory = self.factory
+                    if factory is None:
+                        import boto3
+
+                        factory = boto3.client
+                    self._client = factory(self.service_name, **self.kwargs)
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
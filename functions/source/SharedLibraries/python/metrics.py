@@ -0,0 +1,258 @@
+"""Per-stage timings and counters emitted in CloudWatch Embedded Metric Format.
+
+A ``Metrics`` object collects the stage times and counts of one invocation
+and prints them as a single EMF JSON line when it is flushed; CloudWatch
+Logs turns the line into metrics, so nothing calls PutMetricData on the hot
+path. Stage times are exclusive: time spent in a stage timed inside another
+is only counted once, in the inner stage. ``invocation`` is the handler's
+total time.
+
+Invocations are sampled at METRICS_SAMPLE_RATE. Unsampled invocations skip
+the timing and print nothing, and so do ``debug`` messages unless
+METRICS_DEBUG is set. PROFILE_STAGES names stages, or ``*`` for all of
+them, to run under cProfile on sampled invocations; the PROFILE_LIMIT
+functions with the most cumulative time are printed after the metrics.
+"""
+import contextlib
+import functools
+import io
+import json
+import os
+import random
+import threading
+import time
+
+NAMESPACE = os.getenv("METRICS_NAMESPACE", "ConnectSense")
+SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "1"))
+DEBUG = os.getenv("METRICS_DEBUG", "false").lower() == "true"
+PROFILE_STAGES = frozenset(
+    stage.strip() for stage in os.getenv("PROFILE_STAGES", "").split(",")
+) - {""}
+PROFILE_LIMIT = int(os.getenv("PROFILE_LIMIT", "25"))
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+        self.profiler = None
+
+    def __enter__(self):
+        self.profiler = self.metrics._start_profile(self.stage)
+        self.metrics._enter()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics._exit(self.stage, time.perf_counter() - self.start)
+        if self.profiler is not None:
+            self.metrics._stop_profile(self.profiler)
+        return False
+
+
+class Metrics:
+    """Stage times, counts and properties of the current invocation."""
+
+    def __init__(
+        self,
+        service,
+        namespace=NAMESPACE,
+        sample_rate=SAMPLE_RATE,
+        debug=DEBUG,
+        profile_stages=PROFILE_STAGES,
+        emit=print,
+        rng=random.random,
+    ):
+        self.service = service
+        self.namespace = namespace
+        self.sample_rate = sample_rate
+        self.debug_enabled = debug
+        self.profile_stages = frozenset(profile_stages)
+        self.emit = emit
+        self.rng = rng
+        self.active = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._reset()
+
+    def _reset(self):
+        self.times = {}
+        self.counts = {}
+        self.properties = {}
+        self._stats = None
+
+    def start(self):
+        """Begin an invocation; returns whether it is sampled."""
+        self._reset()
+        self.active = self.sample_rate >= 1 or self.rng() < self.sample_rate
+        return self.active
+
+    def timer(self, stage):
+        """Context manager adding the time spent in it to ``stage``."""
+        if not self.active:
+            return NULL_TIMER
+        return _Timer(self, stage)
+
+    def timed(self, stage):
+        """Decorator timing every call of a function as ``stage``."""
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def timed_iter(self, stage, iterable):
+        """Yield from ``iterable``, adding the time spent producing each item
+        to ``stage``."""
+        if not self.active:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            self._enter()
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._exit(stage, time.perf_counter() - start)
+            yield item
+
+    def add_time(self, stage, seconds):
+        if not self.active:
+            return
+        with self._lock:
+            self.times[stage] = self.times.get(stage, 0.0) + seconds
+
+    def count(self, name, value=1):
+        if not self.active:
+            return
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def set_property(self, name, value):
+        """Log ``value`` with the metrics without making it a metric."""
+        if self.active:
+            self.properties[name] = value
+
+    def debug(self, message, *args, **kwargs):
+        """Print ``message.format(*args, **kwargs)`` on sampled invocations
+        when METRICS_DEBUG is set; nothing is formatted otherwise."""
+        if self.active and self.debug_enabled:
+            self.emit(message.format(*args, **kwargs))
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _enter(self):
+        self._stack().append(0.0)
+
+    def _exit(self, stage, elapsed):
+        stack = self._stack()
+        self.add_time(stage, elapsed - stack.pop())
+        if stack:
+            stack[-1] += elapsed
+
+    def _start_profile(self, stage):
+        if not self.profile_stages or getattr(self._local, "profiling", False):
+            return None
+        if stage not in self.profile_stages and "*" not in self.profile_stages:
+            return None
+        import cProfile
+
+        # A thread can only run one profiler; nested stages share it.
+        self._local.profiling = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _stop_profile(self, profiler):
+        import pstats
+
+        profiler.disable()
+        self._local.profiling = False
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profiler)
+            else:
+                self._stats.add(profiler)
+
+    def flush(self):
+        """Print the invocation's metrics as one EMF line and return the
+        document, or None when the invocation was not sampled."""
+        if not self.active:
+            return None
+        self.active = False
+        definitions = []
+        values = {}
+        for stage, seconds in self.times.items():
+            definitions.append({"Name": stage + "_ms", "Unit": "Milliseconds"})
+            values[stage + "_ms"] = round(seconds * 1000, 3)
+        for name, value in self.counts.items():
+            definitions.append({"Name": name, "Unit": "Count"})
+            values[name] = value
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": [["Service"]],
+                        "Metrics": definitions,
+                    }
+                ],
+            },
+            "Service": self.service,
+            "SampleRate": self.sample_rate,
+        }
+        document.update(self.properties)
+        document.update(values)
+        self.emit(json.dumps(document))
+        if self._stats is not None:
+            stream = io.StringIO()
+            self._stats.stream = stream
+            self._stats.sort_stats("cumulative").print_stats(PROFILE_LIMIT)
+            self.emit(stream.getvalue())
+        return document
+
+    @contextlib.contextmanager
+    def invocation(self):
+        """Sample, time and flush one invocation."""
+        self.start()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_time("invocation", time.perf_counter() - start)
+            self.flush()
+
+    def instrument(self, handler):
+        """Decorator running every call of a Lambda handler in
+        ``invocation``."""
+
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            with self.invocation():
+                return handler(event, context)
+
+        return wrapper
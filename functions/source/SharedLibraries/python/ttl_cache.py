@@ -0,0 +1,81 @@
+"""TTL cache for control-plane lookups shared by the Lambda functions.
+
+Values are loaded lazily on first use and kept for a per-key time to live,
+so a warm container makes each lookup once per TTL instead of once per cold
+start and still picks up new endpoints, thresholds and asset models.
+"""
+import os
+import threading
+import time
+
+DEFAULT_TTL = int(os.getenv("CACHE_TTL_SECONDS", "300"))
+ENDPOINT_PREFIX = "randomcutforest"
+
+
+class TTLCache:
+    """Thread-safe mapping of keys to lazily loaded, expiring values."""
+
+    def __init__(self, default_ttl=DEFAULT_TTL, clock=time.monotonic):
+        self.default_ttl = default_ttl
+        self.clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader, ttl=None):
+        """Return the value for ``key``, calling ``loader()`` if it is missing
+        or expired."""
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                return entry[0]
+        value = loader()
+        expires = now + (self.default_ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires)
+        return value
+
+    def invalidate(self, key=None):
+        """Drop ``key``, or every entry when no key is given."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+cache = TTLCache()
+
+
+def cached(key, loader, ttl=None):
+    """Look ``key`` up in the module-wide cache."""
+    return cache.get(key, loader, ttl)
+
+
+def invalidate(key=None):
+    """Invalidate ``key`` (or everything) in the module-wide cache."""
+    cache.invalidate(key)
+
+
+def endpoint_key(prefix=ENDPOINT_PREFIX):
+    return "endpoint:{}".format(prefix)
+
+
+def find_endpoint(sagemaker_client, prefix=ENDPOINT_PREFIX, ttl=None):
+    """Return the name of the newest endpoint starting with ``prefix``.
+
+    Walks every page of ``list_endpoints``; returns None if there is none.
+    """
+
+    def load():
+        paginator = sagemaker_client.get_paginator("list_endpoints")
+        pages = paginator.paginate(
+            NameContains=prefix, SortBy="CreationTime", SortOrder="Descending"
+        )
+        for page in pages:
+            for endpoint in page["Endpoints"]:
+                if endpoint["EndpointName"].startswith(prefix):
+                    return endpoint["EndpointName"]
+        return None
+
+    return cached(endpoint_key(prefix), load, ttl)
@@ -1,34 +1,136 @@
-import os
 import logging
-import boto3
+import os
 import time
+from archive_reader import iter_documents, list_archive_partitions
+from lazy_client import LazyClient
+from metrics import Metrics
+from orchestrator import GlueOrchestrator, TableStateStore
 
 logger = logging.Logger(__name__)
-glue_client = boto3.client("glue")
+
+metrics = Metrics("StartGlueJobFunction")
+dynamodb_client = LazyClient("dynamodb")
+glue_client = LazyClient("glue")
+s3_client = LazyClient("s3")
 JOB_NAME = os.environ.get("JOB_NAME")
 CRAWLER_NAME = os.environ.get("CRAWLER_NAME")
-CRAWL_TIMEOUT = 800
-CRAWL_WAIT_INTERVAL = 30
+ARCHIVE_BUCKET = os.environ.get("ARCHIVE_BUCKET")
+DATABASE_NAME = os.environ.get("DATABASE_NAME")
+TABLE_NAME = os.environ.get("TABLE_NAME")
+STATE_TABLE_NAME = os.environ.get("STATE_TABLE_NAME")
+CRAWL_TIMEOUT = int(os.environ.get("CRAWL_TIMEOUT_SECONDS", "1800"))
+JOB_TIMEOUT = int(os.environ.get("JOB_TIMEOUT_SECONDS", "7200"))
+MAX_ATTEMPTS = int(os.environ.get("MAX_ATTEMPTS", "3"))
+# Time the partition check may take before the run falls back to a crawl,
+# and how many assets it lists at once.
+LISTING_BUDGET = float(os.environ.get("LISTING_BUDGET_SECONDS", "20"))
+LISTING_WORKERS = int(os.environ.get("LISTING_WORKERS", "16"))
+
+
+def catalog_partitions(since_date):
+    paginator = glue_client.get_paginator("get_partitions")
+    pages = paginator.paginate(
+        DatabaseName=DATABASE_NAME,
+        TableName=TABLE_NAME,
+        Expression="dt >= '{}'".format(since_date),
+    )
+    for page in pages:
+        for partition in page["Partitions"]:
+            yield tuple(partition["Values"])
+
+
+def archived_fields(partition):
+    """Top-level fields of the first document archived in ``partition``."""
+    prefix = "asset={}/dt={}/hour={}/".format(*partition)
+    listing = s3_client.list_objects_v2(Bucket=ARCHIVE_BUCKET, Prefix=prefix, MaxKeys=1)
+    for item in listing.get("Contents", []):
+        body = s3_client.get_object(Bucket=ARCHIVE_BUCKET, Key=item["Key"])["Body"]
+        try:
+            for document in iter_documents(body):
+                return {field.lower() for field in document}
+        finally:
+            body.close()
+    return set()
+
 
+def _find_new_partitions(deadline):
+    crawler = glue_client.get_crawler(Name=CRAWLER_NAME)["Crawler"]
+    last_crawl = crawler.get("LastCrawl")
+    if not last_crawl or last_crawl["Status"] != "SUCCEEDED":
+        return None
+    table = glue_client.get_table(DatabaseName=DATABASE_NAME, Name=TABLE_NAME)
+    partition_keys = [key["Name"] for key in table["Table"].get("PartitionKeys", [])]
+    if "dt" not in partition_keys:
+        # The archive is not partitioned (PartitionArchive false).
+        return None
+    since_date = last_crawl["StartTime"].strftime("%Y-%m-%d")
+    known = set(catalog_partitions(since_date))
+    archived = list_archive_partitions(
+        s3_client, ARCHIVE_BUCKET, since_date, deadline, LISTING_WORKERS
+    )
+    new = [partition for partition in archived if partition not in known]
+    if new:
+        descriptor = table["Table"].get("StorageDescriptor", {})
+        columns = {column["Name"] for column in descriptor.get("Columns", [])}
+        newest = max(new, key=lambda partition: partition[1:])
+        added = archived_fields(newest) - columns
+        if added:
+            logger.warning(
+                "Archive fields missing from the catalog, crawling: {}".format(
+                    ", ".join(sorted(added))
+                )
+            )
+            metrics.count("schema_changes")
+            return None
+    return new
 
+
+def new_partitions():
+    """Archive partitions written since the last crawl that the catalog does
+    not know yet, or None when a full crawl is needed.
+
+    A crawl is also needed when the newest new partition holds fields the
+    catalog table lacks. The incremental crawler (IncrementalCrawl stack
+    parameter) only logs such schema changes, so the table keeps its
+    columns, and every run crawls, until a crawl with IncrementalCrawl off
+    applies them. Crawling is always safe, so a check that fails or runs
+    out of LISTING_BUDGET returns None rather than holding up the run.
+    """
+    try:
+        return _find_new_partitions(time.monotonic() + LISTING_BUDGET)
+    except Exception as error:
+        logger.warning("Partition check failed, crawling: {!r}".format(error))
+        return None
+
+
+orchestrator = GlueOrchestrator(
+    glue_client,
+    TableStateStore(dynamodb_client, STATE_TABLE_NAME),
+    CRAWLER_NAME,
+    JOB_NAME,
+    CRAWL_TIMEOUT,
+    JOB_TIMEOUT,
+    MAX_ATTEMPTS,
+    new_partitions=new_partitions,
+)
+
+
+@metrics.instrument
 def handler(event, context):
-    logger.debug("Starting Crawler")
-    glue_client.start_crawler(Name=CRAWLER_NAME)
-    elapsed_time = 0
-    crawler_status = None
-    crawler_succeeded = False
-    while not crawler_status != "running" and elapsed_time < CRAWL_TIMEOUT:
-        time.sleep(CRAWL_WAIT_INTERVAL)
-        response = glue_client.get_crawler(Name=CRAWLER_NAME)
-        crawler_status = response["State"].lower()
-        elapsed_time += CRAWL_WAIT_INTERVAL
-        if (
-            crawler_status == "ready"
-            and response["LastCrawl"]["Status"].lower() == "succeeded"
-        ):
-            crawler_succeeded = True
-
-    if crawler_succeeded:
-        response = glue_client.start_job_run(JobName=JOB_NAME)
+    """Advance the crawler/job run for a schedule, watchdog or Glue event.
+
+    Each invocation makes at most a few Glue calls and returns; completion is
+    signalled by the next state change event rather than polled for.
+    """
+    detail_type = event.get("detail-type")
+    metrics.set_property("EventType", detail_type or event.get("action"))
+    if detail_type == "Glue Crawler State Change":
+        state = orchestrator.on_crawler_event(event["detail"])
+    elif detail_type == "Glue Job State Change":
+        state = orchestrator.on_job_event(event["detail"])
+    elif event.get("action") == "check":
+        state = orchestrator.check()
     else:
-        logger.debug("Crawler did not succeeed")
+        state = orchestrator.start_run()
+    metrics.debug("Run state: {}", state)
+    return state
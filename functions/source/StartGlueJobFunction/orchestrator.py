@@ -0,0 +1,271 @@
+"""Event-driven orchestration of the ingest crawler and the Glue job.
+
+A run moves through ``CRAWLING`` and ``JOB_RUNNING`` to ``SUCCEEDED`` or
+``FAILED``. Every transition is driven by an event (the daily schedule, a
+crawler or job state change) or by the periodic watchdog, and is persisted in
+a small JSON state record, so no invocation waits on Glue. A stage that fails
+or exceeds its timeout is retried up to ``max_attempts`` times.
+
+Events and the watchdog can act on the same state at once. The record is
+written with a conditional put, and every transition is saved before the
+crawler or job is started, so only the invocation whose write wins starts
+it; the others return the state as the winner left it.
+"""
+import functools
+import json
+import logging
+import time
+
+logger = logging.Logger(__name__)
+
+CRAWLING = "CRAWLING"
+JOB_RUNNING = "JOB_RUNNING"
+SUCCEEDED = "SUCCEEDED"
+FAILED = "FAILED"
+ACTIVE_STATES = (CRAWLING, JOB_RUNNING)
+
+JOB_FAILED_STATES = ("FAILED", "TIMEOUT", "STOPPED", "ERROR")
+JOB_ACTIVE_STATES = ("STARTING", "RUNNING", "WAITING")
+# A job claimed this long ago without a run id was never started, e.g. the
+# invocation that claimed it failed; longer than the function timeout.
+START_TIMEOUT = 300
+
+
+def _error_code(error):
+    return getattr(error, "response", {}).get("Error", {}).get("Code")
+
+
+class StateConflict(Exception):
+    """The state record changed since it was loaded."""
+
+
+class TableStateStore:
+    """Keeps the run state record as JSON in a DynamoDB item.
+
+    ``save`` only succeeds if the item is still at the version ``load`` or
+    the previous ``save`` saw, and raises ``StateConflict`` otherwise.
+    """
+
+    def __init__(self, dynamodb_client, table_name, name="glue-run"):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+        self.name = name
+        self.version = 0
+
+    def load(self):
+        item = self.dynamodb_client.get_item(
+            TableName=self.table_name,
+            Key={"name": {"S": self.name}},
+            ConsistentRead=True,
+        ).get("Item")
+        if item is None:
+            self.version = 0
+            return {}
+        self.version = int(item["version"]["N"])
+        return json.loads(item["state"]["S"])
+
+    def save(self, state):
+        condition = {"ConditionExpression": "attribute_not_exists(#name)"}
+        if self.version:
+            condition = {
+                "ConditionExpression": "version = :version",
+                "ExpressionAttributeValues": {":version": {"N": str(self.version)}},
+            }
+        else:
+            condition["ExpressionAttributeNames"] = {"#name": "name"}
+        try:
+            self.dynamodb_client.put_item(
+                TableName=self.table_name,
+                Item={
+                    "name": {"S": self.name},
+                    "version": {"N": str(self.version + 1)},
+                    "state": {"S": json.dumps(state)},
+                },
+                **condition,
+            )
+        except Exception as error:
+            if _error_code(error) == "ConditionalCheckFailedException":
+                raise StateConflict(self.name)
+            raise
+        self.version += 1
+
+
+def _yield_on_conflict(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except StateConflict:
+            logger.info("Run state changed concurrently, leaving it as it is")
+            return self.store.load()
+
+    return wrapper
+
+
+class GlueOrchestrator:
+    """Start, advance and recover crawler/job runs without blocking.
+
+    ``new_partitions`` is a callable returning the archive partitions missing
+    from the catalog, or None when a full crawl is needed; when it returns an
+    empty list the crawler is skipped.
+    """
+
+    def __init__(
+        self,
+        glue_client,
+        store,
+        crawler_name,
+        job_name,
+        crawl_timeout,
+        job_timeout,
+        max_attempts,
+        new_partitions=None,
+        clock=time.time,
+    ):
+        self.glue_client = glue_client
+        self.store = store
+        self.crawler_name = crawler_name
+        self.job_name = job_name
+        self.crawl_timeout = crawl_timeout
+        self.job_timeout = job_timeout
+        self.max_attempts = max_attempts
+        self.new_partitions = new_partitions or (lambda: None)
+        self.clock = clock
+
+    @_yield_on_conflict
+    def start_run(self):
+        """Begin a new run unless one is still in progress."""
+        state = self.check()
+        if state.get("status") in ACTIVE_STATES:
+            logger.info("Run {} still {}".format(state["run_id"], state["status"]))
+            return state
+        now = self.clock()
+        state = {"run_id": str(int(now)), "started_at": now}
+        if self.new_partitions() == []:
+            # The job bookmark still picks up new files in known partitions.
+            logger.debug("No new partitions, skipping crawler")
+            return self._start_job(state, attempts=1)
+        return self._start_crawl(state, attempts=1)
+
+    @_yield_on_conflict
+    def on_crawler_event(self, detail):
+        """Handle a ``Glue Crawler State Change`` event."""
+        state = self.store.load()
+        if (
+            detail.get("crawlerName") != self.crawler_name
+            or state.get("status") != CRAWLING
+        ):
+            return state
+        if detail.get("state") == "Succeeded":
+            return self._start_job(state, attempts=1)
+        if detail.get("state") == "Failed":
+            return self._retry(state, "crawler failed")
+        return state
+
+    @_yield_on_conflict
+    def on_job_event(self, detail):
+        """Handle a ``Glue Job State Change`` event."""
+        state = self.store.load()
+        if (
+            detail.get("jobName") != self.job_name
+            or state.get("status") != JOB_RUNNING
+            or detail.get("jobRunId") != state.get("job_run_id")
+        ):
+            return state
+        return self._job_finished(state, detail.get("state"))
+
+    @_yield_on_conflict
+    def check(self):
+        """Recover runs whose completion event was missed or that timed out."""
+        state = self.store.load()
+        status = state.get("status")
+        if status not in ACTIVE_STATES:
+            return state
+        elapsed = self.clock() - state["updated_at"]
+        if status == CRAWLING:
+            crawler = self.glue_client.get_crawler(Name=self.crawler_name)["Crawler"]
+            last_crawl = crawler.get("LastCrawl") or {}
+            started = last_crawl.get("StartTime")
+            finished = (
+                crawler["State"] == "READY"
+                and started is not None
+                and started.timestamp() >= state["crawl_requested_at"]
+            )
+            if finished and last_crawl.get("Status") == "SUCCEEDED":
+                return self._start_job(state, attempts=1)
+            if finished or elapsed > self.crawl_timeout:
+                return self._retry(state, "crawler did not succeed")
+            return state
+        if state.get("job_run_id") is None:
+            if elapsed > START_TIMEOUT:
+                return self._retry(state, "job did not start")
+            return state
+        run = self.glue_client.get_job_run(
+            JobName=self.job_name, RunId=state["job_run_id"]
+        )["JobRun"]
+        if run["JobRunState"] in ("SUCCEEDED",) + JOB_FAILED_STATES:
+            return self._job_finished(state, run["JobRunState"])
+        if elapsed > self.job_timeout:
+            self.glue_client.batch_stop_job_run(
+                JobName=self.job_name, JobRunIds=[state["job_run_id"]]
+            )
+            return self._retry(state, "job timed out")
+        return state
+
+    def _job_finished(self, state, job_state):
+        if job_state == "SUCCEEDED":
+            return self._save(state, SUCCEEDED)
+        if job_state in JOB_FAILED_STATES:
+            return self._retry(state, "job {}".format(job_state.lower()))
+        return state
+
+    def _retry(self, state, reason):
+        logger.info("Run {}: {}".format(state["run_id"], reason))
+        attempts = state["attempts"] + 1
+        if attempts > self.max_attempts:
+            state["error"] = reason
+            return self._save(state, FAILED)
+        if state["status"] == CRAWLING:
+            return self._start_crawl(state, attempts)
+        return self._start_job(state, attempts)
+
+    def _start_crawl(self, state, attempts):
+        state["crawl_requested_at"] = self.clock()
+        state["attempts"] = attempts
+        # Claim the transition first; a conflict means another invocation
+        # starts the crawl. If starting fails, the watchdog retries the
+        # crawl once it times out.
+        self._save(state, CRAWLING)
+        try:
+            self.glue_client.start_crawler(Name=self.crawler_name)
+        except Exception as error:
+            # A crawl started elsewhere still ends in a state change event.
+            if _error_code(error) != "CrawlerRunningException":
+                raise
+        return state
+
+    def _start_job(self, state, attempts):
+        state["job_run_id"] = None
+        state["attempts"] = attempts
+        self._save(state, JOB_RUNNING)
+        state["job_run_id"] = self._start_job_run()
+        return self._save(state, JOB_RUNNING)
+
+    def _start_job_run(self):
+        try:
+            return self.glue_client.start_job_run(JobName=self.job_name)["JobRunId"]
+        except Exception as error:
+            if _error_code(error) != "ConcurrentRunsExceededException":
+                raise
+        # A run started elsewhere, e.g. by hand; follow it instead.
+        runs = self.glue_client.get_job_runs(JobName=self.job_name, MaxResults=10)
+        for run in runs["JobRuns"]:
+            if run["JobRunState"] in JOB_ACTIVE_STATES:
+                return run["Id"]
+        raise RuntimeError("job {} is not running".format(self.job_name))
+
+    def _save(self, state, status):
+        state["status"] = status
+        state["updated_at"] = self.clock()
+        self.store.save(state)
+        return state
@@ -1,12 +1,35 @@
+import logging
 import os
-import boto3
-import pandas as pd
-import sagemaker
-from sagemaker import RandomCutForest
+import time
+from concurrent.futures import ThreadPoolExecutor
+from rcf_local import MODEL_FILE_NAME, LocalRandomCutForest
+from model_registry import (
+    GLOBAL,
+    REGISTRY_FILE_NAME,
+    ModelRegistry,
+    segment_model_key,
+    segment_of,
+)
+from archive_reader import event_object_key
+from lazy_client import LazyClient
+from metrics import Metrics
+from ttl_cache import endpoint_key, find_endpoint, invalidate
+from training_data import (
+    asset_of,
+    combine,
+    fingerprint,
+    list_parquet_objects,
+    load_sample,
+    upload_recordio,
+)
+from training_gate import TrainingGate, summarize
 
+logger = logging.Logger(__name__)
+metrics = Metrics("StartMLTrainingDeploymentFunction")
 
 ROLE_ARN = os.getenv("ROLE_ARN")
 INPUT_DATA_PREFIX = "combined"
+FEATURES = ["volts", "amps", "watts", "power_factor", "watt_hours"]
 MODEL_OUTPUT_PREFIX = os.getenv("MODEL_OUTPUT_PREFIX")
 SAMPLES_PER_TREE = 5
 NUM_OF_TREES = 50
@@ -14,29 +37,80 @@ INSTANCE_TYPE = "ml.c5.xlarge"
 INSTANCE_COUNT = 1
 INFERENCE_INSTANCE = "ml.t2.medium"
 INFERENCE_INSTANCE_COUNT = 1
+# Rows kept for training; 1M rows of float32 features is about 20 MB.
+TRAINING_SAMPLE_SIZE = int(os.getenv("TRAINING_SAMPLE_SIZE", "1000000"))
+# "uniform" samples all rows alike; "stratified" keeps an equal share per asset.
+TRAINING_SAMPLING = os.getenv("TRAINING_SAMPLING", "uniform")
+TRAINING_CHANNEL_KEY = "training/train.rec"
+# Retrain only when a feature's mean or quantiles moved by more than this
+# many standard deviations, or when the model is older than the max age.
+DRIFT_THRESHOLD = float(os.getenv("DRIFT_THRESHOLD", "0.25"))
+MODEL_MAX_AGE = int(os.getenv("MODEL_MAX_AGE_SECONDS", str(7 * 86400)))
+# "global" trains one forest for the fleet; "asset" adds a forest per asset and
+# "group" one per SEGMENT_COUNT hash groups of assets, routed by the registry.
+SEGMENTATION = os.getenv("SEGMENTATION", GLOBAL)
+SEGMENT_COUNT = int(os.getenv("SEGMENT_COUNT", "8"))
+# Segments with fewer rows are left to the global model.
+MIN_SEGMENT_ROWS = int(os.getenv("MIN_SEGMENT_ROWS", "100"))
+TRAINING_WORKERS = int(os.getenv("TRAINING_WORKERS", "4"))
+# Rows per shingle; the inference function must use the same SHINGLE_SIZE.
+SHINGLE_SIZE = int(os.getenv("SHINGLE_SIZE", "1"))
+# The inference function's engine. Only "local" reads the global local
+# forest; segment forests are trained either way and endpoint mode falls back
+# to the endpoint.
+SCORING_ENGINE = os.getenv("SCORING_ENGINE", "endpoint")
 
-s3_client = boto3.client("s3")
-sagemaker_client = boto3.client("sagemaker")
+s3_client = LazyClient("s3")
+sagemaker_client = LazyClient("sagemaker")
 
 
+@metrics.instrument
 def handler(event, context):
-    file_name = event["Records"][0]["s3"]["object"]["key"]
+    file_name = event_object_key(event["Records"][0])
     s3_bucket = event["Records"][0]["s3"]["bucket"]["name"]
-    training_data = input_data(file_name, s3_bucket)
-    inference_endpoint = create_model(training_data, s3_bucket)
+    # file_name is the _SUCCESS marker the Glue job writes next to its
+    # partitioned Parquet output.
+    prefix = file_name.rsplit("/", 1)[0] + "/"
+    with metrics.timer("list"):
+        objects = list(list_parquet_objects(s3_client, s3_bucket, prefix))
+    input_fingerprint = fingerprint(objects)
+    gate = TrainingGate(
+        s3_client, s3_bucket, MODEL_OUTPUT_PREFIX, DRIFT_THRESHOLD, MODEL_MAX_AGE
+    )
+    model_exists = find_endpoint(sagemaker_client) is not None
+    decision = gate.skip_unchanged(input_fingerprint, model_exists)
+    if decision is not None:
+        metrics.set_property("Retrain", False)
+        gate.record(decision, None)
+        return None
+    with metrics.timer("load_sample"):
+        samples = input_data(prefix, objects, s3_bucket)
+        training_data = combine(samples, len(FEATURES) * SHINGLE_SIZE)
+    metrics.count("rows", len(training_data))
+    with metrics.timer("summarize"):
+        summary = summarize(training_data, FEATURES)
+    decision = gate.decide(summary, input_fingerprint, model_exists=model_exists)
+    metrics.set_property("Retrain", decision["retrain"])
+    if not decision["retrain"]:
+        gate.record(decision, summary)
+        return None
+    with metrics.timer("train"):
+        with ThreadPoolExecutor(max_workers=TRAINING_WORKERS) as executor:
+            # Segment forests grow while the SageMaker training job runs.
+            segment_models = train_segments(executor, samples, s3_bucket)
+            inference_endpoint = create_model(training_data, s3_bucket)
+            save_registry(segment_models, s3_bucket)
+    gate.record(decision, summary)
     return inference_endpoint
 
 
 def create_model(training_data, s3_bucket):
-    session = sagemaker.Session()
-    endpoints = sagemaker_client.list_endpoints()["Endpoints"]
-    endpoint_exists = False
-    existing_endpoint_name = ""
-    for e in endpoints:
-        if e["EndpointName"].startswith("randomcutforest"):
-            existing_endpoint_name = e["EndpointName"]
-            endpoint_exists = True
-            break
+    # The SageMaker SDK takes seconds to import; runs the training gate
+    # turns away never load it.
+    from sagemaker import RandomCutForest
+    from sagemaker.amazon.amazon_estimator import RecordSet
+
+    existing_endpoint_name = find_endpoint(sagemaker_client)
     rcf = RandomCutForest(
         role=ROLE_ARN,
         instance_count=INSTANCE_COUNT,
@@ -46,31 +120,87 @@ def create_model(training_data, s3_bucket):
         num_samples_per_tree=SAMPLES_PER_TREE,
         num_trees=NUM_OF_TREES,
     )
-    numpy_data = training_data.to_numpy()
-    record_set = rcf.record_set(numpy_data, channel="train", encrypt=False)
+    s3_data = upload_recordio(
+        s3_client,
+        training_data,
+        s3_bucket,
+        "{}/{}".format(MODEL_OUTPUT_PREFIX, TRAINING_CHANNEL_KEY),
+    )
+    record_set = RecordSet(
+        s3_data,
+        num_records=len(training_data),
+        feature_dim=training_data.shape[1],
+        s3_data_type="S3Prefix",
+        channel="train",
+    )
     rcf.fit(record_set)
-    if endpoint_exists:
+    if SCORING_ENGINE == "local":
+        save_local_model(training_data, s3_bucket)
+    if existing_endpoint_name:
         response = update_model(rcf, existing_endpoint_name)
     else:
         response = deploy_model(rcf)
+        invalidate(endpoint_key())
     return response
 
 
+def save_local_model(numpy_data, s3_bucket):
+    # SageMaker's RCF artifact cannot be loaded outside the algorithm
+    # container, so the inference function's local engine gets its own forest
+    # grown from the same data and hyperparameters.
+    forest = LocalRandomCutForest.fit(
+        numpy_data, num_trees=NUM_OF_TREES, samples_per_tree=SAMPLES_PER_TREE
+    )
+    s3_client.put_object(
+        Bucket=s3_bucket,
+        Key="{}/{}".format(MODEL_OUTPUT_PREFIX, MODEL_FILE_NAME),
+        Body=forest.dumps(),
+    )
+
+
+def train_segments(executor, samples, s3_bucket):
+    """Submit one forest per segment sample to ``executor``.
+
+    Returns ``{segment: future}``; each future resolves to the forest's key.
+    """
+    if SEGMENTATION == GLOBAL:
+        return {}
+    version = str(int(time.time()))
+
+    def train(segment, data):
+        forest = LocalRandomCutForest.fit(
+            data, num_trees=NUM_OF_TREES, samples_per_tree=SAMPLES_PER_TREE
+        )
+        key = segment_model_key(MODEL_OUTPUT_PREFIX, version, segment)
+        s3_client.put_object(Bucket=s3_bucket, Key=key, Body=forest.dumps())
+        return key
+
+    return {
+        segment: executor.submit(train, segment, data)
+        for segment, data in samples.items()
+        if segment is not None and len(data) >= MIN_SEGMENT_ROWS
+    }
+
+
+def save_registry(segment_models, s3_bucket):
+    models = {segment: future.result() for segment, future in segment_models.items()}
+    registry = ModelRegistry(
+        SEGMENTATION, SEGMENT_COUNT, version=str(int(time.time())), models=models
+    )
+    s3_client.put_object(
+        Bucket=s3_bucket,
+        Key="{}/{}".format(MODEL_OUTPUT_PREFIX, REGISTRY_FILE_NAME),
+        Body=registry.dumps(),
+    )
+    logger.info("Registered {} segment models".format(len(models)))
+
+
 def deploy_model(rcf):
     rcf_inference = rcf.deploy(
         initial_instance_count=INFERENCE_INSTANCE_COUNT,
         instance_type=INFERENCE_INSTANCE,
         wait=False,
     )
-    endpoints = sagemaker_client.list_endpoints()
-    endpoint_exists = False
-    existing_endpoint_name = ""
-    for e in endpoints:
-        if e["EndpointName"].startswith("randomcutforest"):
-            existing_endpoint_name = e["EndpointName"]
-            endpoint_exists = True
-            break
-
     return rcf_inference
 
 
@@ -85,10 +215,29 @@ def update_model(rcf, endpoint_name):
     return rcf_inference
 
 
-def input_data(file_name, s3_bucket):
-    file_object_data = s3_client.get_object(Bucket=s3_bucket, Key=file_name)
+def input_data(prefix, objects, s3_bucket):
+    if SEGMENTATION != GLOBAL:
+
+        def stratify(key):
+            return segment_of(asset_of(key), SEGMENTATION, SEGMENT_COUNT)
 
-    train_data = pd.read_csv(
-        file_object_data["Body"], parse_dates=["timestamp"], delimiter=","
-    ).set_index("timestamp")
-    return train_data
+    elif TRAINING_SAMPLING == "stratified":
+        stratify = asset_of
+    else:
+        stratify = None
+    samples, rows_seen, _ = load_sample(
+        s3_client,
+        s3_bucket,
+        prefix,
+        FEATURES,
+        TRAINING_SAMPLE_SIZE,
+        stratify,
+        shingle_size=SHINGLE_SIZE,
+        objects=objects,
+    )
+    logger.info(
+        "Sampled {} of {} training rows in {} strata".format(
+            sum(len(sample) for sample in samples.values()), rows_seen, len(samples)
+        )
+    )
+    return samples
@@ -0,0 +1,195 @@
+"""Memory-bounded loading of the Glue output for model training.
+
+The combined dataset is read one Parquet row group batch at a time, as
+float32, and only a fixed-size sample of it is kept: either a uniform
+reservoir over all rows or one reservoir per asset. Peak memory therefore
+depends on the sample size and batch size, not on the size of the dataset.
+"""
+import hashlib
+import tempfile
+
+import numpy as np
+import pyarrow.parquet as pq
+
+BATCH_SIZE = 65536
+# Rows written per RecordIO chunk when uploading the training channel.
+RECORDIO_CHUNK_ROWS = 65536
+ASSET_PARTITION = "asset_id="
+
+
+class Reservoir:
+    """Uniform sample of at most ``size`` rows over a stream of batches."""
+
+    def __init__(self, size, num_features, rng):
+        self.size = size
+        self.rng = rng
+        self.rows = np.empty((size, num_features), dtype=np.float32)
+        self.seen = 0
+
+    def add(self, batch):
+        count = len(batch)
+        filled = min(max(self.size - self.seen, 0), count)
+        if filled:
+            self.rows[self.seen : self.seen + filled] = batch[:filled]
+        if filled < count:
+            # Algorithm R for the rest of the batch: row i replaces a random
+            # slot with probability size / (i + 1). Later rows win duplicate
+            # slots, as they would when added one at a time.
+            positions = np.arange(self.seen + filled, self.seen + count) + 1
+            slots = (self.rng.random(count - filled) * positions).astype(np.int64)
+            keep = slots < self.size
+            self.rows[slots[keep]] = batch[filled:][keep]
+        self.seen += count
+
+    def sample(self):
+        return self.rows[: min(self.seen, self.size)]
+
+
+class StratifiedSample:
+    """One reservoir per stratum (an asset or a segment of assets), splitting
+    ``size`` rows evenly."""
+
+    def __init__(self, size, num_features, strata, rng):
+        per_stratum = max(size // max(len(strata), 1), 1)
+        self.reservoirs = {
+            stratum: Reservoir(per_stratum, num_features, rng) for stratum in strata
+        }
+
+    def add(self, batch, stratum):
+        self.reservoirs[stratum].add(batch)
+
+    @property
+    def seen(self):
+        return sum(r.seen for r in self.reservoirs.values())
+
+    def samples(self):
+        return {stratum: r.sample() for stratum, r in self.reservoirs.items()}
+
+
+def shingle(batch, carry, size):
+    """Concatenate each row with the ``size - 1`` rows before it.
+
+    ``carry`` holds the last rows of the previous batch of the same object,
+    so shingles span batch boundaries. Returns ``(shingles, carry)``.
+    """
+    rows = np.concatenate([carry, batch]) if len(carry) else batch
+    width = rows.shape[1]
+    if len(rows) < size:
+        return np.empty((0, width * size), dtype=rows.dtype), rows
+    windows = np.lib.stride_tricks.sliding_window_view(rows, (size, width))[:, 0]
+    return windows.reshape(len(windows), width * size), rows[len(rows) - size + 1 :]
+
+
+def asset_of(key):
+    """Return the ``asset_id`` partition value of an output key, or None."""
+    for part in key.split("/"):
+        if part.startswith(ASSET_PARTITION):
+            return part[len(ASSET_PARTITION) :]
+    return None
+
+
+def list_parquet_objects(s3_client, bucket, prefix):
+    """Yield ``(key, etag)`` for every Parquet object below ``prefix``."""
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get("Contents", []):
+            if item["Key"].endswith(".parquet"):
+                yield item["Key"], item["ETag"]
+
+
+def fingerprint(objects):
+    """Digest of ``(key, etag)`` pairs; equal datasets share a fingerprint
+    without their contents being read."""
+    digest = hashlib.sha256()
+    for key, etag in sorted(objects):
+        digest.update("{}\0{}\n".format(key, etag).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def iter_feature_batches(s3_client, bucket, key, columns, batch_size=BATCH_SIZE):
+    """Yield float32 arrays of ``columns`` from one Parquet object.
+
+    The object is streamed to a temporary file, since Parquet needs random
+    access to its footer, and read back one batch at a time. Rows with
+    missing values are dropped.
+    """
+    with tempfile.TemporaryFile() as local_file:
+        s3_client.download_fileobj(bucket, key, local_file)
+        local_file.seek(0)
+        parquet_file = pq.ParquetFile(local_file)
+        for record_batch in parquet_file.iter_batches(
+            batch_size=batch_size, columns=columns
+        ):
+            batch = np.column_stack(
+                [
+                    column.to_numpy(zero_copy_only=False).astype(np.float32)
+                    for column in record_batch.columns
+                ]
+            )
+            yield batch[~np.isnan(batch).any(axis=1)]
+
+
+def load_sample(
+    s3_client,
+    bucket,
+    prefix,
+    columns,
+    sample_size,
+    stratify=None,
+    shingle_size=1,
+    seed=None,
+    objects=None,
+):
+    """Sample at most ``sample_size`` rows of ``columns`` below ``prefix``.
+
+    Without ``stratify`` the sample is uniform over all rows. Otherwise
+    ``stratify`` maps each object key to its stratum, e.g. ``asset_of``, and
+    every stratum gets an equal share of the sample. With ``shingle_size``
+    above 1 each sampled row is a shingle of consecutive rows of one object;
+    the Glue job writes each asset's rows sorted by timestamp. ``objects``
+    are the ``list_parquet_objects`` of ``prefix``, when already listed.
+
+    Returns ``(samples, rows_seen, fingerprint)`` where ``samples`` maps each
+    stratum (None when unstratified) to its rows.
+    """
+    rng = np.random.default_rng(seed)
+    if objects is None:
+        objects = list(list_parquet_objects(s3_client, bucket, prefix))
+    strata = {key: stratify(key) if stratify else None for key, _ in objects}
+    width = len(columns) * shingle_size
+    sampler = StratifiedSample(
+        sample_size, width, sorted(set(strata.values()), key=str), rng
+    )
+    for key, _ in objects:
+        carry = np.empty((0, len(columns)), dtype=np.float32)
+        for batch in iter_feature_batches(s3_client, bucket, key, columns):
+            if shingle_size > 1:
+                batch, carry = shingle(batch, carry, shingle_size)
+            sampler.add(batch, strata[key])
+    return sampler.samples(), sampler.seen, fingerprint(objects)
+
+
+def combine(samples, num_features):
+    """Concatenate per-stratum samples into one array; a single stratum's
+    sample is returned as it is rather than copied."""
+    if not samples:
+        return np.empty((0, num_features), dtype=np.float32)
+    if len(samples) == 1:
+        return next(iter(samples.values()))
+    return np.concatenate(list(samples.values()))
+
+
+def upload_recordio(s3_client, data, bucket, key, chunk_rows=RECORDIO_CHUNK_ROWS):
+    """Write ``data`` as a RecordIO-protobuf training channel object.
+
+    Records are serialized a chunk at a time into a temporary file that is
+    then uploaded, so no serialized copy of the whole sample is held.
+    """
+    from sagemaker.amazon.common import write_numpy_to_dense_tensor
+
+    with tempfile.TemporaryFile() as local_file:
+        for start in range(0, len(data), chunk_rows):
+            write_numpy_to_dense_tensor(local_file, data[start : start + chunk_rows])
+        local_file.seek(0)
+        s3_client.upload_fileobj(local_file, bucket, key)
+    return "s3://{}/{}".format(bucket, key)
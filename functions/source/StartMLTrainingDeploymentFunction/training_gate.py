@@ -0,0 +1,161 @@
+"""Decide whether a new Glue output warrants retraining the model.
+
+Each trained model has a summary of its training data stored beside it:
+a fingerprint of the input objects plus per-feature mean, standard deviation
+and quantiles. A new dataset is summarized the same way. It is only trained
+on when its fingerprint differs and its distribution has drifted by more
+than ``threshold``, or when the model is older than ``max_age`` seconds.
+The fingerprint only needs a listing of the input, so ``skip_unchanged``
+turns away unchanged input before any of it is read.
+Every decision is written under ``training-runs/`` so skipped and performed
+runs can be compared.
+"""
+import json
+import logging
+import time
+
+import numpy as np
+
+logger = logging.Logger(__name__)
+
+STATS_KEY = "training-stats.json"
+RUNS_PREFIX = "training-runs"
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def summarize(sample, features):
+    """Per-feature mean, standard deviation and ``QUANTILES`` of a sample.
+
+    Only the first ``len(features)`` columns are read, i.e. the first row of
+    each shingle, and one column is copied at a time, so the summary needs a
+    fraction of the memory the sample takes.
+    """
+    sample = np.asarray(sample)
+    summary = {"rows": len(sample), "features": {}}
+    if not len(sample):
+        return summary
+    for index, name in enumerate(features):
+        column = sample[:, index].astype(np.float64)
+        summary["features"][name] = {
+            "mean": float(column.mean()),
+            "std": float(column.std()),
+            "quantiles": [float(q) for q in np.quantile(column, QUANTILES)],
+        }
+        del column
+    return summary
+
+
+def drift(previous, current):
+    """Largest shift of any feature's mean or quantiles, in units of the
+    feature's previous standard deviation. Missing features count as
+    infinite drift."""
+    score = 0.0
+    for name, before in previous["features"].items():
+        after = current["features"].get(name)
+        if after is None:
+            return float("inf")
+        scale = before["std"] or 1.0
+        shifts = [abs(after["mean"] - before["mean"])]
+        shifts.extend(
+            abs(a - b) for a, b in zip(after["quantiles"], before["quantiles"])
+        )
+        score = max(score, max(shifts) / scale)
+    return score
+
+
+class TrainingGate:
+    def __init__(self, s3_client, bucket, prefix, threshold, max_age, clock=time.time):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.threshold = threshold
+        self.max_age = max_age
+        self.clock = clock
+        self._previous = None
+        self._loaded = False
+
+    def _key(self, name):
+        return "{}/{}".format(self.prefix, name)
+
+    def previous(self):
+        """Return the stats stored with the current model, or None."""
+        if not self._loaded:
+            try:
+                response = self.s3_client.get_object(
+                    Bucket=self.bucket, Key=self._key(STATS_KEY)
+                )
+                self._previous = json.loads(response["Body"].read())
+            except Exception as error:
+                logger.debug("No previous training stats: {}".format(error))
+            self._loaded = True
+        return self._previous
+
+    def skip_unchanged(self, fingerprint, model_exists=True):
+        """Return a decision not to retrain when ``fingerprint`` is that of
+        the current model's input and the model is younger than ``max_age``,
+        otherwise None."""
+        previous = self.previous() if model_exists else None
+        if (
+            previous is None
+            or self.clock() - previous["trained_at"] > self.max_age
+            or fingerprint != previous["fingerprint"]
+        ):
+            return None
+        return {
+            "retrain": False,
+            "drift": 0.0,
+            "fingerprint": fingerprint,
+            "rows": previous["summary"]["rows"],
+            "threshold": self.threshold,
+            "reason": "unchanged input",
+        }
+
+    def decide(self, summary, fingerprint, model_exists=True):
+        """Return a decision dict with ``retrain``, ``reason`` and ``drift``."""
+        previous = self.previous() if model_exists else None
+        decision = {
+            "retrain": True,
+            "drift": None,
+            "fingerprint": fingerprint,
+            "rows": summary["rows"],
+            "threshold": self.threshold,
+        }
+        if previous is None:
+            decision["reason"] = "no previous model"
+        elif self.clock() - previous["trained_at"] > self.max_age:
+            decision["reason"] = "model older than {}s".format(self.max_age)
+        elif fingerprint == previous["fingerprint"]:
+            decision.update(retrain=False, drift=0.0, reason="unchanged input")
+        else:
+            decision["drift"] = drift(previous["summary"], summary)
+            if decision["drift"] > self.threshold:
+                decision["reason"] = "drift above threshold"
+            else:
+                decision.update(retrain=False, reason="drift below threshold")
+        return decision
+
+    def record(self, decision, summary):
+        """Store the decision and, for trained runs, the new model's stats."""
+        now = self.clock()
+        run = dict(decision, decided_at=now)
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self._key("{}/{}.json".format(RUNS_PREFIX, int(now * 1000))),
+            Body=json.dumps(run).encode("utf-8"),
+        )
+        if decision["retrain"]:
+            stats = {
+                "fingerprint": decision["fingerprint"],
+                "summary": summary,
+                "trained_at": now,
+            }
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=self._key(STATS_KEY),
+                Body=json.dumps(stats).encode("utf-8"),
+            )
+        logger.info(
+            "Retrain {}: {} (drift {})".format(
+                decision["retrain"], decision["reason"], decision["drift"]
+            )
+        )
@@ -0,0 +1,277 @@
+"""Batch transform of SiteWise property notifications for the archive stream.
+
+Each output record holds newline-terminated JSON documents, so archive
+objects are newline-delimited JSON. By default every notification becomes
+one document listing the values of one property. With a ``WideRowBuilder``
+the readings are instead grouped into one wide row per asset and timestamp,
+so consumers read feature rows without joining properties. When
+partitioning is enabled, records also carry the ``asset_id``, ``date`` and
+``hour`` keys used by Firehose dynamic partitioning.
+"""
+import base64
+import collections
+import datetime
+import json
+import time
+
+NUMERIC_TYPES = ("INTEGER", "DOUBLE")
+# Properties a wide row needs to be complete; matches the inference pivot and
+# the Glue job.
+FEATURES = ("volts", "amps", "watts", "power_factor", "watt_hours")
+# Wide rows are split across output records beyond this many bytes while
+# there are records to spare.
+MAX_RECORD_BYTES = 512 * 1024
+TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+# One day of distinct seconds; the cache is cleared when it fills up.
+TIMESTAMP_CACHE_SIZE = 86400
+
+_decode = json.JSONDecoder().decode
+_encode = json.JSONEncoder(separators=(",", ":")).encode
+
+
+class TimestampFormatter:
+    """Format epoch seconds as ``TIMESTAMP_FORMAT``, caching per second."""
+
+    def __init__(self, fmt=TIMESTAMP_FORMAT, max_size=TIMESTAMP_CACHE_SIZE):
+        self.fmt = fmt
+        self.max_size = max_size
+        self._cache = {}
+
+    def __call__(self, seconds):
+        formatted = self._cache.get(seconds)
+        if formatted is None:
+            if len(self._cache) >= self.max_size:
+                self._cache.clear()
+            formatted = datetime.datetime.fromtimestamp(seconds).strftime(self.fmt)
+            self._cache[seconds] = formatted
+        return formatted
+
+
+format_timestamp = TimestampFormatter()
+_partition_cache = {}
+
+
+def partition_keys(asset_id, seconds):
+    """Dynamic partitioning keys for a reading of ``asset_id`` (UTC)."""
+    hour_start = int(seconds) // 3600 * 3600
+    date_hour = _partition_cache.get(hour_start)
+    if date_hour is None:
+        if len(_partition_cache) >= TIMESTAMP_CACHE_SIZE:
+            _partition_cache.clear()
+        date_obj = datetime.datetime.utcfromtimestamp(hour_start)
+        date_hour = (date_obj.strftime("%Y-%m-%d"), date_obj.strftime("%H"))
+        _partition_cache[hour_start] = date_hour
+    return {"asset_id": asset_id, "date": date_hour[0], "hour": date_hour[1]}
+
+
+def _non_negative(value):
+    try:
+        return float(value) >= 0
+    except (TypeError, ValueError):
+        return False
+
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 3)
+
+
+class WideRowBuilder:
+    """Groups readings into ``{asset_id, timestamp, <property>...}`` rows.
+
+    A row is complete once it has every one of ``features``. Firehose may
+    split the readings of a row across batches; those rows are written
+    partial and merged by their readers (the Glue job and the inference
+    window store), so nothing is held back between batches.
+    """
+
+    def __init__(self, features=FEATURES):
+        self.features = frozenset(features)
+        # (asset_id, timestamp) -> (partition key, row), oldest first.
+        self.rows = collections.OrderedDict()
+
+    def add(self, asset_id, timestamp, name, value, key=None):
+        """Add a reading; a new row is written under partition ``key``."""
+        entry = self.rows.get((asset_id, timestamp))
+        if entry is None:
+            row = {"asset_id": asset_id, "timestamp": timestamp}
+            entry = self.rows[(asset_id, timestamp)] = (key, row)
+        # First reading wins when a property repeats for a timestamp.
+        entry[1].setdefault(name, value)
+
+    def is_complete(self, row):
+        return self.features.issubset(row)
+
+    def take(self):
+        """Remove and return every row as ``(key, row)``."""
+        rows = list(self.rows.values())
+        self.rows.clear()
+        return rows
+
+
+def _row_chunks(lines):
+    """Split encoded rows into chunks of up to MAX_RECORD_BYTES."""
+    chunk = []
+    size = 0
+    for line in lines:
+        if chunk and size + len(line) > MAX_RECORD_BYTES:
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(line)
+        size += len(line)
+    if chunk:
+        yield chunk
+
+
+def _write_rows(output, carriers, wide_rows, partitioned, stats):
+    """Write every row of ``wide_rows`` into the ``carriers`` records.
+
+    Firehose needs exactly one output record per input record, so the rows
+    replace the data of records that resolved, and records left without
+    rows are dropped; their readings are in the rows written. All rows of
+    a record share its partition keys. A row takes the keys of the record
+    that started it, so there is at least one record for every group.
+    """
+    groups = collections.OrderedDict()
+    for key, row in wide_rows.take():
+        groups.setdefault(key, []).append(row)
+
+    spare = len(carriers) - len(groups)
+    carriers = iter(carriers)
+    for key, rows in groups.items():
+        lines = [(_encode(row) + "\n").encode("utf-8") for row in rows]
+        stats["rows"] += len(rows)
+        stats["partial_rows"] += sum(
+            1 for row in rows if not wide_rows.is_complete(row)
+        )
+        chunks = list(_row_chunks(lines))
+        if len(chunks) > spare + 1:
+            chunks[spare:] = [[line for chunk in chunks[spare:] for line in chunk]]
+        spare -= len(chunks) - 1
+        for chunk in chunks:
+            output_record = output[next(carriers)]
+            output_record["result"] = "Ok"
+            output_record["data"] = base64.b64encode(b"".join(chunk)).decode("ascii")
+            if partitioned:
+                output_record["metadata"] = {"partitionKeys": dict(key)}
+
+
+def transform_batch(records, property_index, partitioned=False, wide_rows=False):
+    """Transform a list of Firehose records in one pass.
+
+    With ``wide_rows`` set, the readings are written as wide rows (see
+    ``WideRowBuilder``) instead of one document per notification.
+
+    Returns ``(output_records, stats)`` where stats holds record and value
+    counts and per-phase timings in milliseconds.
+    """
+    stats = {"records": len(records), "values": 0, "dropped_values": 0, "failed": 0}
+    if wide_rows:
+        wide_rows = WideRowBuilder()
+        stats.update(rows=0, partial_rows=0)
+
+    start = time.perf_counter()
+    decoded = [
+        _decode(base64.b64decode(record["data"]).decode("utf-8"))["payload"]
+        for record in records
+    ]
+    stats["decode_ms"] = _elapsed_ms(start)
+
+    start = time.perf_counter()
+    property_index.resolve(
+        (payload["assetId"], payload["propertyId"]) for payload in decoded
+    )
+    stats["resolve_ms"] = _elapsed_ms(start)
+
+    start = time.perf_counter()
+    output = []
+    carriers = []
+    for record, payload in zip(records, decoded):
+        property_id = payload["propertyId"]
+        resolved = property_index.get(property_id)
+        if resolved is None:
+            stats["failed"] += 1
+            output.append(
+                {
+                    "recordId": record["recordId"],
+                    "result": "ProcessingFailed",
+                    "data": record["data"],
+                }
+            )
+            continue
+        property_name, property_type = resolved
+        value_key = property_type.lower() + "Value"
+        numeric = property_type in NUMERIC_TYPES
+
+        raw_values = payload["values"]
+        kept = [
+            v
+            for v in raw_values
+            if not numeric or _non_negative(v["value"][value_key])
+        ]
+        stats["values"] += len(kept)
+        stats["dropped_values"] += len(raw_values) - len(kept)
+
+        asset_id = payload["assetId"]
+        if wide_rows:
+            name = property_name.lower()
+            key = None
+            if partitioned and kept:
+                seconds = kept[0]["timestamp"]["timeInSeconds"]
+                key = tuple(sorted(partition_keys(asset_id, seconds).items()))
+            for v in kept:
+                wide_rows.add(
+                    asset_id,
+                    format_timestamp(v["timestamp"]["timeInSeconds"]),
+                    name,
+                    v["value"][value_key],
+                    key,
+                )
+            # Records still without rows after _write_rows are dropped;
+            # their readings are in the rows of other records.
+            carriers.append(len(output))
+            output.append(
+                {
+                    "recordId": record["recordId"],
+                    "result": "Dropped",
+                    "data": record["data"],
+                }
+            )
+            continue
+
+        values = [
+            {
+                "timestamp": format_timestamp(v["timestamp"]["timeInSeconds"]),
+                "quality": v["quality"],
+                "value": v["value"][value_key],
+            }
+            for v in kept
+        ]
+        output_record_data = {
+            "name": property_name,
+            "property_id": property_id,
+            "property_type": property_type,
+            "asset_id": asset_id,
+            "values": values,
+        }
+        output_record = {
+            "recordId": record["recordId"],
+            "result": "Ok",
+            "data": base64.b64encode(
+                (_encode(output_record_data) + "\n").encode("utf-8")
+            ).decode("ascii"),
+        }
+        if partitioned:
+            seconds = (
+                raw_values[0]["timestamp"]["timeInSeconds"]
+                if raw_values
+                else time.time()
+            )
+            output_record["metadata"] = {
+                "partitionKeys": partition_keys(asset_id, seconds)
+            }
+        output.append(output_record)
+    if wide_rows:
+        _write_rows(output, carriers, wide_rows, partitioned, stats)
+    stats["transform_ms"] = _elapsed_ms(start)
+    return output, stats
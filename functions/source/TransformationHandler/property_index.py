@@ -0,0 +1,71 @@
+"""Property id lookup for SiteWise asset property notifications."""
+import logging
+import time
+
+logger = logging.Logger(__name__)
+
+
+class PropertyIndex:
+    """Maps SiteWise property ids to ``(name, dataType)`` across asset models.
+
+    The index is filled from ``describe_asset_model`` once per model. Unknown
+    property ids are resolved in batches: each unseen asset is described once
+    to find its model, and each unseen model is loaded once. Entries are
+    dropped after ``ttl`` seconds so renamed or new properties are picked up.
+    """
+
+    def __init__(self, sitewise_client, ttl, clock=time.monotonic):
+        self.sitewise_client = sitewise_client
+        self.ttl = ttl
+        self.clock = clock
+        self._reset()
+
+    def _reset(self):
+        self.properties = {}
+        self.models = {}
+        self.asset_models = {}
+        self.expires = self.clock() + self.ttl
+
+    def expire_if_stale(self):
+        if self.clock() >= self.expires:
+            self._reset()
+
+    def get(self, property_id):
+        """Return ``(name, dataType)`` for ``property_id`` or None."""
+        return self.properties.get(property_id)
+
+    def load_model(self, asset_model_id):
+        """Index every property of ``asset_model_id`` unless already loaded."""
+        if asset_model_id in self.models:
+            return
+        response = self.sitewise_client.describe_asset_model(
+            assetModelId=asset_model_id
+        )
+        model_properties = {}
+        for prop in response["assetModelProperties"]:
+            model_properties[prop["id"]] = (prop["name"], prop["dataType"])
+        self.models[asset_model_id] = model_properties
+        self.properties.update(model_properties)
+
+    def resolve(self, unknown):
+        """Load the models behind ``(asset_id, property_id)`` pairs that are
+        not indexed yet."""
+        asset_ids = {
+            asset_id
+            for asset_id, property_id in unknown
+            if property_id not in self.properties
+        }
+        for asset_id in asset_ids:
+            asset_model_id = self.asset_models.get(asset_id)
+            if asset_model_id is None:
+                try:
+                    asset_model_id = self.sitewise_client.describe_asset(
+                        assetId=asset_id
+                    )["assetModelId"]
+                except Exception as error:
+                    logger.debug(
+                        "Unable to describe asset {}: {}".format(asset_id, error)
+                    )
+                    continue
+                self.asset_models[asset_id] = asset_model_id
+            self.load_model(asset_model_id)